@@ -0,0 +1,248 @@
+"""
+Массовая рассылка сообщений с ограничением скорости (лимиты Telegram)
+"""
+import asyncio
+import enum
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterable, Iterable
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from backend.config import (
+    BROADCAST_RATE,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_CHAT_INTERVAL,
+    BROADCAST_MAX_RETRIES,
+)
+
+if TYPE_CHECKING:
+    from backend.bot.outbox import Outbox
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Глобальный token bucket.
+
+    Пополняется со скоростью rate токенов в секунду, вмещает не больше capacity.
+    Ожидающие получают токены строго по очереди (asyncio.Lock - FIFO).
+    pause() останавливает выдачу токенов всем - так обрабатывается RetryAfter.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    def pause(self, seconds: float):
+        """Приостановить выдачу токенов на seconds секунд"""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        # Токены, накопленные до паузы, сгорают - после паузы начинаем аккуратно
+        self._tokens = 0.0
+        self._updated_at = max(self._updated_at, self._paused_until)
+
+    async def acquire(self):
+        """Дождаться и забрать один токен"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastStats:
+    """Итоги одного запуска рассылки"""
+    name: str
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    # Переданы в очередь сообщений для повторной доставки
+    deferred: int = 0
+    retries: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float | None = None
+
+    @property
+    def duration(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Сообщений в секунду"""
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.name}: отправлено {self.sent}/{self.total}, ошибок {self.failed}, "
+            f"отложено {self.deferred}, "
+            f"повторов {self.retries}, за {self.duration:.1f} с ({self.throughput:.1f} msg/s)"
+        )
+
+
+class Delivery(enum.Enum):
+    """Итог отправки одного сообщения рассылки"""
+    SENT = "sent"
+    FAILED = "failed"
+    DEFERRED = "deferred"
+
+
+class Broadcaster:
+    """
+    Конкурентная рассылка через общий token bucket.
+
+    Сообщения - это словари с аргументами для bot.send_message.
+    Источник читается лениво через ограниченную очередь, поэтому
+    его можно отдавать потоком прямо из БД.
+    Сообщения, которые не удалось отправить из-за временной ошибки, передаются
+    в outbox (если он запущен) - там они повторяются с задержкой, а не теряются.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        rate: float = BROADCAST_RATE,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        chat_interval: float = BROADCAST_CHAT_INTERVAL,
+        max_retries: int = BROADCAST_MAX_RETRIES,
+        outbox: "Outbox | None" = None,
+        bucket: TokenBucket | None = None,
+    ):
+        self.bot = bot
+        self.outbox = outbox
+        # bucket передают, чтобы делить лимит токена бота с очередью сообщений
+        self.bucket = bucket if bucket is not None else TokenBucket(rate)
+        self.concurrency = concurrency
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+
+    async def broadcast(
+        self,
+        name: str,
+        messages: Iterable[dict] | AsyncIterable[dict],
+    ) -> BroadcastStats:
+        """Разослать сообщения и вернуть статистику"""
+        stats = BroadcastStats(name=name)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        # Время последней отправки в чат (в рамках одного запуска), от старых к новым;
+        # хранятся только чаты, для которых интервал еще не истек
+        chat_last_sent: OrderedDict[int, float] = OrderedDict()
+
+        workers = [
+            asyncio.create_task(self._worker(queue, stats, chat_last_sent))
+            for _ in range(self.concurrency)
+        ]
+
+        try:
+            if isinstance(messages, AsyncIterable):
+                async for message in messages:
+                    stats.total += 1
+                    await queue.put(message)
+            else:
+                for message in messages:
+                    stats.total += 1
+                    await queue.put(message)
+
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        stats.finished_at = time.monotonic()
+        if stats.total:
+            logger.info(f"Рассылка завершена - {stats}")
+        return stats
+
+    async def _worker(self, queue: asyncio.Queue, stats: BroadcastStats, chat_last_sent: OrderedDict[int, float]):
+        while True:
+            message = await queue.get()
+            try:
+                delivery = await self._send(message, stats, chat_last_sent)
+                if delivery is Delivery.SENT:
+                    stats.sent += 1
+                elif delivery is Delivery.DEFERRED:
+                    stats.deferred += 1
+                else:
+                    stats.failed += 1
+            finally:
+                queue.task_done()
+
+    async def _wait_chat_interval(self, chat_id: int, chat_last_sent: OrderedDict[int, float]):
+        """
+        Не чаще одного сообщения в chat_interval секунд в один чат.
+
+        Записи старше chat_interval больше ни на что не влияют и удаляются с начала
+        словаря - он не растет с размером рассылки.
+        """
+        last_sent = chat_last_sent.get(chat_id)
+        if last_sent is not None:
+            delay = last_sent + self.chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        now = time.monotonic()
+        chat_last_sent[chat_id] = now
+        chat_last_sent.move_to_end(chat_id)
+        while chat_last_sent:
+            oldest_chat, oldest_sent = next(iter(chat_last_sent.items()))
+            if oldest_sent + self.chat_interval > now:
+                break
+            del chat_last_sent[oldest_chat]
+
+    async def _defer(self, message: dict, stats: BroadcastStats) -> Delivery:
+        """Передать сообщение на повторную доставку в outbox (если он не запущен - ошибка)"""
+        if self.outbox is None or not self.outbox.running:
+            return Delivery.FAILED
+        await self.outbox.send(**message, kind=stats.name, durable=True)
+        return Delivery.DEFERRED
+
+    async def _send(self, message: dict, stats: BroadcastStats, chat_last_sent: OrderedDict[int, float]) -> Delivery:
+        chat_id = message['chat_id']
+
+        for _ in range(self.max_retries + 1):
+            await self._wait_chat_interval(chat_id, chat_last_sent)
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(**message)
+                logger.debug(f"Сообщение отправлено пользователю {chat_id}")
+                return Delivery.SENT
+            except TelegramRetryAfter as e:
+                # Флуд-контроль глобальный - тормозим всю рассылку, а не один воркер
+                logger.warning(f"RetryAfter {e.retry_after} с при отправке пользователю {chat_id}, пауза рассылки")
+                self.bucket.pause(e.retry_after)
+                stats.retries += 1
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Пользователь заблокировал бота или чат недоступен - повтор не поможет
+                logger.debug(f"Пользователь {chat_id} недоступен: {e}")
+                return Delivery.FAILED
+            except Exception as e:
+                logger.error(f"Ошибка отправки сообщения пользователю {chat_id}: {e}")
+                return await self._defer(message, stats)
+
+        logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: превышено число повторов")
+        return await self._defer(message, stats)
@@ -0,0 +1,84 @@
+"""
+Ограниченный in-process кэш с TTL и вытеснением LRU
+"""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable
+
+from backend.config import IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL, STATS_CACHE_SIZE, STATS_CACHE_TTL
+
+
+class TTLCache:
+    """
+    Кэш на OrderedDict: не больше maxsize записей, каждая живет не дольше ttl секунд.
+
+    При переполнении вытесняется давно не использованная запись (LRU).
+    Считает попадания, промахи и вытеснения.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+@dataclass(frozen=True)
+class UserIdentity:
+    """Неизменяемый снимок пользователя, которого достаточно большинству обработчиков"""
+    telegram_id: int
+    family_id: int
+    display_name: str
+
+
+# telegram_id -> UserIdentity
+identity_cache = TTLCache(maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)
+
+# (family_id, period) -> текст отчета /stats; сбрасывается при каждой записи в семью
+stats_cache = TTLCache(maxsize=STATS_CACHE_SIZE, ttl=STATS_CACHE_TTL)
@@ -0,0 +1,21 @@
+"""
+Отправка файлов, которые не нужно целиком читать в память
+"""
+import asyncio
+from typing import AsyncGenerator, BinaryIO
+
+from aiogram import Bot
+from aiogram.types import InputFile
+
+
+class SpooledInputFile(InputFile):
+    """InputFile поверх открытого файла (например, SpooledTemporaryFile) - читается кусками"""
+
+    def __init__(self, file: BinaryIO, filename: str, **kwargs):
+        super().__init__(filename=filename, **kwargs)
+        self.file = file
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := await asyncio.to_thread(self.file.read, self.chunk_size):
+            yield chunk
@@ -1,50 +1,46 @@
 """
 Обработчики команд и сообщений бота
 """
+import io
 import logging
-import secrets
-from datetime import datetime
+from html import escape
+from tempfile import SpooledTemporaryFile
+from datetime import datetime, date
+from decimal import Decimal
 from aiogram import Router, F
-from aiogram.filters import Command, StateFilter
-from aiogram.types import Message
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.enums import ChatAction
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from sqlalchemy import select
+from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from backend.db.models import User, Transaction, TransactionType, Family
+from backend.config import DAILY_INCOME_TIME, DAILY_EXPENSE_TIME, TIMEZONE
+from backend.db.models import User, TransactionType, Family
+from backend.db.ledger import parse_entries, record_transactions, merge_families, Entry, MAX_ENTRIES
+from backend.db.rollups import get_member_totals, period_range, PERIODS, MemberTotals
+from backend.db.export import export_transactions, available_formats, SPOOL_MAX_SIZE
+from backend.db.importer import import_transactions, read_import_rows, ImportFormatError
+from backend.db.history import fetch_history_page, HistoryCursor, HistoryPage
+from backend.db.slots import user_slots, parse_time, is_valid_timezone
+from backend.bot.cache import identity_cache, stats_cache, UserIdentity
+from backend.bot.invites import invite_store
+from backend.bot.outbox import outbox
+from backend.bot.documents import SpooledInputFile
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-# Глобальное хранилище кодов привязки
-# {code: {"family_id": int, "creator_id": int, "expires_at": float}}
-invite_codes = {}
-
-
-def cleanup_expired_codes():
-    """Очистка истекших кодов привязки"""
-    current_time = datetime.utcnow().timestamp()
-    expired_codes = [
-        code for code, data in invite_codes.items()
-        if data['expires_at'] < current_time
-    ]
-    for code in expired_codes:
-        del invite_codes[code]
-        logger.debug(f"Удален истекший код: {code}")
-    
-    if expired_codes:
-        logger.info(f"Очищено истекших кодов: {len(expired_codes)}")
-
-
 class FinanceStates(StatesGroup):
     """Состояния для записи транзакций"""
     waiting_for_income = State()
     waiting_for_expense = State()
     waiting_for_link_code = State()
+    waiting_for_import_file = State()
 
 
-async def get_or_create_user(session: AsyncSession, message: Message) -> tuple[User, Family]:
+async def get_or_create_user(session: AsyncSession, message: Message | CallbackQuery) -> tuple[User, Family]:
     """Получить или создать пользователя и его семью"""
     telegram_id = message.from_user.id
     
@@ -63,12 +59,15 @@ async def get_or_create_user(session: AsyncSession, message: Message) -> tuple[U
         await session.flush()
         
         # Создаем пользователя и привязываем к семье
+        income_slot, expense_slot = user_slots(None, None, None)
         user = User(
             telegram_id=telegram_id,
             username=message.from_user.username,
             first_name=message.from_user.first_name,
             last_name=message.from_user.last_name,
-            family_id=family.id
+            family_id=family.id,
+            income_slot=income_slot,
+            expense_slot=expense_slot
         )
         session.add(user)
         await session.commit()
@@ -82,9 +81,55 @@ async def get_or_create_user(session: AsyncSession, message: Message) -> tuple[U
         )
         family = result.scalar_one()
     
+    identity_cache.set(telegram_id, UserIdentity(
+        telegram_id=user.telegram_id,
+        family_id=family.id,
+        display_name=user.first_name or user.username or f"ID {user.telegram_id}"
+    ))
     return user, family
 
 
+async def get_identity(session: AsyncSession, message: Message | CallbackQuery) -> UserIdentity:
+    """Получить пользователя из кэша (без запросов к БД), при промахе - из БД"""
+    identity = identity_cache.get(message.from_user.id)
+    if identity is None:
+        await get_or_create_user(session, message)
+        identity = identity_cache.get(message.from_user.id)
+    return identity
+
+
+async def get_user_family(session: AsyncSession, message: Message | CallbackQuery) -> tuple[UserIdentity, Family]:
+    """Получить пользователя (из кэша) и его семью - один запрос по первичному ключу"""
+    identity = await get_identity(session, message)
+    family = await session.get(Family, identity.family_id)
+    
+    if family is None:
+        # Семья удалена (пользователь перешел в другую на другой реплике) - кэш устарел
+        identity_cache.invalidate(identity.telegram_id)
+        user, family = await get_or_create_user(session, message)
+        identity = identity_cache.get(user.telegram_id)
+    
+    return identity, family
+
+
+STALE_FAMILY_AMOUNT = "⚠️ Семья изменилась, пока ты вводил сумму. Отправь сумму еще раз:"
+STALE_FAMILY_IMPORT = "⚠️ Семья изменилась во время импорта, ничего не импортировано. Пришли файл еще раз:"
+
+
+async def stale_family_answer(message: Message, user: UserIdentity, text: str = STALE_FAMILY_AMOUNT):
+    """Семьи из кэша уже нет (пользователь сменил семью) - сбрасываем кэш и просим повторить"""
+    identity_cache.invalidate(user.telegram_id)
+    logger.warning(f"User {user.telegram_id}: семья {user.family_id} не найдена, кэш сброшен")
+    await outbox.reply(message, text)
+
+
+def invalidate_family_stats(*family_ids: int):
+    """Сбросить закэшированные отчеты /stats семей после записи"""
+    for family_id in family_ids:
+        for period in PERIODS:
+            stats_cache.invalidate((family_id, period))
+
+
 async def get_family_members(session: AsyncSession, family_id: int) -> list[User]:
     """Получить всех членов семьи"""
     result = await session.execute(
@@ -96,7 +141,7 @@ async def get_family_members(session: AsyncSession, family_id: int) -> list[User
 @router.message(Command("start"))
 async def cmd_start(message: Message, session: AsyncSession):
     """Команда /start"""
-    user, family = await get_or_create_user(session, message)
+    user, family = await get_user_family(session, message)
     
     # Получаем членов семьи
     family_members = await get_family_members(session, family.id)
@@ -113,15 +158,18 @@ async def cmd_start(message: Message, session: AsyncSession):
         "/income - Записать пополнение счета\n"
         "/expense - Записать расход\n"
         "/balance - Показать текущий баланс\n"
-        "/history - История транзакций (последние 10)\n"
+        "/history - История транзакций\n"
+        "/stats - Итоги за неделю/месяц/год\n"
         "/family - Участники семьи\n"
         "/link - Создать код для привязки\n"
         "/join - Присоединиться к семье по коду\n"
+        "/remind - Время напоминаний\n"
+        "/timezone - Часовой пояс\n"
         "/help - Справка\n\n"
         f"💰 Семейный баланс: <b>{float(family.current_balance):.2f} ₽</b>"
     ).format(family_info=family_info)
     
-    await message.answer(welcome_text, parse_mode="HTML")
+    await outbox.reply(message, welcome_text, parse_mode="HTML")
 
 
 @router.message(Command("help"))
@@ -130,32 +178,47 @@ async def cmd_help(message: Message):
     help_text = (
         "ℹ️ Справка по использованию:\n\n"
         "📥 /income - Записать пополнение счета\n"
-        "Бот попросит ввести сумму пополнения.\n\n"
+        "Сразу: /income 5000 зарплата, или бот спросит сумму.\n\n"
         "📤 /expense - Записать расход\n"
-        "Бот попросит ввести сумму расхода.\n\n"
+        "Сразу: /expense 350 продукты, или бот спросит сумму.\n\n"
+        "⚡ Можно без команды, по операции на строку:\n"
+        "350 продукты\n"
+        "1200 аренда\n"
+        "+5000 зарплата\n"
+        f"(без знака - расход, до {MAX_ENTRIES} строк за раз)\n\n"
         "💰 /balance - Показать семейный баланс\n"
         "Выводит актуальный остаток на счете.\n\n"
         "📊 /history - История транзакций\n"
-        "Показывает последние 10 операций всей семьи с указанием кто добавил.\n\n"
+        "Показывает операции всей семьи с указанием кто добавил, листать кнопками.\n\n"
+        "📈 /stats [week|month|year] - Итоги за период\n"
+        "Доходы, расходы и разбивка по членам семьи (по умолчанию - месяц).\n\n"
+        "📂 /export [week|month|year|all] [csv|xlsx] - Выгрузка\n"
+        "Все операции семьи файлом (по умолчанию - всё время, CSV).\n\n"
+        "📥 /import - Загрузка истории из CSV\n"
+        "Например, из таблицы или другого приложения (формат как у /export).\n\n"
         "👨‍👩‍👧‍👦 /family - Участники семьи\n"
         "Показывает список всех членов семьи.\n\n"
         "🔗 /link - Создать код для привязки\n"
         "Создаёт код для привязки супруга/супруги к общему кошельку.\n\n"
         "🔗 /join - Присоединиться к семье\n"
         "Ввести код от супруга/супруги для объединения кошельков.\n\n"
+        "⏰ /remind 09:00 20:00 - Время напоминаний\n"
+        "Утреннее (пополнения) и вечернее (расходы).\n\n"
+        "🌍 /timezone Europe/Moscow - Часовой пояс\n"
+        "Напоминания приходят по твоему местному времени.\n\n"
         "❌ /cancel - Отменить текущую операцию\n\n"
         "Я буду присылать тебе ежедневные напоминания:\n"
         "🌅 Утром - записать пополнения\n"
         "🌙 Вечером - записать расходы"
     )
     
-    await message.answer(help_text)
+    await outbox.reply(message, help_text)
 
 
 @router.message(Command("balance"))
 async def cmd_balance(message: Message, session: AsyncSession):
     """Команда /balance - показать семейный баланс"""
-    user, family = await get_or_create_user(session, message)
+    user, family = await get_user_family(session, message)
     
     # Получаем членов семьи
     family_members = await get_family_members(session, family.id)
@@ -172,13 +235,13 @@ async def cmd_balance(message: Message, session: AsyncSession):
         f"<b>{float(family.current_balance):.2f} ₽</b>{members_text}"
     )
     
-    await message.answer(balance_text, parse_mode="HTML")
+    await outbox.reply(message, balance_text, parse_mode="HTML")
 
 
 @router.message(Command("family"))
 async def cmd_family(message: Message, session: AsyncSession):
     """Команда /family - показать участников семьи"""
-    user, family = await get_or_create_user(session, message)
+    user, family = await get_user_family(session, message)
     
     # Получаем всех членов семьи
     family_members = await get_family_members(session, family.id)
@@ -197,30 +260,20 @@ async def cmd_family(message: Message, session: AsyncSession):
     if len(family_members) == 1:
         family_text += "\n💡 Чтобы добавить супруга/супругу, используй /link"
     
-    await message.answer(family_text, parse_mode="HTML")
+    await outbox.reply(message, family_text, parse_mode="HTML")
 
 
 @router.message(Command("link"))
 async def cmd_link(message: Message, session: AsyncSession):
     """Команда /link - создать код для привязки члена семьи"""
-    user, family = await get_or_create_user(session, message)
+    user = await get_identity(session, message)
     
     # Очищаем истекшие коды перед созданием нового
-    cleanup_expired_codes()
-    
-    # Генерируем уникальный код привязки (6 символов)
-    while True:
-        link_code = secrets.token_urlsafe(6)[:6].upper()
-        # Проверяем что код уникальный
-        if link_code not in invite_codes:
-            break
-    
-    # Сохраняем код в глобальное хранилище (живет 10 минут)
-    invite_codes[link_code] = {
-        "family_id": family.id,
-        "creator_id": user.telegram_id,
-        "expires_at": datetime.utcnow().timestamp() + 600  # 10 минут
-    }
+    await invite_store.cleanup(session)
+    
+    # Генерируем уникальный код привязки (живет 10 минут, виден всем репликам)
+    link_code = await invite_store.create(session, family_id=user.family_id, creator_id=user.telegram_id)
+    await session.commit()
     
     link_text = (
         f"🔗 <b>Код для привязки к семейному кошельку:</b>\n\n"
@@ -232,8 +285,70 @@ async def cmd_link(message: Message, session: AsyncSession):
         f"⏰ Код действителен 10 минут"
     )
     
-    await message.answer(link_text, parse_mode="HTML")
-    logger.info(f"User {user.telegram_id} создал код привязки: {link_code} для семьи {family.id}")
+    await outbox.reply(message, link_text, parse_mode="HTML")
+    logger.info(f"User {user.telegram_id} создал код привязки: {link_code} для семьи {user.family_id}")
+
+
+async def update_reminder_settings(session: AsyncSession, user: User, **settings):
+    """Сохранить настройки напоминаний и пересчитать слоты"""
+    for key, value in settings.items():
+        setattr(user, key, value)
+    user.income_slot, user.expense_slot = user_slots(user.timezone, user.income_time, user.expense_time)
+    user.updated_at = datetime.utcnow()
+    await session.commit()
+
+
+@router.message(Command("remind"))
+async def cmd_remind(message: Message, command: CommandObject, session: AsyncSession):
+    """Команда /remind - время утреннего и вечернего напоминаний"""
+    user, family = await get_or_create_user(session, message)
+    
+    if not command.args:
+        await outbox.reply(
+            message,
+            f"⏰ Напоминания приходят в {user.income_time or DAILY_INCOME_TIME} (пополнения) "
+            f"и в {user.expense_time or DAILY_EXPENSE_TIME} (расходы), "
+            f"часовой пояс {user.timezone or TIMEZONE}.\n\n"
+            "Чтобы изменить: /remind 08:30 21:00"
+        )
+        return
+    
+    try:
+        income_time, expense_time = command.args.split()
+        income_time = parse_time(income_time).strftime("%H:%M")
+        expense_time = parse_time(expense_time).strftime("%H:%M")
+    except ValueError:
+        await outbox.reply(message, "❌ Не могу распознать время. Пример: /remind 08:30 21:00")
+        return
+    
+    await update_reminder_settings(session, user, income_time=income_time, expense_time=expense_time)
+    
+    await outbox.reply(message, f"✅ Напоминания: пополнения в {income_time}, расходы в {expense_time}")
+    logger.info(f"User {user.telegram_id} изменил время напоминаний: {income_time}, {expense_time}")
+
+
+@router.message(Command("timezone"))
+async def cmd_timezone(message: Message, command: CommandObject, session: AsyncSession):
+    """Команда /timezone - часовой пояс для напоминаний"""
+    user, family = await get_or_create_user(session, message)
+    
+    if not command.args:
+        await outbox.reply(
+            message,
+            f"🌍 Твой часовой пояс: {user.timezone or TIMEZONE}\n\n"
+            "Чтобы изменить: /timezone Europe/Moscow"
+        )
+        return
+    
+    timezone = command.args.strip()
+    if not is_valid_timezone(timezone):
+        await outbox.reply(message, "❌ Неизвестный часовой пояс. Пример: Europe/Moscow, Asia/Yekaterinburg")
+        return
+    
+    await update_reminder_settings(session, user, timezone=timezone)
+    
+    await outbox.reply(message, f"✅ Часовой пояс: {timezone}")
+    logger.info(f"User {user.telegram_id} изменил часовой пояс: {timezone}")
 
 
 @router.message(Command("join"))
@@ -241,7 +356,8 @@ async def cmd_join(message: Message, state: FSMContext):
     """Команда /join - начать процесс присоединения к семье"""
     await state.set_state(FinanceStates.waiting_for_link_code)
     
-    await message.answer(
+    await outbox.reply(
+        message,
         "🔗 Введи код привязки, который получил от супруга/супруги:\n\n"
         "Код выглядит как: ABC123\n"
         "Для отмены: /cancel"
@@ -256,114 +372,207 @@ async def process_link_code(message: Message, state: FSMContext, session: AsyncS
     # Получаем текущего пользователя
     current_user, current_family = await get_or_create_user(session, message)
     
-    # Проверяем код в глобальном хранилище
-    if code not in invite_codes:
-        await message.answer(
-            "❌ Код не найден.\n\n"
-            "Возможно:\n"
-            "• Код введен неверно\n"
-            "• Код уже был использован\n"
-            "• Код истек (10 минут)\n\n"
-            "Попроси супруга/супругу отправить команду /link и получить новый код."
-        )
-        await state.clear()
-        return
-    
-    # Получаем данные кода
-    code_data = invite_codes[code]
+    # Гасим код одним DELETE ... RETURNING в той же транзакции, что и перенос:
+    # код срабатывает ровно один раз на любой реплике
+    invite = await invite_store.consume(
+        session, code, telegram_id=current_user.telegram_id, family_id=current_family.id
+    )
     
-    # Проверяем срок действия
-    if datetime.utcnow().timestamp() > code_data['expires_at']:
-        # Удаляем истекший код
-        del invite_codes[code]
-        await message.answer(
-            "⏰ Код истек (10 минут).\n\n"
-            "Попроси супруга/супругу создать новый код через /link"
-        )
+    if invite is None:
+        # Код не подошел - выясняем почему
+        invite = await invite_store.get(session, code)
+        if invite is None:
+            await outbox.reply(
+                message,
+                "❌ Код не найден.\n\n"
+                "Возможно:\n"
+                "• Код введен неверно\n"
+                "• Код уже был использован\n"
+                "• Код истек (10 минут)\n\n"
+                "Попроси супруга/супругу отправить команду /link и получить новый код."
+            )
+        elif invite.expires_at <= datetime.utcnow():
+            await outbox.reply(
+                message,
+                "⏰ Код истек (10 минут).\n\n"
+                "Попроси супруга/супругу создать новый код через /link"
+            )
+        elif invite.creator_id == current_user.telegram_id:
+            # Проверяем не пытается ли пользователь привязаться к самому себе
+            await outbox.reply(message, "❌ Это твой собственный код! Отправь его супругу/супруге.")
+        else:
+            # Пользователь пытается привязаться к своей же семье
+            await outbox.reply(message, "❌ Ты уже в этой семье!")
         await state.clear()
         return
     
-    target_family_id = code_data['family_id']
-    creator_id = code_data['creator_id']
-    
-    # Проверяем не пытается ли пользователь привязаться к самому себе
-    if current_user.telegram_id == creator_id:
-        await message.answer("❌ Это твой собственный код! Отправь его супругу/супруге.")
-        await state.clear()
-        return
+    # Переносим баланс и все транзакции текущей семьи в целевую (set-based)
+    target_balance = await merge_families(
+        session, source_family_id=current_family.id, target_family_id=invite.family_id
+    )
     
-    # Проверяем не пытается ли пользователь привязаться к своей же семье
-    if current_family.id == target_family_id:
-        await message.answer("❌ Ты уже в этой семье!")
+    if target_balance is None:
+        # Семья создателя кода уже не существует - код погашен, перенос не делаем
+        await session.commit()
+        await outbox.reply(message, "❌ Семья, для которой создан код, больше не существует. Попроси новый код через /link")
         await state.clear()
         return
     
-    # Получаем целевую семью
-    result = await session.execute(
-        select(Family).where(Family.id == target_family_id)
-    )
-    target_family = result.scalar_one()
-    
-    # Переносим баланс текущей семьи в целевую
-    target_family.current_balance = float(target_family.current_balance) + float(current_family.current_balance)
-    
-    # Переносим все транзакции текущей семьи в целевую
+    # Считаем членов старой семьи для проверки
     result = await session.execute(
-        select(Transaction).where(Transaction.family_id == current_family.id)
+        select(func.count()).select_from(User).where(User.family_id == current_family.id)
     )
-    transactions = result.scalars().all()
-    
-    for tx in transactions:
-        tx.family_id = target_family.id
-    
-    # Получаем членов старой семьи для проверки
-    old_family_members = await get_family_members(session, current_family.id)
+    old_family_size = result.scalar_one()
     
     # Привязываем пользователя к новой семье
-    current_user.family_id = target_family.id
+    current_user.family_id = invite.family_id
     current_user.updated_at = datetime.utcnow()
     
     # Если в старой семье был только этот пользователь - удаляем её
-    if len(old_family_members) == 1:
+    if old_family_size == 1:
         await session.delete(current_family)
     
     await session.commit()
     await state.clear()
     
-    # Удаляем использованный код
-    del invite_codes[code]
+    # Пользователь сменил семью - закэшированная привязка устарела
+    identity_cache.invalidate(current_user.telegram_id)
+    invalidate_family_stats(current_family.id, invite.family_id)
     
-    # Получаем новый список членов семьи
-    new_members = await get_family_members(session, target_family.id)
+    # Считаем членов новой семьи
+    result = await session.execute(
+        select(func.count()).select_from(User).where(User.family_id == invite.family_id)
+    )
+    new_family_size = result.scalar_one()
     
-    await message.answer(
+    await outbox.reply(
+        message,
         f"✅ Успешно привязан к семье!\n\n"
-        f"👨‍👩‍👧‍👦 Теперь в семье {len(new_members)} чел.\n"
-        f"💰 Общий баланс: <b>{float(target_family.current_balance):.2f} ₽</b>",
+        f"👨‍👩‍👧‍👦 Теперь в семье {new_family_size} чел.\n"
+        f"💰 Общий баланс: <b>{target_balance:.2f} ₽</b>",
+        parse_mode="HTML"
+    )
+    
+    logger.info(f"User {current_user.telegram_id} присоединился к семье {invite.family_id}, код {code} погашен")
+
+
+def with_default_descriptions(entries: list[Entry]) -> list[Entry]:
+    """Подставить "Пополнение"/"Расход" операциям без описания"""
+    return [
+        entry if entry.description else Entry(
+            entry.transaction_type,
+            entry.amount,
+            "Пополнение" if entry.transaction_type == TransactionType.INCOME else "Расход"
+        )
+        for entry in entries
+    ]
+
+
+async def save_entries(message: Message, session: AsyncSession, entries: list[Entry]) -> bool:
+    """
+    Записать операции из сообщения одним запросом и ответить итогом.
+    Возвращает False, если семья пользователя устарела и ничего не записано.
+    """
+    user = await get_identity(session, message)
+    
+    # Записываем все транзакции и обновляем баланс СЕМЬИ одним запросом
+    balance = await record_transactions(
+        session,
+        family_id=user.family_id,
+        telegram_id=user.telegram_id,
+        user_name=user.display_name,
+        entries=with_default_descriptions(entries)
+    )
+    await session.commit()
+    
+    if balance is None:
+        await stale_family_answer(message, user)
+        return False
+    
+    invalidate_family_stats(user.family_id)
+    
+    balance_emoji = "💰" if balance >= 0 else "⚠️"
+    
+    if len(entries) == 1:
+        entry = entries[0]
+        if entry.transaction_type == TransactionType.INCOME:
+            header = "✅ Пополнение записано!"
+            line = f"💵 +{entry.amount:.2f} ₽"
+        else:
+            header = "✅ Расход записан!"
+            line = f"💸 -{entry.amount:.2f} ₽"
+        if entry.description:
+            line += f" {escape(entry.description)}"
+        text = f"{header}\n\n{line} (добавил: {user.display_name})\n"
+    else:
+        lines = [
+            f"{'💵 +' if entry.transaction_type == TransactionType.INCOME else '💸 -'}{entry.amount:.2f} ₽ {escape(entry.description)}"
+            for entry in entries
+        ]
+        text = f"✅ Записано операций: {len(entries)} (добавил: {user.display_name})\n\n" + "\n".join(lines) + "\n\n"
+    
+    await outbox.reply(
+        message,
+        f"{text}{balance_emoji} Семейный баланс: <b>{balance:.2f} ₽</b>",
         parse_mode="HTML"
     )
     
-    logger.info(f"User {current_user.telegram_id} присоединился к семье {target_family.id}, код {code} удален")
+    logger.info(f"User {user.telegram_id} записал {len(entries)} операций в семью {user.family_id}")
+    return True
+
+
+async def process_entries(
+    message: Message,
+    state: FSMContext,
+    session: AsyncSession,
+    text: str,
+    default_type: TransactionType,
+):
+    """Разобрать операции из текста, записать их и сбросить состояние"""
+    try:
+        entries = parse_entries(text, default_type)
+    except ValueError as e:
+        await outbox.reply(
+            message,
+            f"❌ {e}\n\n"
+            "Формат: сумма и описание, по одной операции на строку. Например:\n"
+            "350 продукты\n"
+            "+5000 зарплата"
+        )
+        return
+    
+    if await save_entries(message, session, entries):
+        await state.clear()
 
 
 @router.message(Command("income"))
-async def cmd_income(message: Message, state: FSMContext):
-    """Команда /income - начать запись пополнения"""
+async def cmd_income(message: Message, command: CommandObject, state: FSMContext, session: AsyncSession):
+    """Команда /income - записать пополнение сразу (/income 5000 зарплата) или спросить сумму"""
+    if command.args:
+        await process_entries(message, state, session, command.args, TransactionType.INCOME)
+        return
+    
     await state.set_state(FinanceStates.waiting_for_income)
-    await message.answer(
+    await outbox.reply(
+        message,
         "💵 Введи сумму пополнения счета:\n\n"
-        "Например: 5000 или 1500.50\n"
+        "Например: 5000 или 1500.50 зарплата\n"
         "Для отмены введи /cancel"
     )
 
 
 @router.message(Command("expense"))
-async def cmd_expense(message: Message, state: FSMContext):
-    """Команда /expense - начать запись расхода"""
+async def cmd_expense(message: Message, command: CommandObject, state: FSMContext, session: AsyncSession):
+    """Команда /expense - записать расход сразу (/expense 350 продукты) или спросить сумму"""
+    if command.args:
+        await process_entries(message, state, session, command.args, TransactionType.EXPENSE)
+        return
+    
     await state.set_state(FinanceStates.waiting_for_expense)
-    await message.answer(
+    await outbox.reply(
+        message,
         "💸 Введи сумму расхода:\n\n"
-        "Например: 350 или 1299.99\n"
+        "Например: 350 или 1299.99 продукты\n"
         "Для отмены введи /cancel"
     )
 
@@ -374,147 +583,61 @@ async def cmd_cancel(message: Message, state: FSMContext):
     current_state = await state.get_state()
     
     if current_state is None:
-        await message.answer("Нечего отменять 🤷")
+        await outbox.reply(message, "Нечего отменять 🤷")
         return
     
     await state.clear()
-    await message.answer("❌ Операция отменена")
+    await outbox.reply(message, "❌ Операция отменена")
 
 
-@router.message(StateFilter(FinanceStates.waiting_for_income))
+@router.message(StateFilter(FinanceStates.waiting_for_income), F.text)
 async def process_income(message: Message, state: FSMContext, session: AsyncSession):
-    """Обработка суммы пополнения"""
-    try:
-        amount = float(message.text.replace(',', '.').strip())
-        
-        if amount <= 0:
-            await message.answer("❌ Сумма должна быть больше нуля. Попробуй еще раз:")
-            return
-        
-        if amount > 999999999:
-            await message.answer("❌ Сумма слишком большая. Попробуй еще раз:")
-            return
-        
-        user, family = await get_or_create_user(session, message)
-        
-        # Имя пользователя для отображения
-        user_display_name = user.first_name or user.username or f"ID {user.telegram_id}"
-        
-        # Создаем транзакцию
-        transaction = Transaction(
-            family_id=family.id,
-            telegram_id=user.telegram_id,
-            user_name=user_display_name,
-            transaction_type=TransactionType.INCOME,
-            amount=amount,
-            description="Пополнение",
-            created_at=datetime.utcnow()
-        )
-        session.add(transaction)
-        
-        # Обновляем баланс СЕМЬИ
-        family.current_balance = float(family.current_balance) + amount
-        family.updated_at = datetime.utcnow()
-        
-        await session.commit()
-        await session.refresh(family)
-        
-        await message.answer(
-            f"✅ Пополнение записано!\n\n"
-            f"💵 +{amount:.2f} ₽ (добавил: {user_display_name})\n"
-            f"💰 Семейный баланс: <b>{float(family.current_balance):.2f} ₽</b>",
-            parse_mode="HTML"
-        )
-        
-        await state.clear()
-        logger.info(f"User {user.telegram_id} добавил пополнение {amount} в семью {family.id}")
-        
-    except ValueError:
-        await message.answer(
-            "❌ Не могу распознать сумму. Введи число, например: 1000 или 1500.50"
-        )
+    """Обработка суммы пополнения (можно несколько строк)"""
+    await process_entries(message, state, session, message.text, TransactionType.INCOME)
 
 
-@router.message(StateFilter(FinanceStates.waiting_for_expense))
+@router.message(StateFilter(FinanceStates.waiting_for_expense), F.text)
 async def process_expense(message: Message, state: FSMContext, session: AsyncSession):
-    """Обработка суммы расхода"""
-    try:
-        amount = float(message.text.replace(',', '.').strip())
-        
-        if amount <= 0:
-            await message.answer("❌ Сумма должна быть больше нуля. Попробуй еще раз:")
-            return
-        
-        if amount > 999999999:
-            await message.answer("❌ Сумма слишком большая. Попробуй еще раз:")
-            return
-        
-        user, family = await get_or_create_user(session, message)
-        
-        # Имя пользователя для отображения
-        user_display_name = user.first_name or user.username or f"ID {user.telegram_id}"
-        
-        # Создаем транзакцию
-        transaction = Transaction(
-            family_id=family.id,
-            telegram_id=user.telegram_id,
-            user_name=user_display_name,
-            transaction_type=TransactionType.EXPENSE,
-            amount=amount,
-            description="Расход",
-            created_at=datetime.utcnow()
-        )
-        session.add(transaction)
-        
-        # Обновляем баланс СЕМЬИ
-        family.current_balance = float(family.current_balance) - amount
-        family.updated_at = datetime.utcnow()
-        
-        await session.commit()
-        await session.refresh(family)
-        
-        balance_emoji = "💰" if family.current_balance >= 0 else "⚠️"
-        
-        await message.answer(
-            f"✅ Расход записан!\n\n"
-            f"💸 -{amount:.2f} ₽ (добавил: {user_display_name})\n"
-            f"{balance_emoji} Семейный баланс: <b>{float(family.current_balance):.2f} ₽</b>",
-            parse_mode="HTML"
-        )
-        
-        await state.clear()
-        logger.info(f"User {user.telegram_id} добавил расход {amount} в семью {family.id}")
-        
-    except ValueError:
-        await message.answer(
-            "❌ Не могу распознать сумму. Введи число, например: 500 или 299.99"
-        )
-
-
-@router.message(Command("history"))
-async def cmd_history(message: Message, session: AsyncSession):
-    """Команда /history - показать историю транзакций семьи"""
-    user, family = await get_or_create_user(session, message)
-    
-    # Получаем последние 10 транзакций СЕМЬИ
+    """Обработка суммы расхода (можно несколько строк)"""
+    await process_entries(message, state, session, message.text, TransactionType.EXPENSE)
+
+
+@router.message(StateFilter(None), F.text.regexp(r'^\s*[+-]?\s*\d'))
+async def process_quick_entries(message: Message, state: FSMContext, session: AsyncSession):
+    """
+    Операции без команды: "350 продукты" или несколько строк
+    ("350 продукты\n1200 аренда\n+5000 зарплата"). Без знака - расход.
+    """
+    await process_entries(message, state, session, message.text, TransactionType.EXPENSE)
+
+
+def history_keyboard(page: HistoryPage) -> InlineKeyboardMarkup | None:
+    """Кнопки навигации по истории"""
+    buttons = []
+    if page.has_newer:
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Новее", callback_data=f"hist:newer:{page.newer_cursor.encode()}"
+        ))
+    if page.has_older:
+        buttons.append(InlineKeyboardButton(
+            text="Старее ➡️", callback_data=f"hist:older:{page.older_cursor.encode()}"
+        ))
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+
+async def render_history(session: AsyncSession, family: Family, page: HistoryPage) -> str:
+    """Текст страницы истории"""
+    # Считаем членов семьи для отображения
     result = await session.execute(
-        select(Transaction)
-        .where(Transaction.family_id == family.id)
-        .order_by(Transaction.created_at.desc())
-        .limit(10)
+        select(func.count()).select_from(User).where(User.family_id == family.id)
     )
-    transactions = result.scalars().all()
+    family_size = result.scalar_one()
     
-    if not transactions:
-        await message.answer("📊 История транзакций пуста")
-        return
+    history_text = "📊 <b>История семейных операций:</b>\n\n"
     
-    # Получаем членов семьи для отображения
-    family_members = await get_family_members(session, family.id)
-    
-    history_text = "📊 <b>История семейных операций (последние 10):</b>\n\n"
-    
-    for tx in transactions:
+    for tx in page.transactions:
         date_str = tx.created_at.strftime("%d.%m.%Y %H:%M")
         
         if tx.transaction_type == TransactionType.INCOME:
@@ -525,7 +648,7 @@ async def cmd_history(message: Message, session: AsyncSession):
             sign = "-"
         
         # Показываем кто добавил (если больше 1 члена семьи)
-        if len(family_members) > 1:
+        if family_size > 1:
             who_added = f" ({tx.user_name})"
         else:
             who_added = ""
@@ -536,5 +659,225 @@ async def cmd_history(message: Message, session: AsyncSession):
         )
     
     history_text += f"💰 <b>Семейный баланс: {float(family.current_balance):.2f} ₽</b>"
+    return history_text
+
+
+@router.message(Command("history"))
+async def cmd_history(message: Message, session: AsyncSession):
+    """Команда /history - показать историю транзакций семьи"""
+    user, family = await get_user_family(session, message)
+    
+    # Получаем последние транзакции СЕМЬИ
+    page = await fetch_history_page(session, family.id)
+    
+    if not page.transactions:
+        await outbox.reply(message, "📊 История транзакций пуста")
+        return
+    
+    history_text = await render_history(session, family, page)
+    await outbox.reply(message, history_text, parse_mode="HTML", reply_markup=history_keyboard(page))
+
+
+@router.callback_query(F.data.startswith("hist:"))
+async def history_page(callback: CallbackQuery, session: AsyncSession):
+    """Кнопки «Новее»/«Старее» в /history"""
+    try:
+        _, direction, cursor_value = callback.data.split(":", 2)
+        cursor = HistoryCursor.decode(cursor_value)
+    except ValueError:
+        await callback.answer()
+        return
+    
+    user, family = await get_user_family(session, callback)
     
-    await message.answer(history_text, parse_mode="HTML")
+    if direction == "older":
+        page = await fetch_history_page(session, family.id, older_than=cursor)
+    else:
+        page = await fetch_history_page(session, family.id, newer_than=cursor)
+    
+    if not page.transactions:
+        await callback.answer("Больше операций нет")
+        return
+    
+    history_text = await render_history(session, family, page)
+    await callback.message.edit_text(history_text, parse_mode="HTML", reply_markup=history_keyboard(page))
+    await callback.answer()
+
+
+PERIOD_TITLES = {"week": "неделю", "month": "месяц", "year": "год"}
+
+
+def render_stats(period: str, start: date, members: list[MemberTotals]) -> str:
+    """Текст отчета /stats"""
+    income = sum((m.income for m in members), Decimal('0'))
+    expense = sum((m.expense for m in members), Decimal('0'))
+    net = income - expense
+    
+    stats_text = (
+        f"📈 <b>Итоги за {PERIOD_TITLES[period]}</b> (с {start.strftime('%d.%m.%Y')})\n\n"
+        f"💵 Доходы: <b>+{income:.2f} ₽</b>\n"
+        f"💸 Расходы: <b>-{expense:.2f} ₽</b>\n"
+        f"{'💰' if net >= 0 else '⚠️'} Итого: <b>{net:+.2f} ₽</b>\n"
+    )
+    
+    if len(members) > 1:
+        stats_text += "\n👥 По членам семьи:\n"
+        for member in members:
+            stats_text += f"  • {member.name}: +{member.income:.2f} / -{member.expense:.2f} ₽\n"
+    
+    return stats_text
+
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message, command: CommandObject, session: AsyncSession):
+    """Команда /stats - итоги за неделю/месяц/год"""
+    period = (command.args or "month").strip().lower()
+    if period not in PERIODS:
+        await outbox.reply(message, "❌ Укажи период: /stats week, /stats month или /stats year")
+        return
+    
+    user = await get_identity(session, message)
+    
+    # Отчет считается по дневным итогам и кэшируется до следующей записи в семью
+    stats_text = stats_cache.get((user.family_id, period))
+    if stats_text is None:
+        start, end = period_range(period)
+        members = await get_member_totals(session, user.family_id, start, end)
+        
+        if not members:
+            await outbox.reply(message, f"📈 За {PERIOD_TITLES[period]} операций нет")
+            return
+        
+        stats_text = render_stats(period, start, members)
+        stats_cache.set((user.family_id, period), stats_text)
+    
+    await outbox.reply(message, stats_text, parse_mode="HTML")
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject, session: AsyncSession):
+    """Команда /export [week|month|year|all] [csv|xlsx] - выгрузить транзакции семьи файлом"""
+    args = (command.args or "").lower().split()
+    period = next((arg for arg in args if arg in PERIODS or arg == "all"), "all")
+    export_format = next((arg for arg in args if arg in ("csv", "xlsx")), "csv")
+    unknown = [arg for arg in args if arg not in (*PERIODS, "all", "csv", "xlsx")]
+    
+    if unknown:
+        await outbox.reply(
+            message,
+            "❌ Формат команды: /export [week|month|year|all] [csv|xlsx]\n"
+            "Например: /export month xlsx"
+        )
+        return
+    
+    if export_format not in available_formats():
+        await outbox.reply(message, "❌ Выгрузка в XLSX недоступна на этом сервере, используй /export csv")
+        return
+    
+    user = await get_identity(session, message)
+    
+    if period == "all":
+        start, end = None, None
+    else:
+        start, end = period_range(period)
+    
+    await message.bot.send_chat_action(message.chat.id, ChatAction.UPLOAD_DOCUMENT)
+    
+    file, count = await export_transactions(session, user.family_id, export_format, start, end)
+    try:
+        if count == 0:
+            await outbox.reply(message, "📂 Операций для выгрузки нет")
+            return
+        
+        title = "всё время" if period == "all" else PERIOD_TITLES[period]
+        filename = f"transactions_{period}_{datetime.utcnow():%Y%m%d}.{export_format}"
+        await message.answer_document(
+            SpooledInputFile(file, filename=filename),
+            caption=f"📂 Операции семьи за {title}: {count}"
+        )
+    finally:
+        file.close()
+    
+    logger.info(f"User {user.telegram_id} выгрузил {count} операций семьи {user.family_id} ({export_format})")
+
+
+# Лимит Bot API на скачивание файла ботом
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+
+
+@router.message(Command("import"))
+async def cmd_import(message: Message, state: FSMContext):
+    """Команда /import - загрузить историю операций из CSV"""
+    await state.set_state(FinanceStates.waiting_for_import_file)
+    await outbox.reply(
+        message,
+        "📥 Пришли CSV-файл с операциями (до 20 МБ).\n\n"
+        "Формат - как у /export, первая строка - заголовок:\n"
+        "<code>Дата;Тип;Сумма;Описание;Кто добавил\n"
+        "2024-01-15;Расход;350;Продукты;Аня\n"
+        "2024-01-16;Пополнение;50000;Зарплата;</code>\n\n"
+        "Тип можно не указывать - тогда расход записывается отрицательной суммой.\n"
+        "Если в файле есть ошибки, ничего не импортируется.\n"
+        "Для отмены: /cancel",
+        parse_mode="HTML"
+    )
+
+
+@router.message(StateFilter(FinanceStates.waiting_for_import_file), F.document)
+async def process_import_file(message: Message, state: FSMContext, session: AsyncSession):
+    """Обработка файла импорта: потоковая проверка и загрузка через COPY"""
+    if message.document.file_size and message.document.file_size > IMPORT_MAX_FILE_SIZE:
+        await outbox.reply(message, "❌ Файл больше 20 МБ - раздели его на части")
+        return
+    
+    user = await get_identity(session, message)
+    
+    with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as file:
+        await message.bot.download(message.document, destination=file)
+        file.seek(0)
+        lines = io.TextIOWrapper(file, encoding='utf-8-sig', errors='replace', newline='')
+        
+        try:
+            result = await import_transactions(
+                session,
+                family_id=user.family_id,
+                telegram_id=user.telegram_id,
+                user_name=user.display_name,
+                rows=read_import_rows(lines)
+            )
+        except ImportFormatError as e:
+            await session.rollback()
+            errors = "\n".join(escape(error) for error in e.errors)
+            more = f"\n…и еще {e.total - len(e.errors)}" if e.total > len(e.errors) else ""
+            await outbox.reply(
+                message,
+                f"❌ Ошибок в файле: {e.total}, ничего не импортировано.\n\n{errors}{more}\n\n"
+                "Исправь файл и пришли его снова или введи /cancel",
+                parse_mode="HTML"
+            )
+            return
+        finally:
+            lines.detach()
+    
+    if result is None:
+        await session.rollback()
+        await stale_family_answer(message, user, STALE_FAMILY_IMPORT)
+        return
+    
+    await session.commit()
+    await state.clear()
+    invalidate_family_stats(user.family_id)
+    
+    await outbox.reply(
+        message,
+        f"✅ Импортировано операций: {result.count}\n"
+        f"💰 Семейный баланс: <b>{result.balance:.2f} ₽</b>",
+        parse_mode="HTML"
+    )
+    logger.info(f"User {user.telegram_id} импортировал {result.count} операций в семью {user.family_id}")
+
+
+@router.message(StateFilter(FinanceStates.waiting_for_import_file))
+async def process_import_not_file(message: Message):
+    """В состоянии импорта ждем именно файл"""
+    await outbox.reply(message, "📎 Пришли CSV-файл документом или введи /cancel")
@@ -0,0 +1,111 @@
+"""
+Коды привязки к семье: общая для всех реплик таблица + локальная куча сроков
+"""
+import heapq
+import logging
+import secrets
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, Row
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.db.models import InviteCode
+
+logger = logging.getLogger(__name__)
+
+# Сколько живет код привязки
+INVITE_TTL = timedelta(minutes=10)
+
+
+class InviteStore:
+    """
+    Хранилище кодов привязки.
+
+    Источник правды - таблица invite_codes (видна всем репликам и переживает
+    перезапуск), погашение кода - один DELETE ... RETURNING, поэтому код
+    срабатывает ровно один раз. Истекшие коды, созданные этой репликой,
+    отслеживаются в min-куче по сроку: очистка смотрит только на вершину кучи
+    и не зависит от числа живых кодов.
+    """
+
+    def __init__(self, ttl: timedelta = INVITE_TTL):
+        self.ttl = ttl
+        # (expires_at, code) для кодов, созданных этой репликой
+        self._expiry_heap: list[tuple[datetime, str]] = []
+
+    async def create(self, session: AsyncSession, family_id: int, creator_id: int) -> str:
+        """Создать уникальный код (6 символов). Коммит - на вызывающем"""
+        expires_at = datetime.utcnow() + self.ttl
+
+        while True:
+            code = secrets.token_urlsafe(6)[:6].upper()
+            result = await session.execute(
+                insert(InviteCode)
+                .values(code=code, family_id=family_id, creator_id=creator_id, expires_at=expires_at)
+                .on_conflict_do_nothing()
+                .returning(InviteCode.code)
+            )
+            # Код уже занят - генерируем другой
+            if result.first() is not None:
+                break
+
+        heapq.heappush(self._expiry_heap, (expires_at, code))
+        return code
+
+    async def consume(
+        self,
+        session: AsyncSession,
+        code: str,
+        telegram_id: int,
+        family_id: int,
+    ) -> Row | None:
+        """
+        Погасить код: удалить его и вернуть данные, если код жив, создан не этим
+        пользователем и ведет в другую семью. Иначе None (код не тронут).
+        Выполняется в транзакции вызывающего - при откате код возвращается.
+        """
+        result = await session.execute(
+            delete(InviteCode)
+            .where(
+                InviteCode.code == code,
+                InviteCode.expires_at > datetime.utcnow(),
+                InviteCode.creator_id != telegram_id,
+                InviteCode.family_id != family_id,
+            )
+            .returning(InviteCode.code, InviteCode.family_id, InviteCode.creator_id, InviteCode.expires_at)
+        )
+        return result.first()
+
+    async def get(self, session: AsyncSession, code: str) -> InviteCode | None:
+        """Получить код без погашения (для объяснения, почему он не подошел)"""
+        result = await session.execute(
+            select(InviteCode).where(InviteCode.code == code)
+        )
+        return result.scalar_one_or_none()
+
+    async def cleanup(self, session: AsyncSession) -> int:
+        """Удалить истекшие коды этой реплики. Коммит - на вызывающем"""
+        now = datetime.utcnow()
+        expired_codes = []
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expired_codes.append(heapq.heappop(self._expiry_heap)[1])
+
+        if not expired_codes:
+            return 0
+
+        await session.execute(
+            delete(InviteCode).where(InviteCode.code.in_(expired_codes), InviteCode.expires_at <= now)
+        )
+        logger.info(f"Очищено истекших кодов: {len(expired_codes)}")
+        return len(expired_codes)
+
+    async def cleanup_all(self, session: AsyncSession) -> int:
+        """Удалить все истекшие коды (в т.ч. оставшиеся от упавших реплик) по индексу expires_at"""
+        result = await session.execute(
+            delete(InviteCode).where(InviteCode.expires_at <= datetime.utcnow())
+        )
+        return result.rowcount
+
+
+invite_store = InviteStore()
@@ -8,11 +8,38 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
-from backend.config import BOT_TOKEN
-from backend.db.database import init_db, close_db, async_session_maker
+from backend.config import (
+    BOT_TOKEN,
+    FSM_STORAGE,
+    FSM_CACHE,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_MAX_CONCURRENCY,
+    WEBHOOK_MAX_CONNECTIONS,
+    METRICS_PORT,
+)
+from backend.db.database import init_db, close_db
 from backend.bot.handlers import router
 from backend.bot.scheduler import ReminderScheduler
+from backend.bot.cache import identity_cache
+from backend.bot.outbox import outbox
+from backend.bot.middlewares import (
+    session_middleware,
+    session_usage,
+    metrics_middleware,
+    update_metrics_middleware,
+    ConcurrencyLimitMiddleware,
+)
+from backend.metrics import registry
+from backend.db.instrumentation import handler_queries
+from backend.bot.storage import PostgresStorage
 
 # Настройка логирования
 logging.basicConfig(
@@ -26,11 +53,104 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def session_middleware(handler, event, data):
-    """Middleware для добавления сессии БД в handler"""
-    async with async_session_maker() as session:
-        data['session'] = session
-        return await handler(event, data)
+async def metrics_handler(request: web.Request) -> web.Response:
+    """GET /metrics в формате Prometheus"""
+    return web.Response(
+        text=registry.render(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+async def start_metrics_server() -> web.AppRunner | None:
+    """Отдельный HTTP-сервер для /metrics (METRICS_PORT=0 - выключен)"""
+    if not METRICS_PORT:
+        return None
+    
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=WEBAPP_HOST, port=METRICS_PORT).start()
+    logger.info(f"Метрики: http://{WEBAPP_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер со всеми middleware и обработчиками"""
+    if FSM_STORAGE == 'memory':
+        storage = MemoryStorage()
+    else:
+        storage = PostgresStorage()
+    dp = Dispatcher(storage=storage)
+    
+    # Метрики: счетчик обновлений и время обработчиков (снаружи сессии БД)
+    dp.update.outer_middleware(update_metrics_middleware)
+    dp.message.middleware(metrics_middleware)
+    dp.callback_query.middleware(metrics_middleware)
+    
+    # Регистрация middleware для БД
+    dp.message.middleware(session_middleware)
+    dp.callback_query.middleware(session_middleware)
+    
+    # Регистрация роутера
+    dp.include_router(router)
+    
+    return dp
+
+
+async def run_polling(bot: Bot, dp: Dispatcher):
+    """Получение обновлений через long polling"""
+    # Webhook и polling взаимоисключающие - снимаем webhook, если он был установлен
+    await bot.delete_webhook()
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """
+    Получение обновлений через webhook (aiohttp-сервер).
+    
+    Telegram присылает обновления POST-запросами, сервер сразу отвечает 200
+    и обрабатывает обновление в фоне; одновременно обрабатывается не больше
+    WEBHOOK_MAX_CONCURRENCY обновлений. Несколько реплик можно поставить
+    за балансировщик.
+    """
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware(WEBHOOK_MAX_CONCURRENCY))
+    
+    if FSM_STORAGE == 'memory' or FSM_CACHE == 'local':
+        # Состояние диалога видно только этой реплике - за балансировщиком сообщения
+        # одного пользователя могут попасть на разные реплики
+        logger.warning("Состояния FSM не общие для реплик: запускай одну реплику или FSM_CACHE=shared")
+    
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"Webhook установлен: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    else:
+        # Локальный запуск: обновления можно присылать POST-запросами вручную
+        logger.warning("WEBHOOK_URL не задан - webhook в Telegram не регистрируется")
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 async def main():
@@ -51,27 +171,35 @@ async def main():
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = create_dispatcher()
     
-    # Регистрация middleware для БД
-    dp.message.middleware(session_middleware)
-    
-    # Регистрация роутера
-    dp.include_router(router)
+    # Очередь исходящих сообщений: ответы обработчиков уходят в фоне
+    await outbox.start(bot)
     
     # Запуск планировщика напоминаний
     scheduler = ReminderScheduler(bot)
     scheduler.start()
     
-    logger.info("Бот запущен и готов к работе!")
+    metrics_runner = await start_metrics_server()
+    
+    logger.info(f"Бот запущен и готов к работе! Режим: {BOT_MODE}")
     
     try:
-        # Запуск polling
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if BOT_MODE == 'webhook':
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
     finally:
         # Graceful shutdown
         logger.info("Остановка бота...")
         scheduler.stop()
+        # Недоставленное сохраняется в БД - поэтому до close_db
+        await outbox.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        logger.info(f"Кэш пользователей: {identity_cache.stats()}")
+        logger.info(f"Использование сессий БД по обработчикам: {dict(session_usage)}")
+        logger.info(f"Запросы к БД по обработчикам: {dict(handler_queries)}")
         await close_db()
         await bot.session.close()
         logger.info("Бот остановлен")
@@ -82,8 +210,3 @@ if __name__ == '__main__':
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
-
-
-
-
-
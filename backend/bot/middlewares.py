@@ -0,0 +1,109 @@
+"""
+Middleware бота
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from backend.db.database import async_session_maker
+from backend.db.instrumentation import track_queries
+from backend.metrics import updates_total, handler_duration, handler_errors, handler_queries_count
+
+logger = logging.getLogger(__name__)
+
+# Статистика по обработчикам: имя -> {"calls": ..., "session_used": ...}
+session_usage: dict[str, dict[str, int]] = defaultdict(lambda: {"calls": 0, "session_used": 0})
+
+
+class LazySession:
+    """
+    Прокси над AsyncSession, который создает сессию при первом обращении.
+
+    Обработчик, который так и не обратился к БД, не создает сессию
+    и не занимает соединение из пула.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker):
+        self._session_maker = session_maker
+        self._session: AsyncSession | None = None
+
+    @property
+    def used(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = self._session_maker()
+        return getattr(self._session, name)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+def handler_name(data: dict) -> str:
+    """Имя функции-обработчика, которую выбрал роутер"""
+    handler = data.get('handler')
+    if handler is None:
+        return "unknown"
+    return getattr(handler.callback, '__name__', repr(handler.callback))
+
+
+async def session_middleware(handler, event, data):
+    """Middleware для добавления сессии БД в handler (сессия создается лениво)"""
+    handler_object = data.get('handler')
+    # Обработчику без аргумента session сессия не нужна вовсе
+    if handler_object is not None and 'session' not in handler_object.params:
+        return await handler(event, data)
+
+    name = handler_name(data)
+    session = LazySession(async_session_maker)
+    data['session'] = session
+    try:
+        return await handler(event, data)
+    finally:
+        await session.close()
+        usage = session_usage[name]
+        usage["calls"] += 1
+        if session.used:
+            usage["session_used"] += 1
+        logger.debug(f"{name}: сессия БД {'использована' if session.used else 'не понадобилась'}")
+
+
+async def metrics_middleware(handler, event, data):
+    """
+    Middleware для метрик обработчиков: время (вместе с сессией БД), исключения
+    и SQL-запросы - все запросы внутри обработчика засчитываются ему через contextvar.
+    """
+    name = handler_name(data)
+    started = time.perf_counter()
+    with track_queries(name) as queries:
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, handler=name)
+            handler_queries_count.observe(queries.count, handler=name)
+            logger.debug(f"{name}: {queries.count} запросов к БД, {queries.total_time * 1000:.1f} мс")
+
+
+async def update_metrics_middleware(handler, event, data):
+    """Outer-middleware обновлений: счетчик по типу обновления"""
+    updates_total.inc(type=event.event_type)
+    return await handler(event, data)
+
+
+class ConcurrencyLimitMiddleware:
+    """Outer-middleware обновлений: не больше limit обновлений обрабатываются одновременно"""
+
+    def __init__(self, limit: int):
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(self, handler, event, data):
+        async with self._semaphore:
+            return await handler(event, data)
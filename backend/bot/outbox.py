@@ -0,0 +1,458 @@
+"""
+Очередь исходящих сообщений: ответы обработчиков и недоставленные напоминания
+
+Обработчик ставит ответ в очередь и сразу завершается (и закрывает сессию БД) -
+задержка и флуд-контроль Bot API его больше не тормозят. Сообщения одного чата
+доставляются строго по порядку, разные чаты - параллельно пулом воркеров.
+Сообщения, которые должны пережить перезапуск (напоминания, переданные рассылкой
+на повтор), записываются в outbox_messages при постановке в очередь и удаляются
+после доставки. Ответы обработчиков живут в памяти - обработчик не ждет БД.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.client.default import Default
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.methods import SendMessage
+from aiogram.types import Message
+from sqlalchemy import select, delete, insert, update, or_
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from backend.config import (
+    OUTBOX_WORKERS,
+    OUTBOX_MAX_PENDING,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BACKOFF,
+    OUTBOX_MAX_BACKOFF,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_LEASE,
+    OUTBOX_DRAIN_TIMEOUT,
+    NODE_ID,
+    BROADCAST_RATE,
+)
+from backend.db.database import async_session_maker
+from backend.db.models import OutboxMessage
+from backend.bot.broadcast import TokenBucket
+from backend.metrics import outbox_sent, outbox_failed, outbox_retries, outbox_delivery, outbox_pending
+
+logger = logging.getLogger(__name__)
+
+# Сколько сохраненных сообщений забирать из таблицы за один запрос
+OUTBOX_LOAD_BATCH = 1000
+
+
+@dataclass
+class OutboxItem:
+    """Сообщение в очереди"""
+    method: SendMessage
+    kind: str
+    attempts: int = 0
+    # id строки в outbox_messages (None - сообщение только в памяти)
+    row_id: int | None = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def chat_id(self) -> int:
+        return self.method.chat_id
+
+
+def method_payload(method: SendMessage) -> dict:
+    """Аргументы sendMessage для JSONB (значения по умолчанию бота не сохраняются)"""
+    defaults = {name for name, value in method if isinstance(value, Default)}
+    return method.model_dump(mode="json", exclude_none=True, exclude=defaults)
+
+
+def backoff_delay(attempts: int, base: float, maximum: float) -> float:
+    """Экспоненциальная задержка перед попыткой номер attempts + 1"""
+    return min(base * 2 ** (attempts - 1), maximum)
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений с пулом воркеров.
+
+    У каждого чата своя очередь, и чат целиком принадлежит одному воркеру, пока
+    тот доставляет его головное сообщение, - порядок внутри чата сохраняется.
+    RetryAfter ставит на паузу всю очередь (общий token bucket), сетевые ошибки
+    и ошибки сервера повторяются с экспоненциальной задержкой (чат ждет, не
+    занимая воркер); после max_attempts неудачных попыток сообщение отбрасывается.
+    Заблокировавшим бота и неверные запросы не повторяются.
+
+    В памяти не больше max_pending сообщений: send ждет, пока освободится место.
+
+    С session_maker сообщение, поставленное с durable=True, до доставки лежит
+    в outbox_messages, арендованное этим процессом (owner, locked_until); аренда
+    продлевается каждые poll_interval. Аренда упавшей реплики истекает через
+    lease секунд - после этого сообщения забирает (SKIP LOCKED) любая работающая
+    реплика. Доставка "хотя бы раз": сообщение, отправленное прямо перед падением,
+    может прийти повторно. Ответы (durable=False) в БД не пишутся: при остановке
+    недоставленное сохраняется одной пачкой, при падении ответы теряются.
+    Без session_maker очередь живет только в памяти.
+    """
+
+    def __init__(
+        self,
+        workers: int = OUTBOX_WORKERS,
+        rate: float = BROADCAST_RATE,
+        bucket: TokenBucket | None = None,
+        max_pending: int = OUTBOX_MAX_PENDING,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        retry_backoff: float = OUTBOX_RETRY_BACKOFF,
+        max_backoff: float = OUTBOX_MAX_BACKOFF,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+        lease: float = OUTBOX_LEASE,
+        session_maker: async_sessionmaker | None = async_session_maker,
+    ):
+        self.workers = workers
+        # Лимит отправки общий на токен бота - этот bucket передается и рассылке
+        self.bucket = bucket if bucket is not None else TokenBucket(rate)
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.session_maker = session_maker
+        self.bot: Bot | None = None
+        # Владелец строк outbox_messages - этот процесс (NODE_ID одинаков у перезапусков)
+        self.owner = f"{NODE_ID}:{uuid.uuid4().hex[:8]}"
+        # chat_id -> сообщения чата; чат есть в словаре, пока он в работе
+        # (ждет воркера в _ready, доставляется или ждет повтора)
+        self._chats: dict[int, deque[OutboxItem]] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._workers: list[asyncio.Task] = []
+        self._poller: asyncio.Task | None = None
+        self._pending = 0
+        # Доставленные сообщения, строки которых не удалось удалить сразу
+        self._delivered_rows: list[int] = []
+
+    @property
+    def running(self) -> bool:
+        return self.bot is not None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def start(self, bot: Bot):
+        """Запустить воркеры (и продление аренды и загрузку свободных сообщений, если есть БД)"""
+        if self.running:
+            return
+        self.bot = bot
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._capacity = asyncio.Semaphore(self.max_pending)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.session_maker is not None:
+            self._poller = asyncio.create_task(self._poll())
+        logger.info(f"Очередь сообщений запущена: воркеров {self.workers}, до {self.bucket.rate:.0f} msg/s")
+
+    async def stop(self, timeout: float = OUTBOX_DRAIN_TIMEOUT):
+        """Доставить то, что успеем за timeout, остальное сохранить (освободить) в outbox_messages"""
+        if not self.running:
+            return
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Очередь сообщений не опустела за {timeout:.0f} с")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        for handle in self._timers.values():
+            handle.cancel()
+        self._timers.clear()
+
+        # Сообщения, прерванные на отправке, тоже остаются в очереди чата
+        items = [item for queue in self._chats.values() for item in queue]
+        self._chats.clear()
+        self._pending = 0
+        outbox_pending.set(0)
+        self.bot = None
+
+        if self.session_maker is None:
+            if items:
+                logger.warning(f"Потеряно недоставленных сообщений: {len(items)} (очередь без БД)")
+            return
+        await self._release(items)
+
+    async def join(self):
+        """Дождаться, пока очередь опустеет"""
+        await self._idle.wait()
+
+    async def send(self, chat_id: int, text: str, kind: str = "reply", durable: bool = False, **kwargs):
+        """Поставить sendMessage в очередь (ждет, если очередь заполнена)"""
+        await self.put(SendMessage(chat_id=chat_id, text=text, **kwargs), kind, durable=durable)
+
+    async def reply(self, message: Message, text: str, **kwargs):
+        """Ответить в чат сообщения через очередь; если очередь не запущена - отправить сразу"""
+        method = message.answer(text, **kwargs)
+        if not self.running:
+            await method
+            return
+        await self.put(method, "reply")
+
+    async def put(
+        self,
+        method: SendMessage,
+        kind: str,
+        attempts: int = 0,
+        row_id: int | None = None,
+        durable: bool = False,
+    ):
+        """
+        Поставить метод в очередь его чата.
+
+        durable - сразу записать в outbox_messages (если его там еще нет), чтобы
+        сообщение пережило падение реплики; это запрос к БД на каждое сообщение.
+        """
+        if not self.running:
+            raise RuntimeError("Очередь сообщений не запущена")
+        await self._capacity.acquire()
+
+        item = OutboxItem(method, kind, attempts, row_id)
+        if durable and item.row_id is None and self.session_maker is not None:
+            item.row_id = await self._persist(item)
+        self._pending += 1
+        outbox_pending.set(self._pending)
+        self._idle.clear()
+
+        queue = self._chats.get(item.chat_id)
+        if queue is None:
+            self._chats[item.chat_id] = deque([item])
+            self._ready.put_nowait(item.chat_id)
+        else:
+            queue.append(item)
+
+    def _finish(self, item: OutboxItem):
+        self._pending -= 1
+        outbox_pending.set(self._pending)
+        self._capacity.release()
+        if self._pending == 0:
+            self._idle.set()
+
+    def _wake(self, chat_id: int):
+        self._timers.pop(chat_id, None)
+        self._ready.put_nowait(chat_id)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._chats[chat_id]
+            item = queue[0]
+
+            delay = await self._deliver(item)
+            if delay is not None:
+                # Остальные сообщения чата ждут вместе с головным
+                if delay > 0:
+                    self._timers[chat_id] = asyncio.get_running_loop().call_later(delay, self._wake, chat_id)
+                else:
+                    self._ready.put_nowait(chat_id)
+                continue
+
+            queue.popleft()
+            await self._forget(item)
+            self._finish(item)
+            if queue:
+                # В конец очереди чатов - один разговорчивый чат не держит воркер
+                self._ready.put_nowait(chat_id)
+            else:
+                del self._chats[chat_id]
+
+    async def _deliver(self, item: OutboxItem) -> float | None:
+        """Одна попытка доставки. None - сообщение обработано, иначе - через сколько секунд повторить"""
+        await self.bucket.acquire()
+        try:
+            await self.bot(item.method)
+        except TelegramRetryAfter as e:
+            # Флуд-контроль глобальный - пауза всей очереди, а не одного чата
+            self.bucket.pause(e.retry_after)
+            return self._retry(item, 0, f"RetryAfter {e.retry_after} с")
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Пользователь заблокировал бота или запрос неверный - повтор не поможет
+            logger.debug(f"Сообщение в чат {item.chat_id} не доставлено: {e}")
+            outbox_failed.inc(kind=item.kind)
+            return None
+        except Exception as e:
+            delay = backoff_delay(item.attempts + 1, self.retry_backoff, self.max_backoff)
+            return self._retry(item, delay, str(e))
+
+        outbox_sent.inc(kind=item.kind)
+        outbox_delivery.observe(time.monotonic() - item.enqueued_at, kind=item.kind)
+        return None
+
+    def _retry(self, item: OutboxItem, delay: float, reason: str) -> float | None:
+        item.attempts += 1
+        if item.attempts >= self.max_attempts:
+            logger.error(
+                f"Сообщение в чат {item.chat_id} ({item.kind}) не доставлено "
+                f"за {item.attempts} попыток: {reason}"
+            )
+            outbox_failed.inc(kind=item.kind)
+            return None
+        outbox_retries.inc(kind=item.kind)
+        logger.warning(f"Повтор доставки в чат {item.chat_id} ({item.kind}) через {delay:.1f} с: {reason}")
+        return delay
+
+    def _lease_end(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease)
+
+    async def _persist(self, item: OutboxItem) -> int | None:
+        """Записать сообщение в outbox_messages под арендой этого процесса (None - не удалось)"""
+        try:
+            async with self.session_maker() as session:
+                result = await session.execute(
+                    insert(OutboxMessage)
+                    .values(
+                        chat_id=item.chat_id,
+                        kind=item.kind,
+                        payload=method_payload(item.method),
+                        attempts=item.attempts,
+                        owner=self.owner,
+                        locked_until=self._lease_end(),
+                    )
+                    .returning(OutboxMessage.id)
+                )
+                row_id = result.scalar_one()
+                await session.commit()
+        except Exception as e:
+            # Не теряем сообщение из-за БД: оно будет доставлено, но не переживет падение реплики
+            logger.error(f"Не удалось записать сообщение в чат {item.chat_id} в outbox_messages: {e}")
+            return None
+        return row_id
+
+    async def _forget(self, item: OutboxItem):
+        """Удалить строку доставленного (или отброшенного) сообщения"""
+        if item.row_id is None:
+            return
+        try:
+            async with self.session_maker() as session:
+                await session.execute(delete(OutboxMessage).where(OutboxMessage.id == item.row_id))
+                await session.commit()
+        except Exception as e:
+            # Повторим при следующем продлении аренды, иначе сообщение придет повторно
+            logger.error(f"Не удалось удалить доставленное сообщение {item.row_id} из outbox_messages: {e}")
+            self._delivered_rows.append(item.row_id)
+
+    async def _renew(self):
+        """Продлить аренду своих сообщений и дочистить строки уже доставленных"""
+        async with self.session_maker() as session:
+            if self._delivered_rows:
+                rows, self._delivered_rows = self._delivered_rows, []
+                await session.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(rows)))
+            await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.owner == self.owner)
+                .values(locked_until=self._lease_end())
+            )
+            await session.commit()
+
+    async def _release(self, items: list[OutboxItem]):
+        """Сохранить недоставленные сообщения при остановке и снять аренду - их сразу заберет другая реплика"""
+        persisted = [item for item in items if item.row_id is not None]
+        unsaved = [item for item in items if item.row_id is None]
+        try:
+            async with self.session_maker() as session:
+                if self._delivered_rows:
+                    await session.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(self._delivered_rows)))
+                    self._delivered_rows = []
+                if persisted:
+                    # Сохраняем число попыток (bulk UPDATE по первичному ключу)
+                    await session.execute(
+                        update(OutboxMessage),
+                        [{"id": item.row_id, "attempts": item.attempts} for item in persisted]
+                    )
+                if unsaved:
+                    # Ответы и сообщения, не записанные из-за недоступной БД; id сохраняет порядок
+                    await session.execute(
+                        insert(OutboxMessage),
+                        [
+                            {
+                                "chat_id": item.chat_id,
+                                "kind": item.kind,
+                                "payload": method_payload(item.method),
+                                "attempts": item.attempts,
+                            }
+                            for item in unsaved
+                        ]
+                    )
+                await session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.owner == self.owner)
+                    .values(owner=None, locked_until=None)
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(
+                f"Не удалось освободить {len(items)} недоставленных сообщений: {e} "
+                f"(записанные их доставит другая реплика через {self.lease:.0f} с)"
+            )
+            return
+        if items:
+            logger.info(f"Освобождено недоставленных сообщений: {len(items)}")
+
+    async def restore(self) -> int:
+        """
+        Забрать свободные сообщения из outbox_messages в очередь.
+
+        Свободны освобожденные при остановке и сообщения с истекшей арендой (реплика
+        упала). Захват - UPDATE ... SKIP LOCKED, реплики не мешают друг другу;
+        забираем не больше, чем помещается в очередь, чтобы put не ждал, пока
+        аренда захваченных не продлевается.
+        """
+        restored = 0
+        while True:
+            limit = min(OUTBOX_LOAD_BATCH, self.max_pending - self._pending)
+            if limit <= 0:
+                break
+            async with self.session_maker() as session:
+                claimed = (
+                    select(OutboxMessage.id)
+                    .where(or_(OutboxMessage.locked_until.is_(None), OutboxMessage.locked_until < datetime.utcnow()))
+                    .order_by(OutboxMessage.id)
+                    .limit(limit)
+                    .with_for_update(skip_locked=True)
+                )
+                result = await session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(claimed))
+                    .values(owner=self.owner, locked_until=self._lease_end())
+                    .returning(OutboxMessage.id, OutboxMessage.kind, OutboxMessage.payload, OutboxMessage.attempts)
+                    .execution_options(synchronize_session=False)
+                )
+                rows = sorted(result.all())
+                await session.commit()
+
+            for row_id, kind, payload, attempts in rows:
+                await self.put(SendMessage.model_validate(payload), kind, attempts, row_id)
+            restored += len(rows)
+            if len(rows) < limit:
+                break
+
+        if restored:
+            logger.info(f"Загружено сохраненных сообщений: {restored}")
+        return restored
+
+    async def _poll(self):
+        while True:
+            try:
+                await self._renew()
+                await self.restore()
+            except Exception as e:
+                logger.error(f"Ошибка продления аренды или загрузки сообщений очереди: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+outbox = Outbox()
@@ -2,19 +2,38 @@
 Планировщик ежедневных напоминаний
 """
 import logging
-from datetime import datetime
+import zlib
+from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from aiogram import Bot
-from sqlalchemy import select
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from backend.config import DAILY_INCOME_TIME, DAILY_EXPENSE_TIME, TIMEZONE
-from backend.db.models import User, Family
+from backend.config import DAILY_INCOME_TIME, DAILY_EXPENSE_TIME, TIMEZONE, REMINDER_SHARDS, NODE_ID
+from backend.db.models import User, Family, ReminderClaim
 from backend.db.database import async_session_maker
+from backend.db.slots import current_slot, refresh_reminder_slots
+from backend.db.partitions import ensure_future_partitions
+from backend.bot.broadcast import Broadcaster, BroadcastStats
+from backend.metrics import reminder_duration, reminder_sent, reminder_failed
+from backend.bot.invites import invite_store
+from backend.bot.outbox import outbox
 
 logger = logging.getLogger(__name__)
 
+# Сколько строк читать из серверного курсора за раз
+STREAM_CHUNK_SIZE = 1000
+
+
+def record_reminder_metrics(kind: str, stats: BroadcastStats):
+    """Метрики рассылки (пустые шарды в гистограмму длительности не попадают)"""
+    reminder_sent.inc(stats.sent, kind=kind)
+    reminder_failed.inc(stats.failed, kind=kind)
+    if stats.total:
+        reminder_duration.observe(stats.duration, kind=kind)
+
 
 class ReminderScheduler:
     """Планировщик напоминаний"""
@@ -22,34 +41,37 @@ class ReminderScheduler:
     def __init__(self, bot: Bot):
         self.bot = bot
         self.scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+        # Недоставленные из-за временных ошибок напоминания повторяет очередь сообщений;
+        # лимит токена бота у рассылки и очереди общий
+        self.broadcaster = Broadcaster(bot, outbox=outbox, bucket=outbox.bucket)
     
     def start(self):
         """Запустить планировщик"""
-        # Парсим время
-        income_hour, income_minute = map(int, DAILY_INCOME_TIME.split(':'))
-        expense_hour, expense_minute = map(int, DAILY_EXPENSE_TIME.split(':'))
-        
-        # Добавляем задачи
+        # Каждую минуту рассылаем напоминания пользователям, чей слот (минута UTC) наступил
         self.scheduler.add_job(
-            self.send_income_reminder,
-            trigger=CronTrigger(hour=income_hour, minute=income_minute, timezone=TIMEZONE),
-            id='income_reminder',
-            name='Daily Income Reminder',
-            replace_existing=True
+            self.dispatch_slot,
+            trigger=CronTrigger(minute='*', timezone='UTC'),
+            id='reminder_dispatch',
+            name='Reminder Dispatch',
+            replace_existing=True,
+            misfire_grace_time=30,
+            # Рассылка большого слота может не уложиться в минуту
+            max_instances=5
         )
         
+        # Раз в час пересчитываем слоты (переходы на летнее/зимнее время)
         self.scheduler.add_job(
-            self.send_expense_reminder,
-            trigger=CronTrigger(hour=expense_hour, minute=expense_minute, timezone=TIMEZONE),
-            id='expense_reminder',
-            name='Daily Expense Reminder',
+            self.refresh_slots,
+            trigger=CronTrigger(minute=55, timezone='UTC'),
+            id='reminder_slots_refresh',
+            name='Reminder Slots Refresh',
             replace_existing=True
         )
         
         self.scheduler.start()
         logger.info(
-            f"Планировщик запущен. Напоминания: "
-            f"пополнения в {DAILY_INCOME_TIME}, расходы в {DAILY_EXPENSE_TIME}"
+            f"Планировщик запущен. Напоминания по умолчанию: "
+            f"пополнения в {DAILY_INCOME_TIME}, расходы в {DAILY_EXPENSE_TIME} ({TIMEZONE})"
         )
     
     def stop(self):
@@ -57,73 +79,122 @@ class ReminderScheduler:
         self.scheduler.shutdown()
         logger.info("Планировщик остановлен")
     
-    async def send_income_reminder(self):
-        """Отправить напоминание о записи пополнений"""
-        logger.info("Отправка напоминаний о пополнениях...")
+    async def dispatch_slot(self):
+        """
+        Разослать напоминания пользователям текущего слота.
         
-        async with async_session_maker() as session:
-            result = await session.execute(select(User))
-            users = result.scalars().all()
+        Пользователи слота делятся на REMINDER_SHARDS шардов по telegram_id.
+        Каждая реплика по очереди захватывает свободные шарды (INSERT в reminder_claims
+        с ON CONFLICT DO NOTHING) и рассылает только их - так каждое напоминание
+        уходит ровно один раз, а работа распределяется между репликами.
+        """
+        slot_at = datetime.utcnow().replace(second=0, microsecond=0)
+        slot = current_slot(slot_at)
+        
+        # Каждая реплика начинает со своего шарда, чтобы реже конкурировать за один и тот же
+        offset = zlib.crc32(NODE_ID.encode()) % REMINDER_SHARDS
+        for i in range(REMINDER_SHARDS):
+            shard = (offset + i) % REMINDER_SHARDS
+            if not await self._claim_shard(slot_at, shard):
+                continue
             
-            for user in users:
-                try:
-                    message_text = (
-                        "🌅 Доброе утро!\n\n"
-                        "Были ли вчера пополнения счета?\n\n"
-                        "Если да - используй команду /income\n"
-                        "Если нет - можешь пропустить это напоминание"
-                    )
-                    
-                    await self.bot.send_message(
-                        chat_id=user.telegram_id,
-                        text=message_text
-                    )
-                    
-                    logger.debug(f"Напоминание о пополнении отправлено пользователю {user.telegram_id}")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка отправки напоминания пользователю {user.telegram_id}: {e}")
+            await self.send_income_reminder(slot, shard)
+            await self.send_expense_reminder(slot, shard)
     
-    async def send_expense_reminder(self):
-        """Отправить напоминание о записи расходов"""
-        logger.info("Отправка напоминаний о расходах...")
+    async def _claim_shard(self, slot_at: datetime, shard: int) -> bool:
+        """Захватить шард слота. False - его уже забрала другая реплика"""
+        async with async_session_maker() as session:
+            result = await session.execute(
+                insert(ReminderClaim)
+                .values(slot_at=slot_at, shard=shard, node=NODE_ID, claimed_at=datetime.utcnow())
+                .on_conflict_do_nothing()
+                .returning(ReminderClaim.shard)
+            )
+            claimed = result.first() is not None
+            await session.commit()
+            return claimed
+    
+    async def refresh_slots(self):
+        """Пересчитать слоты напоминаний, удалить устаревшие служебные записи и создать секции transactions"""
+        async with async_session_maker() as session:
+            await refresh_reminder_slots(session)
+            await session.execute(
+                delete(ReminderClaim).where(ReminderClaim.slot_at < datetime.utcnow() - timedelta(days=1))
+            )
+            # Истекшие коды привязки, оставшиеся от перезапущенных реплик
+            await invite_store.cleanup_all(session)
+            await session.commit()
+            # Секции transactions на ближайшие месяцы (на случай долгой работы без перезапуска)
+            await ensure_future_partitions(session)
+            await session.commit()
+    
+    async def send_income_reminder(self, slot: int | None = None, shard: int | None = None):
+        """Отправить напоминание о записи пополнений (slot=None - всем пользователям, shard=None - всем шардам)"""
+        query = select(User.telegram_id)
+        if slot is not None:
+            query = query.where(User.income_slot == slot)
+        if shard is not None:
+            query = query.where(User.telegram_id % REMINDER_SHARDS == shard)
+        
+        logger.debug(f"Отправка напоминаний о пополнениях (слот {slot}, шард {shard})...")
+        
+        message_text = (
+            "🌅 Доброе утро!\n\n"
+            "Были ли вчера пополнения счета?\n\n"
+            "Если да - используй команду /income\n"
+            "Если нет - можешь пропустить это напоминание"
+        )
+        
+        async def messages(session: AsyncSession):
+            result = await session.stream(
+                query.execution_options(yield_per=STREAM_CHUNK_SIZE)
+            )
+            async for telegram_id in result.scalars():
+                yield {"chat_id": telegram_id, "text": message_text}
         
         async with async_session_maker() as session:
-            result = await session.execute(select(User))
-            users = result.scalars().all()
-            
-            for user in users:
-                try:
-                    # Получаем семью пользователя для показа баланса
-                    family_result = await session.execute(
-                        select(Family).where(Family.id == user.family_id)
-                    )
-                    family = family_result.scalar_one_or_none()
-                    
-                    if family:
-                        balance_text = f"💰 Семейный баланс: <b>{float(family.current_balance):.2f} ₽</b>"
-                    else:
-                        balance_text = ""
-                    
-                    message_text = (
-                        "🌙 Добрый вечер!\n\n"
-                        "Сколько потратил(а) сегодня?\n\n"
-                        "Запиши расходы с помощью команды /expense\n\n"
-                        f"{balance_text}"
-                    )
-                    
-                    await self.bot.send_message(
-                        chat_id=user.telegram_id,
-                        text=message_text,
-                        parse_mode="HTML"
-                    )
-                    
-                    logger.debug(f"Напоминание о расходах отправлено пользователю {user.telegram_id}")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка отправки напоминания пользователю {user.telegram_id}: {e}")
-
-
-
-
-
+            stats = await self.broadcaster.broadcast("income_reminder", messages(session))
+        record_reminder_metrics("income", stats)
+        return stats
+    
+    async def send_expense_reminder(self, slot: int | None = None, shard: int | None = None):
+        """Отправить напоминание о записи расходов (slot=None - всем пользователям, shard=None - всем шардам)"""
+        query = (
+            select(User.telegram_id, Family.current_balance)
+            .outerjoin(Family, Family.id == User.family_id)
+        )
+        if slot is not None:
+            query = query.where(User.expense_slot == slot)
+        if shard is not None:
+            query = query.where(User.telegram_id % REMINDER_SHARDS == shard)
+        
+        logger.debug(f"Отправка напоминаний о расходах (слот {slot}, шард {shard})...")
+        
+        async def messages(session: AsyncSession):
+            # Один запрос с JOIN вместо запроса семьи на каждого пользователя,
+            # строки читаются серверным курсором порциями
+            result = await session.stream(
+                query.execution_options(yield_per=STREAM_CHUNK_SIZE)
+            )
+            async for telegram_id, current_balance in result:
+                if current_balance is not None:
+                    balance_text = f"💰 Семейный баланс: <b>{float(current_balance):.2f} ₽</b>"
+                else:
+                    balance_text = ""
+                
+                message_text = (
+                    "🌙 Добрый вечер!\n\n"
+                    "Сколько потратил(а) сегодня?\n\n"
+                    "Запиши расходы с помощью команды /expense\n\n"
+                    f"{balance_text}"
+                )
+                yield {
+                    "chat_id": telegram_id,
+                    "text": message_text,
+                    "parse_mode": "HTML"
+                }
+        
+        async with async_session_maker() as session:
+            stats = await self.broadcaster.broadcast("expense_reminder", messages(session))
+        record_reminder_metrics("expense", stats)
+        return stats
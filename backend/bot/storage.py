@@ -0,0 +1,167 @@
+"""
+Хранилище состояний FSM в PostgreSQL
+"""
+import asyncio
+import copy
+import logging
+from datetime import datetime
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from backend.config import FSM_FLUSH_INTERVAL, FSM_CACHE_SIZE, FSM_CACHE_TTL, FSM_CACHE
+from backend.db.database import async_session_maker
+from backend.db.models import FsmState
+from backend.bot.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def storage_key(key: StorageKey) -> str:
+    """Компактный строковый ключ записи"""
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    if key.thread_id is not None:
+        parts.append(f"t{key.thread_id}")
+    if key.business_connection_id is not None:
+        parts.append(f"b{key.business_connection_id}")
+    parts.append(key.destiny)
+    return ":".join(parts)
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM-хранилище с write-behind кэшем.
+
+    Чтения обслуживаются из памяти (в БД идем только при промахе кэша),
+    записи копятся в памяти и раз в flush_interval секунд сбрасываются
+    в таблицу fsm_states одним пакетным upsert. Пустые записи
+    (нет состояния и данных) удаляются, поэтому таблица хранит
+    только незавершенные диалоги.
+
+    Кэш годится только для одной реплики: соседняя реплика не увидит ни
+    отложенную запись, ни смену состояния. С cached=False (несколько реплик
+    за webhook) каждое чтение идет в БД, а каждая запись сразу сохраняется.
+    """
+
+    def __init__(
+        self,
+        session_maker: async_sessionmaker = async_session_maker,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        cached: bool = FSM_CACHE == 'local',
+    ):
+        self.session_maker = session_maker
+        self.flush_interval = flush_interval
+        self.cached = cached
+        # key -> (state, data): прочитанные и сохраненные записи
+        self._cache = TTLCache(maxsize=FSM_CACHE_SIZE, ttl=FSM_CACHE_TTL)
+        # key -> (state, data): записи, еще не сброшенные в БД
+        self._dirty: dict[str, tuple[str | None, dict[str, Any]]] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    async def _get_record(self, key: StorageKey) -> tuple[str | None, dict[str, Any]]:
+        key_str = storage_key(key)
+
+        record = None
+        if self.cached:
+            record = self._dirty.get(key_str)
+            if record is None:
+                record = self._cache.get(key_str)
+        if record is None:
+            async with self.session_maker() as session:
+                result = await session.execute(
+                    select(FsmState.state, FsmState.data).where(FsmState.key == key_str)
+                )
+                row = result.first()
+            record = (row.state, row.data or {}) if row else (None, {})
+            if self.cached:
+                self._cache.set(key_str, record)
+
+        return record
+
+    async def _put_record(self, key: StorageKey, state: str | None, data: dict[str, Any]):
+        key_str = storage_key(key)
+        record = (state, data)
+        self._dirty[key_str] = record
+        if not self.cached:
+            # Запись видна другим репликам до ответа пользователю
+            await self.flush()
+            return
+
+        self._cache.set(key_str, record)
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._get_record(key)
+        await self._put_record(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._get_record(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        state, _ = await self._get_record(key)
+        await self._put_record(key, state, copy.deepcopy(data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._get_record(key)
+        return copy.deepcopy(data)
+
+    async def _flush_loop(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка сохранения состояний FSM: {e}")
+
+    async def flush(self):
+        """Сбросить накопленные изменения в БД"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+
+            batch, self._dirty = self._dirty, {}
+            now = datetime.utcnow()
+            upserts = [
+                {"key": key, "state": state, "data": data, "updated_at": now}
+                for key, (state, data) in batch.items()
+                if state is not None or data
+            ]
+            deletes = [key for key, (state, data) in batch.items() if state is None and not data]
+
+            try:
+                async with self.session_maker() as session:
+                    if upserts:
+                        stmt = insert(FsmState).values(upserts)
+                        await session.execute(
+                            stmt.on_conflict_do_update(
+                                index_elements=[FsmState.key],
+                                set_={
+                                    "state": stmt.excluded.state,
+                                    "data": stmt.excluded.data,
+                                    "updated_at": stmt.excluded.updated_at,
+                                }
+                            )
+                        )
+                    if deletes:
+                        await session.execute(delete(FsmState).where(FsmState.key.in_(deletes)))
+                    await session.commit()
+            except Exception:
+                # Возвращаем несохраненное, не затирая более свежие изменения
+                for key, record in batch.items():
+                    self._dirty.setdefault(key, record)
+                raise
+
+            logger.debug(f"Состояния FSM сохранены: {len(upserts)} записано, {len(deletes)} удалено")
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
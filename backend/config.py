@@ -2,6 +2,7 @@
 Конфигурация бота
 """
 import os
+import socket
 from pathlib import Path
 from urllib.parse import quote_plus
 from dotenv import load_dotenv
@@ -32,7 +33,67 @@ DAILY_EXPENSE_TIME = os.getenv('DAILY_EXPENSE_TIME', '20:00')  # Вечером
 # Timezone
 TIMEZONE = os.getenv('TIMEZONE', 'Europe/Moscow')
 
+# Массовая рассылка (лимиты Telegram: ~30 msg/s глобально, 1 msg/s в один чат)
+# Лимит общий на токен бота: рассылка и очередь сообщений берут токены из одного bucket,
+# при нескольких репликах дели BROADCAST_RATE между ними
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '30'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '25'))
+BROADCAST_CHAT_INTERVAL = float(os.getenv('BROADCAST_CHAT_INTERVAL', '1.0'))
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
 
+# Очередь исходящих сообщений (ответы обработчиков и недоставленные напоминания)
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '20'))
+OUTBOX_MAX_PENDING = int(os.getenv('OUTBOX_MAX_PENDING', '10000'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '6'))
+OUTBOX_RETRY_BACKOFF = float(os.getenv('OUTBOX_RETRY_BACKOFF', '1.0'))
+OUTBOX_MAX_BACKOFF = float(os.getenv('OUTBOX_MAX_BACKOFF', '60'))
+# Как часто продлевать аренду своих сообщений в outbox_messages и забирать чужие,
+# оставшиеся от остановленных или упавших реплик
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '30'))
+# Аренда сообщения репликой (секунды, больше OUTBOX_POLL_INTERVAL): по ее истечении
+# сообщение упавшей реплики доставляет другая
+OUTBOX_LEASE = float(os.getenv('OUTBOX_LEASE', '120'))
+OUTBOX_DRAIN_TIMEOUT = float(os.getenv('OUTBOX_DRAIN_TIMEOUT', '10'))
 
+# Несколько реплик бота: пользователи делятся на шарды по telegram_id,
+# каждый шард каждой минуты рассылает ровно одна реплика
+REMINDER_SHARDS = int(os.getenv('REMINDER_SHARDS', '16'))
+NODE_ID = os.getenv('NODE_ID', socket.gethostname())
 
+# Кэш telegram_id -> (пользователь, семья) для обработчиков
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', '10000'))
+IDENTITY_CACHE_TTL = float(os.getenv('IDENTITY_CACHE_TTL', '300'))
 
+# Хранилище состояний FSM: postgres (переживает перезапуск) или memory
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'postgres')
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '1.0'))
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))
+FSM_CACHE_TTL = float(os.getenv('FSM_CACHE_TTL', '600'))
+
+# Кэш отчетов /stats по семьям (сбрасывается при записи, TTL - на случай записи другой репликой)
+STATS_CACHE_SIZE = int(os.getenv('STATS_CACHE_SIZE', '10000'))
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', '60'))
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Кэш состояний FSM: local - кэш в памяти и отложенная запись (только одна реплика,
+# как при polling), shared - каждое чтение и запись сразу в БД (несколько реплик за webhook)
+FSM_CACHE = os.getenv('FSM_CACHE', 'shared' if BOT_MODE == 'webhook' else 'local')
+# Публичный адрес бота (https://bot.example.com); пустой - webhook в Telegram не регистрируется
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Секрет, который Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8080'))
+# Сколько обновлений обрабатывается одновременно (не больше, чем выдержит пул БД)
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', '25'))
+# Сколько параллельных соединений Telegram открывает к webhook
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Порт HTTP-сервера метрик Prometheus (GET /metrics), 0 - выключить
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+
+# Запросы дольше этого порога (секунды) пишутся в лог вместе с обработчиком
+SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', '0.2'))
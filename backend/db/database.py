@@ -1,21 +1,45 @@
 """
 Настройка подключения к базе данных
 """
+import time
+
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from backend.config import DATABASE_URL
+from backend.metrics import registry, db_pool_wait
+from backend.db.instrumentation import instrument_engine
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул, который измеряет ожидание свободного соединения"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_wait.observe(time.perf_counter() - started)
+
 
 # Создаем async engine
 engine = create_async_engine(
     DATABASE_URL,
     echo=False,  # Если True - будет логировать все SQL запросы
     future=True,
+    poolclass=TimedQueuePool,
     pool_pre_ping=True,
     pool_size=10,
     max_overflow=20
 )
 
+registry.gauge("db_pool_in_use", "Соединения, выданные из пула", callback=lambda: engine.pool.checkedout())
+registry.gauge("db_pool_size", "Размер пула соединений", callback=lambda: engine.pool.size())
+
+# Время запросов, их учет по обработчикам и лог медленных запросов
+instrument_engine(engine.sync_engine)
+
 # Создаем фабрику сессий
 async_session_maker = async_sessionmaker(
     engine,
@@ -34,18 +58,13 @@ async def get_session() -> AsyncSession:
 
 
 async def init_db():
-    """Инициализация БД - создание всех таблиц и миграция данных"""
-    # Импортируем модели чтобы они зарегистрировались
-    from backend.db.models import User, Transaction, Family, TransactionType
+    """
+    Инициализация БД - проверка версии схемы и быстрые миграции.
+    Если схема актуальна, это один запрос; долгие миграции - python -m backend.db.migrate
+    """
+    from backend.db.migrate import run_migrations
     
-    # Создаем таблицы
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    
-    # Выполняем миграцию данных если нужно
-    from backend.db.migrate import migrate_to_family_wallet
-    async with async_session_maker() as session:
-        await migrate_to_family_wallet(session)
+    await run_migrations()
 
 
 async def close_db():
@@ -0,0 +1,135 @@
+"""
+Потоковая выгрузка транзакций семьи в CSV/XLSX
+"""
+import asyncio
+import csv
+import io
+from datetime import date, datetime, time
+from tempfile import SpooledTemporaryFile
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.db.models import Transaction, TransactionType
+
+try:
+    import openpyxl
+except ImportError:  # XLSX - необязательная зависимость
+    openpyxl = None
+
+# Строк за одно чтение серверного курсора и одну запись в файл
+EXPORT_CHUNK_SIZE = 1000
+
+# До этого размера файл держится в памяти, дальше - во временном файле на диске
+SPOOL_MAX_SIZE = 1024 * 1024
+
+EXPORT_HEADER = ("Дата", "Тип", "Сумма", "Описание", "Кто добавил")
+
+TYPE_TITLES = {TransactionType.INCOME: "Пополнение", TransactionType.EXPENSE: "Расход"}
+
+
+def export_row(created_at: datetime, transaction_type: TransactionType, amount, description, user_name) -> tuple:
+    """Строка выгрузки из колонок транзакции"""
+    return (
+        created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        TYPE_TITLES[transaction_type],
+        amount,
+        description or "",
+        user_name or "",
+    )
+
+
+class CsvWriter:
+    """CSV в UTF-8 с BOM (чтобы Excel открыл кириллицу), разделитель - точка с запятой"""
+
+    def __init__(self, file):
+        self._text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._text, delimiter=';')
+        self._writer.writerow(EXPORT_HEADER)
+
+    def write_rows(self, rows):
+        self._writer.writerows(export_row(*row) for row in rows)
+
+    def close(self):
+        self._text.flush()
+        # Файл остается открытым - его закрывает владелец
+        self._text.detach()
+
+
+class XlsxWriter:
+    """XLSX через write-only книгу openpyxl (строки не копятся в памяти)"""
+
+    def __init__(self, file):
+        self._file = file
+        self._workbook = openpyxl.Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("Транзакции")
+        self._sheet.append(EXPORT_HEADER)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._sheet.append(export_row(*row))
+
+    def close(self):
+        self._workbook.save(self._file)
+
+
+WRITERS = {"csv": CsvWriter, "xlsx": XlsxWriter}
+
+
+def available_formats() -> tuple[str, ...]:
+    """Форматы выгрузки, доступные в этой установке"""
+    if openpyxl is None:
+        return ("csv",)
+    return tuple(WRITERS)
+
+
+async def export_transactions(
+    session: AsyncSession,
+    family_id: int,
+    export_format: str = "csv",
+    start: date | None = None,
+    end: date | None = None,
+) -> tuple[SpooledTemporaryFile, int]:
+    """
+    Выгрузить транзакции семьи за дни [start, end) (без границ - все) от старых к новым.
+
+    Строки читаются серверным курсором пачками по EXPORT_CHUNK_SIZE, каждая пачка
+    пишется в SpooledTemporaryFile в отдельном потоке - ни все строки, ни запись
+    файла не держат память и event loop. Возвращает файл (позиция в начале,
+    закрывает вызывающий) и число строк.
+    """
+    if export_format not in available_formats():
+        raise ValueError(f"Формат недоступен: {export_format}")
+
+    query = (
+        select(
+            Transaction.created_at,
+            Transaction.transaction_type,
+            Transaction.amount,
+            Transaction.description,
+            Transaction.user_name,
+        )
+        .where(Transaction.family_id == family_id)
+        .order_by(Transaction.created_at, Transaction.id)
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+    if start is not None:
+        query = query.where(Transaction.created_at >= datetime.combine(start, time.min))
+    if end is not None:
+        query = query.where(Transaction.created_at < datetime.combine(end, time.min))
+
+    file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        writer = await asyncio.to_thread(WRITERS[export_format], file)
+        count = 0
+        result = await session.stream(query)
+        async for rows in result.partitions():
+            await asyncio.to_thread(writer.write_rows, rows)
+            count += len(rows)
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        file.close()
+        raise
+
+    file.seek(0)
+    return file, count
@@ -0,0 +1,100 @@
+"""
+Постраничная история транзакций на keyset-курсорах
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.db.models import Transaction
+
+# Транзакций на странице
+HISTORY_PAGE_SIZE = 10
+
+EPOCH = datetime(1970, 1, 1)
+
+
+@dataclass(frozen=True)
+class HistoryCursor:
+    """Позиция в истории: (created_at, id) транзакции"""
+    created_at: datetime
+    id: int
+
+    def encode(self) -> str:
+        microseconds = (self.created_at - EPOCH) // timedelta(microseconds=1)
+        return f"{microseconds}:{self.id}"
+
+    @classmethod
+    def decode(cls, value: str) -> "HistoryCursor":
+        """Разобрать курсор (ValueError если формат неверный)"""
+        microseconds, tx_id = value.split(':')
+        return cls(created_at=EPOCH + timedelta(microseconds=int(microseconds)), id=int(tx_id))
+
+    @classmethod
+    def of(cls, transaction: Transaction) -> "HistoryCursor":
+        return cls(created_at=transaction.created_at, id=transaction.id)
+
+
+@dataclass
+class HistoryPage:
+    """Страница истории (от новых к старым)"""
+    transactions: list[Transaction]
+    has_older: bool
+    has_newer: bool
+
+    @property
+    def older_cursor(self) -> HistoryCursor:
+        return HistoryCursor.of(self.transactions[-1])
+
+    @property
+    def newer_cursor(self) -> HistoryCursor:
+        return HistoryCursor.of(self.transactions[0])
+
+
+async def fetch_history_page(
+    session: AsyncSession,
+    family_id: int,
+    older_than: HistoryCursor | None = None,
+    newer_than: HistoryCursor | None = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> HistoryPage:
+    """
+    Получить страницу истории семьи.
+
+    Без курсора - самые свежие транзакции, older_than - следующая страница вглубь,
+    newer_than - предыдущая. Условие (created_at, id) < курсор и сортировка
+    совпадают с индексом (family_id, created_at DESC, id DESC), поэтому
+    любая страница читает из индекса только limit + 1 строк, без OFFSET.
+    """
+    position = tuple_(Transaction.created_at, Transaction.id)
+    query = select(Transaction).where(Transaction.family_id == family_id)
+
+    if newer_than is not None:
+        result = await session.execute(
+            query
+            .where(position > tuple_(newer_than.created_at, newer_than.id))
+            .order_by(Transaction.created_at.asc(), Transaction.id.asc())
+            .limit(limit + 1)
+        )
+        transactions = list(result.scalars().all())
+        has_newer = len(transactions) > limit
+        transactions = transactions[:limit]
+        transactions.reverse()
+        return HistoryPage(transactions=transactions, has_older=True, has_newer=has_newer)
+
+    if older_than is not None:
+        query = query.where(position < tuple_(older_than.created_at, older_than.id))
+
+    result = await session.execute(
+        query
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .limit(limit + 1)
+    )
+    transactions = list(result.scalars().all())
+    has_older = len(transactions) > limit
+    return HistoryPage(
+        transactions=transactions[:limit],
+        has_older=has_older,
+        has_newer=older_than is not None
+    )
@@ -0,0 +1,326 @@
+"""
+Массовый импорт транзакций из CSV через COPY
+
+Формат - как у /export: Дата;Тип;Сумма;Описание;Кто добавил (первая строка - заголовок,
+разделитель ";" или ","). Тип - "Пополнение"/"Расход" (или income/expense); если он
+пустой, расход задается отрицательной суммой.
+
+Запуск из командной строки:
+    python -m backend.db.importer FILE.csv --family-id N --telegram-id M [--user-name NAME]
+"""
+import argparse
+import asyncio
+import csv
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import AsyncIterator, Iterable, Iterator
+
+from sqlalchemy import Table, Column, MetaData, String, Numeric, DateTime, select, update, insert, func, case, cast, literal, true
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.db.ledger import parse_amount, is_member, MAX_AMOUNT
+from backend.db.models import Family, Transaction, TransactionType, FamilyDailyTotal
+from backend.db.rollups import upsert_totals
+from backend.db.partitions import ensure_partitions
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк разбирать подряд, прежде чем отдать управление event loop
+IMPORT_CHUNK_SIZE = 5000
+
+# Сколько ошибок показывать пользователю (остальные только считаются)
+MAX_IMPORT_ERRORS = 10
+
+DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%d.%m.%Y %H:%M", "%d.%m.%Y")
+
+# Допустимые даты операций: под каждый месяц импорт создает секцию transactions,
+# поэтому опечатка вроде 0001-01-01 не должна порождать тысячи секций
+IMPORT_MIN_DATE = datetime(2000, 1, 1)
+IMPORT_MAX_DAYS_AHEAD = 366
+
+TYPE_NAMES = {
+    "пополнение": TransactionType.INCOME,
+    "доход": TransactionType.INCOME,
+    "income": TransactionType.INCOME,
+    "расход": TransactionType.EXPENSE,
+    "expense": TransactionType.EXPENSE,
+}
+
+# Временная таблица, в которую COPY грузит файл (исчезает при коммите)
+import_staging = Table(
+    "import_staging",
+    MetaData(),
+    Column("created_at", DateTime, nullable=False),
+    Column("transaction_type", String(16), nullable=False),
+    Column("amount", Numeric(15, 2), nullable=False),
+    Column("description", String(500)),
+    Column("user_name", String(255)),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+class ImportFormatError(ValueError):
+    """Файл не прошел проверку (ничего не импортировано)"""
+
+    def __init__(self, errors: list[str], total: int):
+        self.errors = errors
+        self.total = total
+        super().__init__(f"Ошибок в файле: {total}")
+
+
+@dataclass
+class ImportRow:
+    """Проверенная строка файла"""
+    created_at: datetime
+    transaction_type: TransactionType
+    amount: Decimal
+    description: str | None
+    user_name: str | None
+
+
+@dataclass
+class ImportResult:
+    """Итог импорта"""
+    count: int
+    balance: Decimal
+
+
+def parse_date(value: str) -> datetime:
+    """Дата операции в одном из DATE_FORMATS (ValueError если не подходит ни один)"""
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f"неизвестный формат даты {value!r}")
+
+
+def parse_import_row(row: list[str]) -> ImportRow:
+    """Разобрать строку файла (ValueError с причиной)"""
+    if len(row) < 3:
+        raise ValueError("нужны хотя бы дата, тип и сумма")
+
+    created_at = parse_date(row[0].strip())
+    if not IMPORT_MIN_DATE <= created_at <= datetime.utcnow() + timedelta(days=IMPORT_MAX_DAYS_AHEAD):
+        raise ValueError(f"дата {row[0].strip()!r} вне допустимого диапазона")
+
+    amount = parse_amount(row[2].replace(' ', '').replace('\xa0', ''))
+    type_name = row[1].strip().lower()
+    if type_name:
+        if type_name not in TYPE_NAMES:
+            raise ValueError(f"неизвестный тип {row[1]!r}")
+        transaction_type = TYPE_NAMES[type_name]
+    else:
+        transaction_type = TransactionType.EXPENSE if amount < 0 else TransactionType.INCOME
+
+    amount = abs(amount)
+    if amount == 0:
+        raise ValueError("сумма должна быть больше нуля")
+    if amount > MAX_AMOUNT:
+        raise ValueError("сумма слишком большая")
+
+    description = row[3].strip()[:500] if len(row) > 3 else ""
+    user_name = row[4].strip()[:255] if len(row) > 4 else ""
+    return ImportRow(created_at, transaction_type, amount, description or None, user_name or None)
+
+
+def read_import_rows(lines: Iterable[str]) -> Iterator[ImportRow]:
+    """
+    Потоково разобрать CSV: строки отдаются по мере чтения, файл целиком в памяти не держится.
+
+    Ошибочные строки копятся; если они были, в конце бросается ImportFormatError -
+    вызывающий откатывает транзакцию, и ничего не импортируется.
+    """
+    lines = iter(lines)
+    header = next(lines, None)
+    if header is None:
+        raise ImportFormatError(["файл пустой"], 1)
+
+    delimiter = ';' if header.count(';') >= header.count(',') else ','
+    errors = []
+    total_errors = 0
+
+    # Номер строки файла: заголовок - 1-я строка
+    for number, row in enumerate(csv.reader(lines, delimiter=delimiter), start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            yield parse_import_row(row)
+        except ValueError as e:
+            total_errors += 1
+            if len(errors) < MAX_IMPORT_ERRORS:
+                errors.append(f"Строка {number}: {e}")
+
+    if total_errors:
+        raise ImportFormatError(errors, total_errors)
+
+
+async def staging_records(rows: Iterable[ImportRow]) -> AsyncIterator[tuple]:
+    """Строки для COPY; каждые IMPORT_CHUNK_SIZE строк отдает управление event loop"""
+    for number, row in enumerate(rows, start=1):
+        yield (row.created_at, row.transaction_type.name, row.amount, row.description, row.user_name)
+        if number % IMPORT_CHUNK_SIZE == 0:
+            await asyncio.sleep(0)
+
+
+async def prepare_partitions(session: AsyncSession, first: datetime, last: datetime):
+    """
+    Создать секции transactions для дат импорта в отдельной транзакции и сразу закоммитить.
+
+    ATTACH PARTITION берет ACCESS EXCLUSIVE на секцию по умолчанию: внутри транзакции
+    импорта блокировка держалась бы до ее коммита и останавливала /history, /export
+    и слияния семей всех пользователей. Транзакция импорта к этому моменту
+    transactions не трогала, поэтому отдельное соединение ее не ждет. Если импорт
+    потом откатится, останутся только пустые секции.
+    """
+    async with AsyncSession(session.bind) as partition_session:
+        await ensure_partitions(partition_session, first.date(), last.date())
+        await partition_session.commit()
+
+
+async def import_transactions(
+    session: AsyncSession,
+    family_id: int,
+    telegram_id: int,
+    user_name: str,
+    rows: Iterable[ImportRow],
+) -> ImportResult | None:
+    """
+    Импортировать транзакции в семью.
+
+    Строки грузятся бинарным COPY во временную таблицу, для их месяцев создаются
+    секции transactions (в отдельной короткой транзакции, см. prepare_partitions),
+    затем один оператор прибавляет их сумму к балансу семьи,
+    переносит их в transactions и обновляет дневные итоги - стоимость не зависит
+    от числа строк на стороне Python. Вставки идут из RETURNING обновления семьи,
+    поэтому для исчезнувшей семьи (или если telegram_id в ней больше не состоит)
+    ничего не записывается.
+    Все операции приписываются telegram_id; имя берется из файла или user_name.
+    Коммит - на вызывающем (при ImportFormatError нужно откатить).
+    Возвращает итог или None, если семьи нет или telegram_id не ее участник.
+    """
+    connection = await session.connection()
+    await connection.run_sync(import_staging.create)
+
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        import_staging.name,
+        records=staging_records(rows),
+        columns=[column.name for column in import_staging.columns],
+    )
+
+    staged = import_staging.c
+
+    # Старая история попадает в свои месячные секции, а не в секцию по умолчанию
+    result = await session.execute(select(func.min(staged.created_at), func.max(staged.created_at)))
+    first, last = result.one()
+    if first is not None:
+        await prepare_partitions(session, first, last)
+
+    transaction_type = cast(staged.transaction_type, Transaction.transaction_type.type)
+    is_income = staged.transaction_type == TransactionType.INCOME.name
+
+    delta = select(
+        func.coalesce(func.sum(case((is_income, staged.amount), else_=-staged.amount)), 0)
+    ).scalar_subquery()
+
+    # Источник вставок - RETURNING обновления семьи: если семьи уже нет (слита или
+    # удалена) или пользователь из нее вышел, обновление не вернет строк и ничего
+    # не будет записано
+    balance_update = (
+        update(Family)
+        .where(Family.id == family_id, is_member(telegram_id))
+        .values(current_balance=Family.current_balance + delta, updated_at=datetime.utcnow())
+        .returning(Family.id, Family.current_balance)
+        .cte("balance_update")
+    )
+
+    moved = (
+        insert(Transaction)
+        .from_select(
+            ["family_id", "telegram_id", "user_name", "transaction_type", "amount", "description", "created_at"],
+            select(
+                balance_update.c.id,
+                literal(telegram_id, Transaction.telegram_id.type),
+                func.coalesce(staged.user_name, literal(user_name, Transaction.user_name.type)),
+                transaction_type,
+                staged.amount,
+                staged.description,
+                staged.created_at,
+            )
+            .select_from(balance_update.join(import_staging, true()))
+            .order_by(staged.created_at)
+        )
+        .returning(Transaction.id)
+        .cte("moved")
+    )
+
+    day = func.date(staged.created_at)
+    totals_upsert = upsert_totals(
+        select(
+            balance_update.c.id,
+            day,
+            literal(telegram_id, FamilyDailyTotal.telegram_id.type),
+            func.coalesce(func.sum(case((is_income, staged.amount))), 0),
+            func.coalesce(func.sum(case((~is_income, staged.amount))), 0),
+            func.count(),
+        )
+        .select_from(balance_update.join(import_staging, true()))
+        .group_by(balance_update.c.id, day)
+    ).cte("totals_upsert")
+
+    count = select(func.count()).select_from(moved).scalar_subquery()
+
+    result = await session.execute(
+        select(balance_update.c.current_balance, count).add_cte(moved, totals_upsert)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return None
+    balance, imported = row
+    return ImportResult(count=imported, balance=balance)
+
+
+async def main():
+    """CLI: импорт CSV в семью"""
+    from backend.db.database import async_session_maker, close_db
+
+    parser = argparse.ArgumentParser(description="Импорт транзакций из CSV")
+    parser.add_argument("file", help="CSV в формате /export")
+    parser.add_argument("--family-id", type=int, required=True, help="Семья, в которую импортировать")
+    parser.add_argument("--telegram-id", type=int, required=True, help="Кому приписать операции (участник семьи)")
+    parser.add_argument("--user-name", default="Импорт", help="Имя, если в файле не указано")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    try:
+        async with async_session_maker() as session:
+            with open(args.file, encoding='utf-8-sig', newline='') as file:
+                try:
+                    result = await import_transactions(
+                        session, args.family_id, args.telegram_id, args.user_name, read_import_rows(file)
+                    )
+                except ImportFormatError as e:
+                    await session.rollback()
+                    for error in e.errors:
+                        logger.error(error)
+                    logger.error(f"{e}, ничего не импортировано")
+                    return
+
+            if result is None:
+                await session.rollback()
+                logger.error(f"Семья {args.family_id} не найдена или {args.telegram_id} в ней не состоит")
+                return
+
+            await session.commit()
+        logger.info(f"Импортировано {result.count} операций, баланс семьи: {result.balance}")
+    finally:
+        await close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""
+Учет SQL-запросов по обработчикам: число и время запросов, лог медленных запросов
+
+Обработчик (или любой блок кода) оборачивается в track_queries(name) - все запросы
+внутри, включая запросы из вложенных корутин той же задачи, попадают в его счет
+через contextvar. В тестах query_budget(n) падает, если запросов больше n.
+"""
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from backend.config import SLOW_QUERY_THRESHOLD
+from backend.metrics import db_query_duration
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueryStats:
+    """Запросы одного обработчика (или одного блока track_queries)"""
+    name: str
+    count: int = 0
+    total_time: float = 0.0
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total_time += duration
+
+
+# Счет текущего обработчика (None - запрос вне track_queries, например из планировщика)
+current_queries: ContextVar[QueryStats | None] = ContextVar("current_queries", default=None)
+
+# Накопленная статистика: имя обработчика -> {"calls": ..., "queries": ..., "time": ...}
+handler_queries: dict[str, dict[str, float]] = defaultdict(lambda: {"calls": 0, "queries": 0, "time": 0.0})
+
+
+def statement_kind(statement: str) -> str:
+    """Тип оператора для метрик - первое слово: SELECT, INSERT, WITH, ..."""
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    # Время старта - в контексте выполнения: при ошибке он просто отбрасывается
+    context.query_started = time.perf_counter()
+
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "query_started", None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    db_query_duration.observe(duration, statement=statement_kind(statement))
+
+    stats = current_queries.get()
+    if stats is not None:
+        stats.add(duration)
+
+    if duration >= SLOW_QUERY_THRESHOLD:
+        handler = stats.name if stats is not None else "-"
+        logger.warning(f"Медленный запрос {duration * 1000:.0f} мс в {handler}: {' '.join(statement.split())[:500]}")
+
+
+def instrument_engine(engine: Engine):
+    """Подключить учет запросов к движку (для AsyncEngine - к engine.sync_engine)"""
+    event.listen(engine, "before_cursor_execute", _query_started)
+    event.listen(engine, "after_cursor_execute", _query_finished)
+
+
+@contextmanager
+def track_queries(name: str) -> Iterator[QueryStats]:
+    """Считать запросы блока на имя name и добавить их в handler_queries"""
+    stats = QueryStats(name)
+    token = current_queries.set(stats)
+    try:
+        yield stats
+    finally:
+        current_queries.reset(token)
+        totals = handler_queries[name]
+        totals["calls"] += 1
+        totals["queries"] += stats.count
+        totals["time"] += stats.total_time
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Блок выполнил больше запросов, чем разрешено"""
+
+
+@contextmanager
+def query_budget(max_queries: int, name: str = "query_budget") -> Iterator[QueryStats]:
+    """
+    Для тестов: упасть с QueryBudgetExceeded, если блок выполнил больше max_queries запросов.
+
+        with query_budget(2):
+            await cmd_start(message, session)
+    """
+    with track_queries(name) as stats:
+        yield stats
+    if stats.count > max_queries:
+        raise QueryBudgetExceeded(f"{name}: {stats.count} запросов при бюджете {max_queries}")
@@ -0,0 +1,237 @@
+"""
+Запись транзакций и изменение семейного баланса на стороне БД
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from sqlalchemy import select, update, insert, literal, case, values, column, true, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.db.models import Family, Transaction, TransactionType, User
+from backend.db.rollups import upsert_totals, totals_row, merge_totals
+
+# Максимальная сумма одной операции
+MAX_AMOUNT = Decimal('999999999')
+
+CENTS = Decimal('0.01')
+
+# Максимум операций в одном сообщении
+MAX_ENTRIES = 50
+
+# Строка пакетного ввода: "[+|-]сумма [описание]". Пробел внутри суммы - только
+# разделитель тысяч ("1 500"), иначе "350 2 пиццы" превратилось бы в 3502
+ENTRY_LINE = re.compile(
+    r'^([+-]?)\s*(\d{1,3}(?:[ \xa0]\d{3})+(?:[.,]\d+)?(?![\d.,])|\d+(?:[.,]\d+)?)\s*(.*)$'
+)
+
+
+def parse_amount(text: str) -> Decimal:
+    """Разобрать сумму из текста пользователя (ValueError если это не число)"""
+    try:
+        amount = Decimal(text.replace(',', '.').strip())
+    except InvalidOperation:
+        raise ValueError(f"Не число: {text!r}")
+
+    if not amount.is_finite():
+        raise ValueError(f"Не число: {text!r}")
+
+    return amount.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def signed_amount(transaction_type: TransactionType, amount: Decimal) -> Decimal:
+    """Изменение баланса от транзакции"""
+    return amount if transaction_type == TransactionType.INCOME else -amount
+
+
+@dataclass(frozen=True)
+class Entry:
+    """Одна операция из сообщения пользователя"""
+    transaction_type: TransactionType
+    amount: Decimal
+    description: str
+
+
+def parse_entries(text: str, default_type: TransactionType) -> list[Entry]:
+    """
+    Разобрать одну или несколько операций - по одной на строку.
+
+    Формат строки: "[+|-]сумма [описание]", например "350 продукты" или "+5000 зарплата".
+    "+" - пополнение, "-" - расход, без знака - default_type.
+    ValueError с номером строки, если строка не разбирается или сумма вне диапазона.
+    """
+    entries = []
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        raise ValueError("Пустое сообщение")
+    if len(lines) > MAX_ENTRIES:
+        raise ValueError(f"Не больше {MAX_ENTRIES} операций в одном сообщении")
+
+    for number, line in enumerate(lines, start=1):
+        match = ENTRY_LINE.match(line)
+        if match is None:
+            raise ValueError(f"Строка {number}: не могу распознать сумму")
+        sign, amount_text, description = match.groups()
+        try:
+            amount = parse_amount(amount_text.replace(' ', '').replace('\xa0', ''))
+        except ValueError:
+            raise ValueError(f"Строка {number}: не могу распознать сумму")
+        if amount <= 0:
+            raise ValueError(f"Строка {number}: сумма должна быть больше нуля")
+        if amount > MAX_AMOUNT:
+            raise ValueError(f"Строка {number}: сумма слишком большая")
+
+        if sign == '+':
+            transaction_type = TransactionType.INCOME
+        elif sign == '-':
+            transaction_type = TransactionType.EXPENSE
+        else:
+            transaction_type = default_type
+        entries.append(Entry(transaction_type, amount, description.strip()[:500]))
+
+    return entries
+
+
+def is_member(telegram_id: int):
+    """
+    Условие для UPDATE families: пользователь все еще состоит в обновляемой семье.
+
+    family_id в обработчиках берется из кэша реплики, а выход из семьи сбрасывает
+    кэш только на реплике, которая его обработала - проверка в самой записи
+    не дает дописывать операции в старую семью.
+    """
+    return exists().where(User.telegram_id == telegram_id, User.family_id == Family.id)
+
+
+async def record_transactions(
+    session: AsyncSession,
+    family_id: int,
+    telegram_id: int,
+    user_name: str,
+    entries: list[Entry],
+) -> Decimal | None:
+    """
+    Записать несколько транзакций и изменить баланс семьи одним запросом.
+
+    UPDATE families ... RETURNING (на сумму всех операций), INSERT INTO transactions
+    из VALUES со всеми операциями и upsert одной строки дневных итогов выполняются
+    в одном операторе (WITH ... ), баланс считается в БД - параллельные записи
+    двух членов семьи не теряют друг друга. Коммит - на вызывающем.
+    Возвращает новый баланс или None, если семьи нет или telegram_id в ней больше
+    не состоит (тогда ничего не записано).
+    """
+    delta = sum((signed_amount(entry.transaction_type, entry.amount) for entry in entries), Decimal('0'))
+    income = sum((entry.amount for entry in entries if entry.transaction_type == TransactionType.INCOME), Decimal('0'))
+    expense = sum((entry.amount for entry in entries if entry.transaction_type == TransactionType.EXPENSE), Decimal('0'))
+
+    balance_update = (
+        update(Family)
+        .where(Family.id == family_id, is_member(telegram_id))
+        .values(
+            current_balance=Family.current_balance + delta,
+            updated_at=datetime.utcnow()
+        )
+        .returning(Family.id, Family.current_balance)
+        .cte("balance_update")
+    )
+
+    created_at = datetime.utcnow()
+
+    rows = values(
+        column("transaction_type", Transaction.transaction_type.type),
+        column("amount", Transaction.amount.type),
+        column("description", Transaction.description.type),
+        name="entries"
+    ).data([(entry.transaction_type, entry.amount, entry.description) for entry in entries])
+
+    transaction_insert = (
+        insert(Transaction)
+        .from_select(
+            ["family_id", "telegram_id", "user_name", "transaction_type", "amount", "description", "created_at"],
+            select(
+                balance_update.c.id,
+                literal(telegram_id, Transaction.telegram_id.type),
+                literal(user_name, Transaction.user_name.type),
+                rows.c.transaction_type,
+                rows.c.amount,
+                rows.c.description,
+                literal(created_at, Transaction.created_at.type),
+            ).select_from(balance_update.join(rows, true()))
+        )
+        .cte("transaction_insert")
+    )
+
+    # Все операции сообщения - один день и один участник: итоги агрегируются заранее
+    totals_upsert = upsert_totals(
+        select(*totals_row(balance_update.c.id, created_at.date(), telegram_id, income, expense, len(entries)))
+    ).cte("totals_upsert")
+
+    result = await session.execute(
+        select(balance_update.c.current_balance).add_cte(transaction_insert, totals_upsert)
+    )
+    return result.scalar_one_or_none()
+
+
+async def record_transaction(
+    session: AsyncSession,
+    family_id: int,
+    telegram_id: int,
+    user_name: str,
+    transaction_type: TransactionType,
+    amount: Decimal,
+    description: str,
+) -> Decimal | None:
+    """Записать одну транзакцию (см. record_transactions)"""
+    return await record_transactions(
+        session, family_id, telegram_id, user_name, [Entry(transaction_type, amount, description)]
+    )
+
+
+async def merge_families(session: AsyncSession, source_family_id: int, target_family_id: int) -> Decimal | None:
+    """
+    Перенести баланс и историю семьи source в семью target.
+
+    Обе строки семей сначала блокируются (SELECT ... FOR UPDATE по возрастанию id,
+    чтобы встречные слияния не взаимоблокировались): запись в source, закоммиченная
+    во время слияния, иначе попала бы в историю target, но не в его баланс.
+    Баланс переносится одним UPDATE (source обнуляется, target получает его сумму),
+    транзакции - одним UPDATE transactions SET family_id = ..., дневные итоги -
+    одним upsert. Время и память не зависят от объема истории.
+    Коммит - на вызывающем. Возвращает новый баланс target или None, если семьи нет.
+    """
+    result = await session.execute(
+        select(Family.id, Family.current_balance)
+        .where(Family.id.in_([source_family_id, target_family_id]))
+        .order_by(Family.id)
+        .with_for_update()
+    )
+    locked = dict(result.all())
+    if source_family_id not in locked or target_family_id not in locked:
+        return None
+
+    transferred = literal(locked[source_family_id], Family.current_balance.type)
+    result = await session.execute(
+        update(Family)
+        .where(Family.id.in_([source_family_id, target_family_id]))
+        .values(
+            current_balance=case(
+                (Family.id == target_family_id, Family.current_balance + transferred),
+                else_=0
+            ),
+            updated_at=datetime.utcnow()
+        )
+        .returning(Family.id, Family.current_balance)
+        .execution_options(synchronize_session=False)
+    )
+    balances = dict(result.all())
+
+    await session.execute(
+        update(Transaction)
+        .where(Transaction.family_id == source_family_id)
+        .values(family_id=target_family_id)
+        .execution_options(synchronize_session=False)
+    )
+    await merge_totals(session, source_family_id, target_family_id)
+
+    return balances[target_family_id]
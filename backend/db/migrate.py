@@ -1,231 +1,463 @@
 """
-Скрипт миграции БД для семейного кошелька
+Миграции схемы БД
+
+Миграции зарегистрированы в MIGRATIONS по возрастанию версии, примененные версии
+записываются в schema_version. На старте бота выполняется один запрос к schema_version;
+если все версии применены, больше ничего не делается. Быстрые миграции применяются
+на старте, долгие (slow) - отдельной командой:
+    python -m backend.db.migrate [status]
 """
+import argparse
+import asyncio
 import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
 from sqlalchemy import text, inspect
+from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 logger = logging.getLogger(__name__)
 
 
-async def migrate_to_family_wallet(session: AsyncSession):
+# Пользователей/транзакций за одну пачку миграции семейного кошелька (каждая пачка - своя транзакция)
+FAMILY_MIGRATION_BATCH_SIZE = 5000
+
+
+async def add_foreign_key(session: AsyncSession, table: str, constraint: str, definition: str):
+    """
+    Добавить внешний ключ без долгой блокировки: NOT VALID (мгновенно),
+    затем VALIDATE CONSTRAINT (проверяет строки, не блокируя запись).
+    """
+    result = await session.execute(
+        text("""
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.table_constraints 
+                WHERE constraint_name = :constraint
+                AND table_name = :table
+            )
+        """),
+        {"constraint": constraint, "table": table}
+    )
+    if result.scalar():
+        return
+    
+    await session.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {constraint} {definition} NOT VALID"))
+    await session.commit()
+    await session.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {constraint}"))
+    await session.commit()
+    logger.info(f"Добавлен внешний ключ {constraint}")
+
+
+async def migrate_to_family_wallet(session: AsyncSession, batch_size: int = FAMILY_MIGRATION_BATCH_SIZE):
     """
     Миграция БД из личных кошельков в семейные.
     
     Выполняет:
-    1. Создание таблицы families (если не существует)
-    2. Добавление family_id в users
-    3. Создание семьи для каждого пользователя
-    4. Перенос балансов из users в families
-    5. Обновление transactions (добавление family_id, user_name)
+    1. Добавление family_id в users и transactions, user_name в transactions
+    2. Создание семьи для каждого пользователя без семьи с переносом баланса
+    3. Заполнение family_id и user_name в транзакциях
+    4. Внешние ключи на families
+    
+    Данные переносятся пачками по batch_size, каждая пачка - один оператор и
+    отдельная короткая транзакция: id семей выделяются nextval прямо в CTE,
+    INSERT INTO families и UPDATE users идут одним запросом. Прерванную миграцию
+    можно запустить снова - она продолжит с необработанных строк.
     """
     
     logger.info("Начало миграции БД...")
     
     try:
-        # Шаг 0: Добавляем необходимые колонки если их нет
-        logger.info("Проверка и добавление необходимых колонок...")
-        
-        # Добавляем family_id в users если его нет
-        await session.execute(
-            text("""
-                ALTER TABLE users 
-                ADD COLUMN IF NOT EXISTS family_id BIGINT
-            """)
-        )
-        logger.info("Колонка users.family_id проверена/добавлена")
-        
-        # Добавляем family_id в transactions если его нет
-        await session.execute(
-            text("""
-                ALTER TABLE transactions 
-                ADD COLUMN IF NOT EXISTS family_id BIGINT
-            """)
-        )
-        logger.info("Колонка transactions.family_id проверена/добавлена")
-        
-        # Добавляем user_name в transactions если его нет
-        await session.execute(
-            text("""
-                ALTER TABLE transactions 
-                ADD COLUMN IF NOT EXISTS user_name VARCHAR(255)
-            """)
-        )
-        logger.info("Колонка transactions.user_name проверена/добавлена")
-        
+        # Шаг 0: Добавляем необходимые колонки если их нет (без DEFAULT - мгновенно)
+        await session.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS family_id BIGINT"))
+        await session.execute(text("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS family_id BIGINT"))
+        await session.execute(text("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS user_name VARCHAR(255)"))
         # Делаем current_balance nullable (больше не используется)
-        await session.execute(
-            text("""
-                ALTER TABLE users 
-                ALTER COLUMN current_balance DROP NOT NULL
-            """)
-        )
-        logger.info("Колонка users.current_balance сделана nullable")
-        
+        await session.execute(text("ALTER TABLE users ALTER COLUMN current_balance DROP NOT NULL"))
         await session.commit()
+        logger.info("Колонки family_id, user_name проверены/добавлены")
         
-        # Проверяем существует ли таблица families
+        # Шаг 1: Семья для каждого пользователя без семьи - пачками
         result = await session.execute(
-            text("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_name = 'families'
-                )
-            """)
+            text("SELECT EXISTS (SELECT 1 FROM users WHERE family_id IS NULL)")
         )
-        families_exists = result.scalar()
-        
-        if families_exists:
-            logger.info("Таблица families существует, проверяем нужна ли миграция данных...")
-            
-            # Проверяем есть ли пользователи без family_id
-            result = await session.execute(
-                text("SELECT COUNT(*) FROM users WHERE family_id IS NULL")
-            )
-            users_without_family = result.scalar()
-            
-            if users_without_family == 0:
-                logger.info("Миграция не требуется, все пользователи уже привязаны к семьям")
-                return
-            
-            logger.info(f"Найдено {users_without_family} пользователей без семьи, выполняем миграцию...")
-        
-        # Шаг 1: Создаем семьи для существующих пользователей
-        logger.info("Создание семей для существующих пользователей...")
+        if result.scalar():
+            logger.info("Создание семей для пользователей без семьи...")
+            migrated = 0
+            # Keyset по telegram_id: каждая пачка читает users с места, где остановилась прошлая
+            after_id = -1
+            while True:
+                result = await session.execute(
+                    text("""
+                        WITH batch AS (
+                            SELECT
+                                u.telegram_id,
+                                'Семья ' || COALESCE(u.first_name, u.username, CAST(u.telegram_id AS VARCHAR)) AS name,
+                                COALESCE(u.current_balance, 0) AS balance,
+                                nextval(pg_get_serial_sequence('families', 'id')) AS family_id
+                            FROM (
+                                SELECT telegram_id, first_name, username, current_balance
+                                FROM users
+                                WHERE family_id IS NULL AND telegram_id > :after_id
+                                ORDER BY telegram_id
+                                LIMIT :batch_size
+                                FOR UPDATE SKIP LOCKED
+                            ) u
+                        ), new_families AS (
+                            INSERT INTO families (id, name, current_balance, created_at, updated_at)
+                            SELECT family_id, name, balance, NOW(), NOW() FROM batch
+                        ), updated AS (
+                            UPDATE users
+                            SET family_id = batch.family_id, updated_at = NOW()
+                            FROM batch
+                            WHERE users.telegram_id = batch.telegram_id
+                            RETURNING users.telegram_id
+                        )
+                        SELECT COUNT(*), MAX(telegram_id) FROM updated
+                    """),
+                    {"after_id": after_id, "batch_size": batch_size}
+                )
+                count, last_telegram_id = result.one()
+                await session.commit()
+                if count == 0:
+                    break
+                migrated += count
+                after_id = last_telegram_id
+                logger.info(f"Создано семей: {migrated}")
         
-        # Получаем пользователей без семьи
+        # Шаг 2: Транзакции - заполняем family_id и user_name из users, пачками по диапазону id
         result = await session.execute(
-            text("""
-                SELECT telegram_id, username, first_name, last_name, current_balance 
-                FROM users 
-                WHERE family_id IS NULL
-            """)
+            text("SELECT MIN(id), MAX(id) FROM transactions WHERE family_id IS NULL")
+        )
+        first_id, last_id = result.one()
+        if first_id is not None:
+            logger.info("Обновление транзакций...")
+            updated = 0
+            start_id = first_id
+            while start_id <= last_id:
+                result = await session.execute(
+                    text("""
+                        UPDATE transactions t
+                        SET 
+                            family_id = u.family_id,
+                            user_name = COALESCE(u.first_name, u.username, CAST(u.telegram_id AS VARCHAR))
+                        FROM users u
+                        WHERE t.telegram_id = u.telegram_id
+                        AND t.family_id IS NULL
+                        AND t.id >= :start_id AND t.id < :end_id
+                    """),
+                    {"start_id": start_id, "end_id": start_id + batch_size}
+                )
+                await session.commit()
+                updated += result.rowcount
+                start_id += batch_size
+                logger.info(f"Обновлено транзакций: {updated} (id до {min(start_id - 1, last_id)} из {last_id})")
+        
+        # Шаг 3: Внешние ключи без долгой блокировки
+        await add_foreign_key(session, "users", "users_family_id_fkey", "FOREIGN KEY (family_id) REFERENCES families(id)")
+        await add_foreign_key(
+            session, "transactions", "transactions_family_id_fkey", "FOREIGN KEY (family_id) REFERENCES families(id)"
         )
-        users = result.fetchall()
         
-        if not users:
-            logger.info("Нет пользователей для миграции")
-            return
+        # Шаг 4: Удаляем колонку current_balance из users (опционально)
+        # Это можно не делать для обратной совместимости
+        # Но можно раскомментировать если нужно:
+        # await session.execute(
+        #     text("ALTER TABLE users DROP COLUMN IF EXISTS current_balance")
+        # )
+        # logger.info("Удалена колонка current_balance из users")
         
-        logger.info(f"Найдено {len(users)} пользователей для миграции")
+        logger.info("✅ Миграция БД успешно завершена!")
         
-        # Для каждого пользователя создаем семью
-        for user in users:
-            telegram_id, username, first_name, last_name, current_balance = user
-            
-            # Создаем семью
-            family_name = f"Семья {first_name or username or telegram_id}"
-            
-            result = await session.execute(
-                text("""
-                    INSERT INTO families (name, current_balance, created_at, updated_at)
-                    VALUES (:name, :balance, NOW(), NOW())
-                    RETURNING id
-                """),
-                {
-                    "name": family_name,
-                    "balance": current_balance or 0.0
-                }
-            )
-            family_id = result.scalar()
-            
-            # Привязываем пользователя к семье
+    except Exception as e:
+        logger.error(f"❌ Ошибка миграции БД: {e}")
+        await session.rollback()
+        raise
+
+
+async def migrate_reminder_settings(session: AsyncSession):
+    """
+    Миграция для персональных напоминаний.
+    
+    Выполняет:
+    1. Добавление в users часового пояса, времени напоминаний и слотов
+    2. Создание индексов по слотам
+    3. Заполнение слотов для всех пользователей
+    """
+    from backend.db.slots import refresh_reminder_slots
+    
+    try:
+        for column, column_type in (
+            ("timezone", "VARCHAR(64)"),
+            ("income_time", "VARCHAR(5)"),
+            ("expense_time", "VARCHAR(5)"),
+            ("income_slot", "SMALLINT"),
+            ("expense_slot", "SMALLINT"),
+        ):
             await session.execute(
-                text("""
-                    UPDATE users 
-                    SET family_id = :family_id, updated_at = NOW()
-                    WHERE telegram_id = :telegram_id
-                """),
-                {
-                    "family_id": family_id,
-                    "telegram_id": telegram_id
-                }
+                text(f"ALTER TABLE users ADD COLUMN IF NOT EXISTS {column} {column_type}")
             )
-            
-            logger.info(f"Создана семья {family_id} для пользователя {telegram_id}")
         
-        # Шаг 2: Обновляем транзакции - заполняем family_id и user_name из users
-        logger.info("Обновление транзакций...")
         await session.execute(
-            text("""
-                UPDATE transactions t
-                SET 
-                    family_id = u.family_id,
-                    user_name = COALESCE(u.first_name, u.username, CAST(u.telegram_id AS VARCHAR))
-                FROM users u
-                WHERE t.telegram_id = u.telegram_id
-                AND t.family_id IS NULL
-            """)
+            text("CREATE INDEX IF NOT EXISTS ix_users_income_slot ON users (income_slot)")
         )
-        
-        # Проверяем сколько транзакций обновлено
-        result = await session.execute(
-            text("SELECT COUNT(*) FROM transactions WHERE family_id IS NOT NULL")
+        await session.execute(
+            text("CREATE INDEX IF NOT EXISTS ix_users_expense_slot ON users (expense_slot)")
         )
-        updated_count = result.scalar()
-        
-        logger.info(f"Обновлено транзакций: {updated_count}")
+        await session.commit()
+        logger.info("Колонки и индексы напоминаний проверены/добавлены")
         
-        # Шаг 3: Добавляем внешние ключи если их нет
-        logger.info("Добавление внешних ключей...")
+        await refresh_reminder_slots(session)
         
-        # Проверяем и добавляем FK для users.family_id
-        result = await session.execute(
+    except Exception as e:
+        logger.error(f"❌ Ошибка миграции напоминаний: {e}")
+        await session.rollback()
+        raise
+
+
+async def migrate_history_index(session: AsyncSession):
+    """
+    Миграция индексов истории.
+    
+    Составной индекс (family_id, created_at DESC, id DESC) для keyset-пагинации
+    заменяет одиночный индекс по family_id.
+    """
+    try:
+        await session.execute(
             text("""
-                SELECT EXISTS (
-                    SELECT 1 FROM information_schema.table_constraints 
-                    WHERE constraint_name = 'users_family_id_fkey'
-                    AND table_name = 'users'
-                )
+                CREATE INDEX IF NOT EXISTS ix_transactions_family_created_id
+                ON transactions (family_id, created_at DESC, id DESC)
             """)
         )
-        fk_exists = result.scalar()
-        
-        if not fk_exists:
-            await session.execute(
-                text("""
-                    ALTER TABLE users 
-                    ADD CONSTRAINT users_family_id_fkey 
-                    FOREIGN KEY (family_id) REFERENCES families(id)
-                """)
-            )
-            logger.info("Добавлен внешний ключ users.family_id -> families.id")
-        
-        # Проверяем и добавляем FK для transactions.family_id
-        result = await session.execute(
-            text("""
-                SELECT EXISTS (
-                    SELECT 1 FROM information_schema.table_constraints 
-                    WHERE constraint_name = 'transactions_family_id_fkey'
-                    AND table_name = 'transactions'
-                )
-            """)
+        await session.execute(
+            text("DROP INDEX IF EXISTS ix_transactions_family_id")
         )
-        fk_exists = result.scalar()
+        await session.commit()
+        logger.info("Индекс истории транзакций проверен/добавлен")
         
-        if not fk_exists:
-            await session.execute(
-                text("""
-                    ALTER TABLE transactions 
-                    ADD CONSTRAINT transactions_family_id_fkey 
-                    FOREIGN KEY (family_id) REFERENCES families(id)
-                """)
-            )
-            logger.info("Добавлен внешний ключ transactions.family_id -> families.id")
+    except Exception as e:
+        logger.error(f"❌ Ошибка миграции индексов истории: {e}")
+        await session.rollback()
+        raise
+
+
+async def migrate_daily_totals(session: AsyncSession):
+    """
+    Заполнение дневных итогов (family_daily_totals) из transactions.
+    
+    Итоги пересчитываются целиком под SHARE-блокировкой transactions (записи ждут).
+    Дальше итоги поддерживаются при каждой записи.
+    """
+    from backend.db.rollups import backfill_totals
+    
+    try:
+        logger.info("Заполнение дневных итогов из истории транзакций...")
+        await session.execute(text("LOCK TABLE transactions IN SHARE MODE"))
+        rows = await backfill_totals(session)
+        await session.commit()
+        logger.info(f"Дневные итоги заполнены: {rows} строк")
         
-        # Шаг 4: Удаляем колонку current_balance из users (опционально)
-        # Это можно не делать для обратной совместимости
-        # Но можно раскомментировать если нужно:
-        # await session.execute(
-        #     text("ALTER TABLE users DROP COLUMN IF EXISTS current_balance")
-        # )
-        # logger.info("Удалена колонка current_balance из users")
+    except Exception as e:
+        logger.error(f"❌ Ошибка заполнения дневных итогов: {e}")
+        await session.rollback()
+        raise
+
+
+async def migrate_transaction_partitions(session: AsyncSession):
+    """
+    Помесячные секции transactions.
+    
+    Секционированная таблица (новая установка или уже перенесенная) получает секцию
+    по умолчанию и секции на ближайшие месяцы. Несекционированную таблицу переносит
+    долгая миграция transactions_partitioning - она же потом создает эти секции,
+    поэтому здесь только предупреждение.
+    """
+    from backend.db.partitions import is_partitioned, ensure_default_partition, ensure_future_partitions
+    
+    try:
+        if not await is_partitioned(session):
+            logger.warning(
+                "Таблица transactions не секционирована - "
+                "перенеси ее командой: python -m backend.db.migrate"
+            )
+            return
         
+        await ensure_default_partition(session)
+        created = await ensure_future_partitions(session)
         await session.commit()
-        logger.info("✅ Миграция БД успешно завершена!")
+        if created:
+            logger.info(f"Созданы секции transactions: {', '.join(created)}")
         
     except Exception as e:
-        logger.error(f"❌ Ошибка миграции БД: {e}")
+        logger.error(f"❌ Ошибка создания секций transactions: {e}")
         await session.rollback()
         raise
 
+
+async def migrate_partition_transactions(session: AsyncSession):
+    """
+    Онлайн-перенос несекционированной transactions в помесячные секции.
+    
+    После переноса создаются секция по умолчанию и секции на ближайшие месяцы:
+    быстрая миграция transactions_partitions_ahead могла быть записана в schema_version
+    раньше, пока таблица еще не была секционирована, и больше не запустится.
+    """
+    from backend.db.partitions import migrate_to_partitions
+    
+    await migrate_to_partitions(session)
+    await migrate_transaction_partitions(session)
+
+
+async def migrate_outbox(session: AsyncSession):
+    """
+    Миграция очереди исходящих сообщений.
+    
+    Таблицу outbox_messages создает create_all перед применением миграций,
+    здесь проверяем, что она есть, и добавляем колонки аренды (owner, locked_until),
+    если таблица создана без них.
+    """
+    result = await session.execute(text("SELECT to_regclass('outbox_messages') IS NOT NULL"))
+    if not result.scalar():
+        raise RuntimeError("Таблица outbox_messages не создана")
+    await session.execute(text("ALTER TABLE outbox_messages ADD COLUMN IF NOT EXISTS owner VARCHAR(128)"))
+    await session.execute(text("ALTER TABLE outbox_messages ADD COLUMN IF NOT EXISTS locked_until TIMESTAMP"))
+    await session.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_outbox_messages_locked_until ON outbox_messages (locked_until)"
+    ))
+    await session.commit()
+    logger.info("Таблица outbox_messages проверена")
+
+
+@dataclass(frozen=True)
+class Migration:
+    """Миграция схемы: версия, имя и функция применения (коммитит сама)"""
+    version: int
+    name: str
+    apply: Callable[[AsyncSession], Awaitable[None]]
+    # Долгая миграция (пропорциональна объему данных) - только командой, не на старте
+    slow: bool = False
+
+
+# Реестр миграций - только добавлять в конец, версии не менять
+MIGRATIONS = [
+    Migration(1, "family_wallet", migrate_to_family_wallet),
+    Migration(2, "reminder_settings", migrate_reminder_settings),
+    Migration(3, "history_index", migrate_history_index),
+    Migration(4, "daily_totals_backfill", migrate_daily_totals, slow=True),
+    Migration(5, "transactions_partitioning", migrate_partition_transactions, slow=True),
+    Migration(6, "transactions_partitions_ahead", migrate_transaction_partitions),
+    Migration(7, "outbox_messages", migrate_outbox),
+]
+
+# Ключ pg_advisory_lock: миграции выполняет одна реплика за раз
+MIGRATION_LOCK_KEY = 0x6D696772  # "migr"
+
+
+def pending_migrations(applied: set[int], include_slow: bool) -> list[Migration]:
+    """Непримененные миграции по порядку версий"""
+    return [
+        migration for migration in sorted(MIGRATIONS, key=lambda m: m.version)
+        if migration.version not in applied and (include_slow or not migration.slow)
+    ]
+
+
+async def applied_versions(session: AsyncSession) -> set[int] | None:
+    """Примененные версии одним запросом (None - таблицы schema_version еще нет)"""
+    try:
+        result = await session.execute(text("SELECT version FROM schema_version"))
+    except ProgrammingError:
+        await session.rollback()
+        return None
+    return set(result.scalars())
+
+
+async def run_migrations(include_slow: bool = False) -> list[Migration]:
+    """
+    Применить непримененные миграции (долгие - только при include_slow).
+    
+    Если все версии уже применены - один запрос к schema_version и выход.
+    Иначе под pg_advisory_lock создаются новые таблицы (create_all) и по порядку
+    применяются миграции. На пустой БД применяются и долгие - данных еще нет.
+    Возвращает примененные миграции.
+    """
+    from backend.db.database import engine, async_session_maker, Base
+    from backend.db import models  # noqa: F401 - регистрирует модели для create_all
+    
+    async with async_session_maker() as session:
+        applied = await applied_versions(session)
+    
+    if applied is not None:
+        pending = pending_migrations(applied, include_slow)
+        deferred = [m for m in pending_migrations(applied, True) if m not in pending]
+        if not pending:
+            if deferred:
+                logger.warning(
+                    f"Не применены долгие миграции: {', '.join(m.name for m in deferred)} - "
+                    "запусти python -m backend.db.migrate"
+                )
+            return []
+    
+    done = []
+    async with engine.connect() as lock_connection:
+        await lock_connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            async with async_session_maker() as session:
+                result = await session.execute(text("SELECT to_regclass('users') IS NULL"))
+                fresh = result.scalar()
+            
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            
+            async with async_session_maker() as session:
+                # Другая реплика могла применить миграции, пока мы ждали блокировку
+                applied = await applied_versions(session) or set()
+                for migration in pending_migrations(applied, include_slow or fresh):
+                    logger.info(f"Миграция {migration.version} ({migration.name})...")
+                    await migration.apply(session)
+                    await session.execute(
+                        text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+                        {"version": migration.version, "name": migration.name}
+                    )
+                    await session.commit()
+                    done.append(migration)
+                
+                deferred = pending_migrations(applied | {m.version for m in done}, True)
+                if deferred:
+                    logger.warning(
+                        f"Не применены долгие миграции: {', '.join(m.name for m in deferred)} - "
+                        "запусти python -m backend.db.migrate"
+                    )
+        finally:
+            await lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    
+    return done
+
+
+async def main():
+    """CLI: применить все миграции, включая долгие, или показать статус"""
+    from backend.db.database import async_session_maker, close_db
+    
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("command", nargs="?", choices=["apply", "status"], default="apply")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    try:
+        if args.command == "status":
+            async with async_session_maker() as session:
+                applied = await applied_versions(session) or set()
+            for migration in MIGRATIONS:
+                mark = "✅" if migration.version in applied else "⏳"
+                kind = " (долгая)" if migration.slow else ""
+                print(f"{mark} {migration.version:3d} {migration.name}{kind}")
+            return
+        
+        done = await run_migrations(include_slow=True)
+        logger.info(f"Применено миграций: {len(done)}")
+    finally:
+        await close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,8 +1,9 @@
 """
 Модели базы данных
 """
-from datetime import datetime
-from sqlalchemy import BigInteger, String, Numeric, DateTime, Enum as SQLEnum, ForeignKey
+from datetime import datetime, date
+from sqlalchemy import BigInteger, SmallInteger, Integer, Date, String, Numeric, DateTime, Enum as SQLEnum, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 import enum
 
@@ -44,6 +45,13 @@ class User(Base):
     family_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('families.id'), nullable=True)
     # Старое поле для обратной совместимости (больше не используется)
     current_balance: Mapped[float] = mapped_column(Numeric(15, 2), nullable=True, default=0.0)
+    # Настройки напоминаний (None - значения по умолчанию из конфига)
+    timezone: Mapped[str] = mapped_column(String(64), nullable=True)
+    income_time: Mapped[str] = mapped_column(String(5), nullable=True)  # HH:MM
+    expense_time: Mapped[str] = mapped_column(String(5), nullable=True)  # HH:MM
+    # Минута суток по UTC, когда отправлять напоминание (индекс для диспетчера)
+    income_slot: Mapped[int] = mapped_column(SmallInteger, nullable=True, index=True)
+    expense_slot: Mapped[int] = mapped_column(SmallInteger, nullable=True, index=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(
         DateTime, 
@@ -58,9 +66,12 @@ class User(Base):
 class Transaction(Base):
     """Транзакция (пополнение или расход)"""
     __tablename__ = "transactions"
+    # Помесячные секции по created_at (см. backend/db/partitions.py),
+    # поэтому created_at входит в первичный ключ
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
-    family_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('families.id'), nullable=False, index=True)
+    family_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('families.id'), nullable=False)
     telegram_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)  # Кто добавил
     user_name: Mapped[str] = mapped_column(String(255), nullable=True)  # Имя того кто добавил
     transaction_type: Mapped[TransactionType] = mapped_column(
@@ -69,12 +80,104 @@ class Transaction(Base):
     )
     amount: Mapped[float] = mapped_column(Numeric(15, 2), nullable=False)
     description: Mapped[str] = mapped_column(String(500), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True, default=datetime.utcnow, index=True)
 
     def __repr__(self):
         return f"<Transaction(id={self.id}, type={self.transaction_type}, amount={self.amount}, user={self.user_name})>"
 
 
+# История семьи читается по (family_id, created_at DESC, id DESC) - keyset-пагинация в /history.
+# Индекс покрывает и поиск по family_id, отдельный индекс на family_id не нужен
+Index(
+    "ix_transactions_family_created_id",
+    Transaction.family_id,
+    Transaction.created_at.desc(),
+    Transaction.id.desc()
+)
 
 
+class ReminderClaim(Base):
+    """Захват шарда рассылки репликой бота (каждая пара слот+шард отправляется ровно одной репликой)"""
+    __tablename__ = "reminder_claims"
 
+    slot_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True)  # Минута рассылки (UTC)
+    shard: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    node: Mapped[str] = mapped_column(String(255), nullable=False)  # Какая реплика захватила
+    claimed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ReminderClaim(slot_at={self.slot_at}, shard={self.shard}, node={self.node})>"
+
+
+class FsmState(Base):
+    """Состояние диалога (FSM aiogram) - хранится только пока диалог не завершен"""
+    __tablename__ = "fsm_states"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)  # bot:chat:user[:thread]:destiny
+    state: Mapped[str] = mapped_column(String(255), nullable=True)
+    data: Mapped[dict] = mapped_column(JSONB, nullable=False, default=dict)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<FsmState(key={self.key}, state={self.state})>"
+
+
+class InviteCode(Base):
+    """Код привязки к семье (живет 10 минут, гасится один раз)"""
+    __tablename__ = "invite_codes"
+
+    code: Mapped[str] = mapped_column(String(16), primary_key=True)
+    family_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    creator_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<InviteCode(code={self.code}, family_id={self.family_id}, expires_at={self.expires_at})>"
+
+
+class FamilyDailyTotal(Base):
+    """Дневные итоги семьи по каждому участнику (обновляются в одной транзакции с записью операций)"""
+    __tablename__ = "family_daily_totals"
+
+    family_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)  # Дата операции (UTC)
+    telegram_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)  # Кто добавил
+    income_sum: Mapped[float] = mapped_column(Numeric(17, 2), nullable=False, default=0)
+    expense_sum: Mapped[float] = mapped_column(Numeric(17, 2), nullable=False, default=0)
+    tx_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return (
+            f"<FamilyDailyTotal(family_id={self.family_id}, day={self.day}, "
+            f"income={self.income_sum}, expense={self.expense_sum})>"
+        )
+
+
+class SchemaVersion(Base):
+    """Примененная миграция схемы (см. реестр MIGRATIONS в backend/db/migrate.py)"""
+    __tablename__ = "schema_version"
+
+    version: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(100), nullable=False)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SchemaVersion(version={self.version}, name={self.name})>"
+
+
+class OutboxMessage(Base):
+    """Исходящее сообщение в очереди: от постановки в очередь до доставки (см. backend/bot/outbox.py)"""
+    __tablename__ = "outbox_messages"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    kind: Mapped[str] = mapped_column(String(64), nullable=False)  # reply, income_reminder, ...
+    payload: Mapped[dict] = mapped_column(JSONB, nullable=False)  # Аргументы sendMessage
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Процесс, у которого сообщение в памяти, и срок его аренды (None - сообщение свободно)
+    owner: Mapped[str] = mapped_column(String(128), nullable=True)
+    locked_until: Mapped[datetime] = mapped_column(DateTime, nullable=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<OutboxMessage(id={self.id}, chat_id={self.chat_id}, kind={self.kind})>"
@@ -0,0 +1,306 @@
+"""
+Помесячное секционирование transactions по created_at
+
+Секции называются transactions_yYYYYmMM и покрывают месяц [1-е число, 1-е число следующего).
+Строки вне существующих секций попадают в transactions_default и переносятся
+в свою секцию при ее создании.
+
+Запуск из командной строки:
+    python -m backend.db.partitions ensure [--months-ahead N]
+    python -m backend.db.partitions migrate [--batch-size N]
+"""
+import argparse
+import asyncio
+import logging
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# На сколько месяцев вперед держать готовые секции
+PARTITION_MONTHS_AHEAD = 3
+
+# Строк за один шаг онлайн-миграции (каждый шаг - отдельная короткая транзакция)
+MIGRATION_BATCH_SIZE = 10000
+
+DEFAULT_PARTITION = "transactions_default"
+
+# Ключ pg_advisory_xact_lock: секции создает одна реплика за раз
+PARTITION_LOCK_KEY = 0x7472616E  # "tran"
+
+# Индексы transactions: имя -> определение (совпадают с моделью Transaction)
+TRANSACTION_INDEXES = {
+    "ix_transactions_family_created_id": "(family_id, created_at DESC, id DESC)",
+    "ix_transactions_telegram_id": "(telegram_id)",
+    "ix_transactions_created_at": "(created_at)",
+}
+
+
+def month_start(day: date) -> date:
+    """Первое число месяца"""
+    return day.replace(day=1)
+
+
+def add_months(day: date, months: int) -> date:
+    """Первое число месяца через months месяцев"""
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """Имя секции месяца"""
+    return f"transactions_y{month.year:04d}m{month.month:02d}"
+
+
+def month_range(start: date, end: date) -> list[date]:
+    """Первые числа всех месяцев, которые пересекаются с днями [start, end]"""
+    months = []
+    month = month_start(start)
+    while month <= end:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+async def is_partitioned(session: AsyncSession, table: str = "transactions") -> bool:
+    """Секционирована ли таблица (relkind = 'p')"""
+    result = await session.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": table}
+    )
+    return bool(result.scalar())
+
+
+async def ensure_partitions(session: AsyncSession, start: date, end: date, table: str = "transactions") -> list[str]:
+    """
+    Создать недостающие секции для месяцев, пересекающихся с днями [start, end].
+
+    Секция создается отдельной таблицей и подключается через ATTACH PARTITION -
+    это не блокирует чтение и запись в transactions. Если в секции по умолчанию
+    уже есть строки этого месяца, они переносятся в новую секцию.
+    Коммит - на вызывающем. Возвращает имена созданных секций.
+    """
+    if not await is_partitioned(session, table):
+        return []
+
+    await session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+
+    created = []
+    for month in month_range(start, end):
+        name = partition_name(month)
+        if table != "transactions":
+            name = name.replace("transactions", table, 1)
+
+        result = await session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+        if result.scalar():
+            continue
+
+        bounds = {"start": datetime.combine(month, datetime.min.time()),
+                  "end": datetime.combine(add_months(month, 1), datetime.min.time())}
+        await session.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+
+        default_name = DEFAULT_PARTITION.replace("transactions", table, 1)
+        result = await session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": default_name})
+        if result.scalar():
+            moved = await session.execute(
+                text(f"""
+                    WITH moved AS (
+                        DELETE FROM {default_name}
+                        WHERE created_at >= :start AND created_at < :end
+                        RETURNING *
+                    )
+                    INSERT INTO {name} SELECT * FROM moved
+                """),
+                bounds
+            )
+            if moved.rowcount:
+                logger.info(f"{moved.rowcount} строк перенесено из {default_name} в {name}")
+
+        # Параметры в DDL не поддерживаются - границы подставляются литералами (это даты)
+        await session.execute(
+            text(f"ALTER TABLE {table} ATTACH PARTITION {name} "
+                 f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')")
+        )
+        created.append(name)
+        logger.info(f"Создана секция {name}")
+
+    return created
+
+
+async def ensure_future_partitions(session: AsyncSession, months_ahead: int = PARTITION_MONTHS_AHEAD) -> list[str]:
+    """Секции с текущего месяца на months_ahead месяцев вперед. Коммит - на вызывающем"""
+    today = datetime.utcnow().date()
+    return await ensure_partitions(session, today, add_months(today, months_ahead))
+
+
+async def ensure_default_partition(session: AsyncSession):
+    """Секция по умолчанию для строк вне месячных секций. Коммит - на вызывающем"""
+    await session.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF transactions DEFAULT"))
+
+
+async def create_partitioned_copy(session: AsyncSession, name: str, first_day: date):
+    """Пустая секционированная копия transactions с секциями от first_day и секцией по умолчанию"""
+    await session.execute(
+        text(f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                LIKE transactions INCLUDING DEFAULTS,
+                PRIMARY KEY (id, created_at),
+                FOREIGN KEY (family_id) REFERENCES families (id)
+            ) PARTITION BY RANGE (created_at)
+        """)
+    )
+    await session.execute(text(f"ALTER TABLE {name} ALTER COLUMN created_at SET NOT NULL"))
+    for index, columns in TRANSACTION_INDEXES.items():
+        await session.execute(text(f"CREATE INDEX IF NOT EXISTS {index}_p ON {name} {columns}"))
+    await session.execute(text(f"CREATE TABLE IF NOT EXISTS {name}_default PARTITION OF {name} DEFAULT"))
+
+    today = datetime.utcnow().date()
+    await ensure_partitions(session, first_day, add_months(today, PARTITION_MONTHS_AHEAD), table=name)
+
+
+async def migrate_to_partitions(session: AsyncSession, batch_size: int = MIGRATION_BATCH_SIZE) -> bool:
+    """
+    Онлайн-перенос существующей transactions в секционированную таблицу.
+
+    1. Создается transactions_partitioned со всеми секциями, триггер на старой таблице
+       зеркалирует в нее каждую новую запись, изменение и удаление.
+    2. Старые строки копируются пачками по id (INSERT ... ON CONFLICT DO NOTHING),
+       каждая пачка - отдельная короткая транзакция; прерванный перенос можно
+       повторить - уже перенесенные строки пропускаются.
+    3. Таблицы меняются местами в одной короткой транзакции. Старая таблица
+       остается как transactions_old (без внешних ключей) - ее можно удалить после проверки.
+    Возвращает False, если transactions уже секционирована.
+    """
+    if await is_partitioned(session):
+        logger.info("transactions уже секционирована")
+        return False
+
+    result = await session.execute(text("SELECT min(created_at) FROM transactions"))
+    first = result.scalar() or datetime.utcnow()
+    await create_partitioned_copy(session, "transactions_partitioned", first.date())
+
+    await session.execute(
+        text("""
+            CREATE OR REPLACE FUNCTION transactions_mirror() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    DELETE FROM transactions_partitioned WHERE id = OLD.id AND created_at = OLD.created_at;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO transactions_partitioned SELECT NEW.*
+                    ON CONFLICT (id, created_at) DO UPDATE SET
+                        family_id = EXCLUDED.family_id,
+                        telegram_id = EXCLUDED.telegram_id,
+                        user_name = EXCLUDED.user_name,
+                        transaction_type = EXCLUDED.transaction_type,
+                        amount = EXCLUDED.amount,
+                        description = EXCLUDED.description;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+    )
+    await session.execute(text("DROP TRIGGER IF EXISTS transactions_mirror ON transactions"))
+    await session.execute(
+        text("""
+            CREATE TRIGGER transactions_mirror
+            AFTER INSERT OR UPDATE OR DELETE ON transactions
+            FOR EACH ROW EXECUTE FUNCTION transactions_mirror()
+        """)
+    )
+    await session.commit()
+    logger.info("Секционированная таблица создана, новые записи зеркалируются")
+
+    # Копирование идемпотентно: прерванный перенос продолжается повторным запуском,
+    # уже перенесенные строки пропускаются по конфликту ключа
+    result = await session.execute(text("SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM transactions"))
+    start_id, last_id = result.one()
+    start_id -= 1
+    await session.commit()
+
+    copied = 0
+    while start_id < last_id:
+        result = await session.execute(
+            text("""
+                INSERT INTO transactions_partitioned
+                SELECT * FROM transactions WHERE id > :start_id AND id <= :end_id
+                ON CONFLICT (id, created_at) DO NOTHING
+            """),
+            {"start_id": start_id, "end_id": start_id + batch_size}
+        )
+        await session.commit()
+        copied += result.rowcount
+        start_id += batch_size
+        logger.info(f"Перенесено строк: {copied} (id до {min(start_id, last_id)} из {last_id})")
+
+    # Короткая транзакция переключения: никто не пишет, пока таблицы меняются местами
+    await session.execute(text("LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE"))
+    await session.execute(text("DROP TRIGGER transactions_mirror ON transactions"))
+    await session.execute(text("DROP FUNCTION transactions_mirror()"))
+    await session.execute(text("ALTER TABLE transactions RENAME TO transactions_old"))
+    await session.execute(text("ALTER TABLE transactions_old RENAME CONSTRAINT transactions_pkey TO transactions_old_pkey"))
+    # Внешние ключи старой таблицы снимаем: иначе удаление семьи (слияние в /join)
+    # упрется в ее строки, уже перенесенные в новую таблицу
+    result = await session.execute(
+        text("SELECT conname FROM pg_constraint WHERE conrelid = 'transactions_old'::regclass AND contype = 'f'")
+    )
+    for (constraint,) in result.all():
+        await session.execute(text(f'ALTER TABLE transactions_old DROP CONSTRAINT "{constraint}"'))
+    for index in TRANSACTION_INDEXES:
+        await session.execute(text(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_old"))
+        await session.execute(text(f"ALTER INDEX {index}_p RENAME TO {index}"))
+    await session.execute(text("ALTER TABLE transactions_partitioned RENAME TO transactions"))
+    await session.execute(text("ALTER TABLE transactions_partitioned_default RENAME TO transactions_default"))
+    await session.execute(text("ALTER TABLE transactions RENAME CONSTRAINT transactions_partitioned_pkey TO transactions_pkey"))
+    await session.execute(
+        text("ALTER TABLE transactions RENAME CONSTRAINT transactions_partitioned_family_id_fkey TO transactions_family_id_fkey")
+    )
+    await session.execute(text("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id"))
+
+    # Секции месяцев тоже получили имена от transactions_partitioned
+    result = await session.execute(
+        text("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'transactions'::regclass AND c.relname LIKE 'transactions_partitioned_y%'
+        """)
+    )
+    for (name,) in result.all():
+        await session.execute(text(f"ALTER TABLE {name} RENAME TO {name.replace('transactions_partitioned', 'transactions', 1)}"))
+
+    await session.commit()
+    logger.info("✅ transactions секционирована, старая таблица - transactions_old")
+    return True
+
+
+async def main():
+    """CLI: обслуживание секций transactions"""
+    from backend.db.database import async_session_maker, close_db
+
+    parser = argparse.ArgumentParser(description="Секционирование transactions по месяцам")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ensure = subparsers.add_parser("ensure", help="Создать секции на ближайшие месяцы")
+    ensure.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    migrate = subparsers.add_parser("migrate", help="Онлайн-перенос несекционированной таблицы")
+    migrate.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    try:
+        async with async_session_maker() as session:
+            if args.command == "ensure":
+                created = await ensure_future_partitions(session, args.months_ahead)
+                await session.commit()
+                logger.info(f"Создано секций: {len(created)}")
+            else:
+                await migrate_to_partitions(session, args.batch_size)
+    finally:
+        await close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,216 @@
+"""
+Дневные итоги по семьям (family_daily_totals), обновляемые вместе с транзакциями
+
+Запуск пересчета из командной строки:
+    python -m backend.db.rollups backfill [--family-id N]
+"""
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import select, delete, func, case, literal, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.db.models import FamilyDailyTotal, Transaction, TransactionType, User
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PeriodTotals:
+    """Итоги за период"""
+    income: Decimal = Decimal('0')
+    expense: Decimal = Decimal('0')
+    count: int = 0
+
+    @property
+    def net(self) -> Decimal:
+        return self.income - self.expense
+
+
+def upsert_totals(rows):
+    """
+    INSERT ... ON CONFLICT DO UPDATE, прибавляющий суммы к существующим дневным итогам.
+
+    rows - select с колонками (family_id, day, telegram_id, income_sum, expense_sum, tx_count).
+    """
+    stmt = insert(FamilyDailyTotal).from_select(
+        ["family_id", "day", "telegram_id", "income_sum", "expense_sum", "tx_count"],
+        rows
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[FamilyDailyTotal.family_id, FamilyDailyTotal.day, FamilyDailyTotal.telegram_id],
+        set_={
+            "income_sum": FamilyDailyTotal.income_sum + stmt.excluded.income_sum,
+            "expense_sum": FamilyDailyTotal.expense_sum + stmt.excluded.expense_sum,
+            "tx_count": FamilyDailyTotal.tx_count + stmt.excluded.tx_count,
+        }
+    )
+
+
+def totals_row(family_id, day: date, telegram_id: int, income: Decimal, expense: Decimal, count: int):
+    """Колонки одной строки итогов для upsert_totals (family_id может быть колонкой CTE)"""
+    return (
+        family_id,
+        literal(day, FamilyDailyTotal.day.type),
+        literal(telegram_id, FamilyDailyTotal.telegram_id.type),
+        literal(income, FamilyDailyTotal.income_sum.type),
+        literal(expense, FamilyDailyTotal.expense_sum.type),
+        literal(count, FamilyDailyTotal.tx_count.type),
+    )
+
+
+async def merge_totals(session: AsyncSession, source_family_id: int, target_family_id: int):
+    """Перенести итоги семьи source в target одним оператором (DELETE ... RETURNING + upsert)"""
+    moved = (
+        delete(FamilyDailyTotal)
+        .where(FamilyDailyTotal.family_id == source_family_id)
+        .returning(
+            FamilyDailyTotal.day,
+            FamilyDailyTotal.telegram_id,
+            FamilyDailyTotal.income_sum,
+            FamilyDailyTotal.expense_sum,
+            FamilyDailyTotal.tx_count,
+        )
+        .cte("moved_totals")
+    )
+    await session.execute(
+        upsert_totals(
+            select(
+                literal(target_family_id, FamilyDailyTotal.family_id.type),
+                moved.c.day,
+                moved.c.telegram_id,
+                moved.c.income_sum,
+                moved.c.expense_sum,
+                moved.c.tx_count,
+            )
+        ).add_cte(moved)
+    )
+
+
+async def backfill_totals(session: AsyncSession, family_id: int | None = None) -> int:
+    """
+    Пересчитать итоги из transactions (для всех семей или одной).
+    Коммит - на вызывающем. Возвращает число строк итогов.
+    """
+    clear = delete(FamilyDailyTotal)
+    source = select(
+        Transaction.family_id,
+        func.date(Transaction.created_at),
+        Transaction.telegram_id,
+        func.coalesce(func.sum(case((Transaction.transaction_type == TransactionType.INCOME, Transaction.amount))), 0),
+        func.coalesce(func.sum(case((Transaction.transaction_type == TransactionType.EXPENSE, Transaction.amount))), 0),
+        func.count(),
+    ).group_by(Transaction.family_id, func.date(Transaction.created_at), Transaction.telegram_id)
+
+    if family_id is not None:
+        clear = clear.where(FamilyDailyTotal.family_id == family_id)
+        source = source.where(Transaction.family_id == family_id)
+
+    await session.execute(clear)
+    result = await session.execute(upsert_totals(source))
+    return result.rowcount
+
+
+async def get_period_totals(session: AsyncSession, family_id: int, start: date, end: date) -> PeriodTotals:
+    """Итоги семьи за дни [start, end) - читает по строке на день и участника"""
+    result = await session.execute(
+        select(
+            func.coalesce(func.sum(FamilyDailyTotal.income_sum), 0),
+            func.coalesce(func.sum(FamilyDailyTotal.expense_sum), 0),
+            func.coalesce(func.sum(FamilyDailyTotal.tx_count), 0),
+        ).where(
+            FamilyDailyTotal.family_id == family_id,
+            FamilyDailyTotal.day >= start,
+            FamilyDailyTotal.day < end,
+        )
+    )
+    income, expense, count = result.one()
+    return PeriodTotals(income=Decimal(income), expense=Decimal(expense), count=int(count))
+
+
+@dataclass
+class MemberTotals(PeriodTotals):
+    """Итоги участника семьи за период"""
+    telegram_id: int = 0
+    name: str = ""
+
+
+# Периоды отчетов: week - с понедельника, month - с 1 числа, year - с 1 января
+PERIODS = ("week", "month", "year")
+
+
+def period_range(period: str, today: date | None = None) -> tuple[date, date]:
+    """Границы периода [start, end) по UTC (ValueError для неизвестного периода)"""
+    today = today or datetime.utcnow().date()
+    if period == "week":
+        start = today - timedelta(days=today.weekday())
+    elif period == "month":
+        start = today.replace(day=1)
+    elif period == "year":
+        start = today.replace(month=1, day=1)
+    else:
+        raise ValueError(f"Неизвестный период: {period}")
+    return start, today + timedelta(days=1)
+
+
+async def get_member_totals(session: AsyncSession, family_id: int, start: date, end: date) -> list[MemberTotals]:
+    """Итоги семьи за дни [start, end) по участникам (от больших расходов к меньшим)"""
+    result = await session.execute(
+        select(
+            FamilyDailyTotal.telegram_id,
+            func.coalesce(User.first_name, User.username),
+            func.sum(FamilyDailyTotal.income_sum),
+            func.sum(FamilyDailyTotal.expense_sum),
+            func.sum(FamilyDailyTotal.tx_count),
+        )
+        .outerjoin(User, User.telegram_id == FamilyDailyTotal.telegram_id)
+        .where(
+            FamilyDailyTotal.family_id == family_id,
+            FamilyDailyTotal.day >= start,
+            FamilyDailyTotal.day < end,
+        )
+        .group_by(FamilyDailyTotal.telegram_id, User.first_name, User.username)
+        .order_by(func.sum(FamilyDailyTotal.expense_sum).desc())
+    )
+    return [
+        MemberTotals(
+            telegram_id=telegram_id,
+            name=name or f"ID {telegram_id}",
+            income=Decimal(income),
+            expense=Decimal(expense),
+            count=int(count),
+        )
+        for telegram_id, name, income, expense, count in result.all()
+    ]
+
+
+async def main():
+    """CLI: пересчет итогов"""
+    from backend.db.database import async_session_maker, close_db
+
+    parser = argparse.ArgumentParser(description="Дневные итоги семей")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill = subparsers.add_parser("backfill", help="Пересчитать итоги из transactions")
+    backfill.add_argument("--family-id", type=int, default=None, help="Только одна семья")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    try:
+        async with async_session_maker() as session:
+            # Не даем параллельным записям менять transactions во время пересчета
+            await session.execute(text("LOCK TABLE transactions IN SHARE MODE"))
+            rows = await backfill_totals(session, args.family_id)
+            await session.commit()
+        logger.info(f"Итоги пересчитаны: {rows} строк")
+    finally:
+        await close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
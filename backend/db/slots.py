@@ -0,0 +1,110 @@
+"""
+Слоты напоминаний: минута суток по UTC, в которую пользователь получает напоминание
+"""
+import logging
+from datetime import datetime, date, time
+
+import pytz
+from sqlalchemy import select, update, or_, values, column, String, SmallInteger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.config import DAILY_INCOME_TIME, DAILY_EXPENSE_TIME, TIMEZONE
+from backend.db.models import User
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_time(value: str) -> time:
+    """Разобрать время в формате HH:MM (ValueError если формат неверный)"""
+    hour, minute = map(int, value.strip().split(':'))
+    return time(hour=hour, minute=minute)
+
+
+def is_valid_timezone(name: str) -> bool:
+    """Проверить что часовой пояс существует"""
+    return name in pytz.all_timezones_set
+
+
+def reminder_slot(local_time: str, timezone: str, on_date: date | None = None) -> int:
+    """
+    Минута суток UTC (0..1439), соответствующая local_time в часовом поясе timezone.
+
+    Смещение пояса берется на дату on_date (по умолчанию - сегодня в этом поясе),
+    поэтому после перехода на летнее/зимнее время слоты нужно пересчитать.
+    """
+    tz = pytz.timezone(timezone)
+    if on_date is None:
+        on_date = datetime.now(tz).date()
+
+    local_dt = tz.localize(datetime.combine(on_date, parse_time(local_time)))
+    utc_dt = local_dt.astimezone(pytz.utc)
+    return utc_dt.hour * 60 + utc_dt.minute
+
+
+def user_slots(user_timezone: str | None, income_time: str | None, expense_time: str | None) -> tuple[int, int]:
+    """Слоты (пополнения, расходы) с учетом значений по умолчанию из конфига"""
+    timezone = user_timezone or TIMEZONE
+    return (
+        reminder_slot(income_time or DAILY_INCOME_TIME, timezone),
+        reminder_slot(expense_time or DAILY_EXPENSE_TIME, timezone),
+    )
+
+
+def current_slot(now: datetime | None = None) -> int:
+    """Текущая минута суток UTC"""
+    now = now or datetime.utcnow()
+    return now.hour * 60 + now.minute
+
+
+async def refresh_reminder_slots(session: AsyncSession) -> int:
+    """
+    Пересчитать слоты всех пользователей.
+
+    Слоты считаются в Python для различных сочетаний (часовой пояс, время) -
+    таких групп единицы, - и записываются одним UPDATE ... FROM (VALUES ...):
+    таблица users просматривается один раз, обновляются только строки,
+    у которых слот действительно изменился.
+    Возвращает число обновленных пользователей.
+    """
+    result = await session.execute(
+        select(User.timezone, User.income_time, User.expense_time).distinct()
+    )
+    rows = [
+        (user_timezone, income_time, expense_time, *user_slots(user_timezone, income_time, expense_time))
+        for user_timezone, income_time, expense_time in result.all()
+    ]
+    if not rows:
+        return 0
+
+    slots = values(
+        column('timezone', String),
+        column('income_time', String),
+        column('expense_time', String),
+        column('income_slot', SmallInteger),
+        column('expense_slot', SmallInteger),
+        name='slots',
+        literal_binds=True,
+    ).data(rows)
+
+    result = await session.execute(
+        update(User)
+        .where(
+            User.timezone.is_not_distinct_from(slots.c.timezone),
+            User.income_time.is_not_distinct_from(slots.c.income_time),
+            User.expense_time.is_not_distinct_from(slots.c.expense_time),
+            or_(
+                User.income_slot.is_distinct_from(slots.c.income_slot),
+                User.expense_slot.is_distinct_from(slots.c.expense_slot),
+            )
+        )
+        .values(income_slot=slots.c.income_slot, expense_slot=slots.c.expense_slot)
+        .execution_options(synchronize_session=False)
+    )
+    updated = result.rowcount
+    await session.commit()
+
+    if updated:
+        logger.info(f"Пересчитаны слоты напоминаний: {updated} пользователей")
+    return updated
@@ -0,0 +1,3 @@
+"""
+Нагрузочные тесты и бенчмарки бота (не входят в набор pytest)
+"""
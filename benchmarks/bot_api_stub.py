@@ -0,0 +1,77 @@
+"""
+Локальная заглушка Telegram Bot API для нагрузочных тестов
+
+Отвечает на POST /bot<token>/<method> как настоящий Bot API: sendMessage возвращает
+Message, остальные методы - true. Может добавлять задержку и отвечать 429 (RetryAfter)
+на каждый N-й запрос.
+"""
+import asyncio
+import itertools
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+class BotApiStub:
+    """HTTP-заглушка Bot API на 127.0.0.1"""
+
+    def __init__(self, latency: float = 0.0, retry_after_every: int = 0, retry_after: int = 1):
+        self.latency = latency
+        self.retry_after_every = retry_after_every
+        self.retry_after = retry_after
+        self.calls: Counter[str] = Counter()
+        self.retries = 0
+        self._message_ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        self.calls[method] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.retry_after_every and sum(self.calls.values()) % self.retry_after_every == 0:
+            self.retries += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        if method.lower() in ("sendmessage", "senddocument"):
+            chat_id = int(data.get("chat_id", 0))
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data.get("text", ""),
+            }
+        elif method.lower() == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host="127.0.0.1", port=self.port)
+        await site.start()
+        # Порт 0 - свободный порт, выбранный системой
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
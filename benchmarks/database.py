@@ -0,0 +1,17 @@
+"""
+Защита от запуска бенчмарков на рабочей БД
+"""
+from backend.config import DB_NAME
+
+# Бенчмарк пишет в БД тысячи синтетических строк - только в БД с такими именами
+BENCH_DB_MARKERS = ("bench", "test")
+
+
+def check_bench_database(force: bool = False) -> str | None:
+    """Текст ошибки, если DB_NAME не похожа на БД для бенчмарков (force - не проверять)"""
+    if force or any(marker in DB_NAME.lower() for marker in BENCH_DB_MARKERS):
+        return None
+    return (
+        f"DB_NAME={DB_NAME} не похожа на БД для бенчмарков: запусти с DB_NAME=money_bot_bench "
+        "(или --force, если уверен)"
+    )
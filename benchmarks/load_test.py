@@ -0,0 +1,223 @@
+"""
+Нагрузочный тест бота целиком: синтетические обновления через настоящие Dispatcher и router
+
+Бот ходит не в Telegram, а в локальную заглушку Bot API (bot_api_stub), поэтому
+в замеры попадают обработчики, middleware, FSM и БД, но не сеть до Telegram.
+Каждый синтетический пользователь проходит сценарий по порядку
+(/start, /income + сумма, /expense + сумма, /history, /join + код),
+пользователи работают параллельно, не больше --concurrency одновременно.
+
+Запуск только на отдельной БД (имя с bench/test) - тест создает пользователей,
+семьи и транзакции и удаляет их в конце:
+    DB_NAME=money_bot_bench python -m benchmarks.load_test --users 500 --concurrency 50 --rounds 2
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from aiogram.types import Update
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.bot.main import create_dispatcher
+from backend.bot.outbox import outbox
+from backend.bot.broadcast import TokenBucket
+from backend.db.database import init_db, close_db, async_session_maker
+from backend.db.models import User, Family, Transaction, FamilyDailyTotal, FsmState, InviteCode, OutboxMessage
+from backend.db.instrumentation import handler_queries
+from benchmarks.bot_api_stub import BotApiStub
+from benchmarks.database import check_bench_database
+from benchmarks.stats import LatencySeries, render_table
+
+logger = logging.getLogger(__name__)
+
+# Синтетические telegram_id - далеко за пределами настоящих
+SYNTHETIC_USER_BASE = 9_000_000_000
+
+# Токен заглушки: формат как у настоящего, проверяется только aiogram
+STUB_TOKEN = "123456:load-test"
+
+# Сценарии: метка -> тексты сообщений подряд (второе сообщение - ответ на вопрос бота)
+SCENARIOS = {
+    "start": ["/start"],
+    "income": ["/income", "1500"],
+    "expense": ["/expense", "350 продукты"],
+    "history": ["/history"],
+    "join": ["/join", "000000"],
+}
+
+
+class UpdateFactory:
+    """Синтетические Update от личного чата пользователя"""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def message(self, telegram_id: int, text: str) -> Update:
+        user = {"id": telegram_id, "is_bot": False, "first_name": f"Load{telegram_id - SYNTHETIC_USER_BASE}"}
+        data = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": {"id": telegram_id, "type": "private"}, "from": user, "text": text}
+        if text.startswith("/"):
+            command = text.split(None, 1)[0]
+            data["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        # context с ботом - иначе feed_update заново валидирует обновление
+        return Update.model_validate(
+            {"update_id": next(self._update_ids), "message": data},
+            context={"bot": self.bot}
+        )
+
+
+async def drop_synthetic_users(session: AsyncSession, users: int, bot_id: int):
+    """Удалить синтетических пользователей, их семьи, транзакции, итоги, коды, состояния FSM и очередь"""
+    synthetic = User.telegram_id.between(SYNTHETIC_USER_BASE, SYNTHETIC_USER_BASE + users - 1)
+    result = await session.execute(select(User.family_id).where(synthetic).distinct())
+    family_ids = [family_id for family_id in result.scalars() if family_id is not None]
+
+    await session.execute(delete(Transaction).where(Transaction.family_id.in_(family_ids)))
+    await session.execute(delete(FamilyDailyTotal).where(FamilyDailyTotal.family_id.in_(family_ids)))
+    await session.execute(delete(InviteCode).where(InviteCode.family_id.in_(family_ids)))
+    await session.execute(delete(User).where(synthetic))
+    await session.execute(delete(Family).where(Family.id.in_(family_ids)))
+    await session.execute(delete(FsmState).where(FsmState.key.startswith(f"{bot_id}:")))
+    await session.execute(delete(OutboxMessage).where(OutboxMessage.chat_id.between(
+        SYNTHETIC_USER_BASE, SYNTHETIC_USER_BASE + users - 1
+    )))
+    await session.commit()
+
+
+async def run_user(
+    dp: Dispatcher,
+    bot: Bot,
+    factory: UpdateFactory,
+    telegram_id: int,
+    scenarios: list[str],
+    rounds: int,
+    series: dict[str, LatencySeries],
+):
+    """Сценарии одного пользователя по порядку (FSM требует последовательности)"""
+    for _ in range(rounds):
+        for name in scenarios:
+            for step, text in enumerate(SCENARIOS[name]):
+                label = name if step == 0 else f"{name}:reply"
+                update = factory.message(telegram_id, text)
+                started = time.perf_counter()
+                measured = series.setdefault(label, LatencySeries(label))
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception as e:
+                    measured.errors += 1
+                    logger.debug(f"{label} для {telegram_id}: {e}")
+                    continue
+                measured.add(time.perf_counter() - started)
+
+
+async def run_load_test(
+    users: int,
+    concurrency: int,
+    rounds: int,
+    scenarios: list[str],
+    api_latency: float,
+    outbox_rate: float,
+) -> tuple[list[dict], float, BotApiStub]:
+    """Прогнать users пользователей; вернуть строки отчета, общее время и заглушку (для счетчиков)"""
+    stub = BotApiStub(latency=api_latency)
+    await stub.start()
+
+    bot = Bot(
+        token=STUB_TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(stub.base_url)),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    dp = create_dispatcher()
+    # Как в боте: ответы уходят через очередь, в замер попадает только обработчик
+    outbox.bucket = TokenBucket(outbox_rate)
+    await outbox.start(bot)
+    factory = UpdateFactory(bot)
+    series: dict[str, LatencySeries] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(telegram_id: int):
+        async with semaphore:
+            await run_user(dp, bot, factory, telegram_id, scenarios, rounds, series)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(SYNTHETIC_USER_BASE + i) for i in range(users)))
+        wall_time = time.perf_counter() - started
+        await outbox.join()
+    finally:
+        await outbox.stop()
+        # Состояния FSM сбрасываются в БД до удаления синтетических строк
+        await dp.storage.close()
+        async with async_session_maker() as session:
+            await drop_synthetic_users(session, users, bot.id)
+        await bot.session.close()
+        await stub.stop()
+
+    total = LatencySeries("всего")
+    rows = []
+    for values in series.values():
+        total.values.extend(values.values)
+        total.errors += values.errors
+        rows.append(values.summary(wall_time))
+    rows.append(total.summary(wall_time))
+    return rows, wall_time, stub
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушкой Bot API")
+    parser.add_argument("--users", type=int, default=100, help="Синтетических пользователей")
+    parser.add_argument("--concurrency", type=int, default=20, help="Пользователей одновременно")
+    parser.add_argument("--rounds", type=int, default=1, help="Повторов сценариев на пользователя")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Задержка заглушки Bot API, секунды")
+    parser.add_argument(
+        "--outbox-rate", type=float, default=10000,
+        help="Лимит очереди ответов, msg/s (в боте - BROADCAST_RATE, общий с рассылкой)"
+    )
+    parser.add_argument(
+        "--scenarios", default=",".join(SCENARIOS),
+        help=f"Сценарии через запятую: {', '.join(SCENARIOS)}"
+    )
+    parser.add_argument("--force", action="store_true", help="Запустить на БД без bench/test в имени")
+    args = parser.parse_args()
+
+    error = check_bench_database(args.force)
+    if error:
+        parser.error(error)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    # Логи обработчиков на каждое обновление только мешают замеру
+    logging.getLogger().setLevel(logging.WARNING)
+
+    await init_db()
+    try:
+        rows, wall_time, stub = await run_load_test(
+            args.users, args.concurrency, args.rounds, scenarios, args.api_latency, args.outbox_rate
+        )
+    finally:
+        await close_db()
+
+    print(f"Пользователей: {args.users}, одновременно: {args.concurrency}, повторов: {args.rounds}, "
+          f"задержка Bot API: {args.api_latency * 1000:.0f} мс")
+    print(f"Время: {wall_time:.2f} с, вызовов Bot API: {dict(stub.calls)}")
+    print(render_table(rows))
+    print("Запросы к БД по обработчикам:")
+    for name, totals in sorted(handler_queries.items()):
+        calls = totals["calls"] or 1
+        print(f"  {name}: {totals['queries'] / calls:.1f} запросов/вызов, {totals['time'] / calls * 1000:.1f} мс/вызов")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
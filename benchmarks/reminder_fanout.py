@@ -0,0 +1,228 @@
+"""
+Бенчмарк рассылки напоминаний на N синтетических пользователях
+
+Создает N пользователей (по --family-size в семье) с отдельным слотом BENCH_SLOT,
+которого нет у настоящих пользователей, и прогоняет send_income_reminder и
+send_expense_reminder планировщика через StubBot - бот без сети с задержкой
+отправки и RetryAfter на каждый N-й вызов. Отчет: время, сообщений в секунду,
+пиковая RSS процесса и обращения к БД.
+
+Запуск только на отдельной БД (имя с bench/test):
+    DB_NAME=money_bot_bench python -m benchmarks.reminder_fanout --users 100000 --rate 100000 --concurrency 200
+"""
+import argparse
+import asyncio
+import logging
+import math
+import resource
+import time
+from dataclasses import dataclass
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.bot.broadcast import Broadcaster
+from backend.bot.scheduler import ReminderScheduler, STREAM_CHUNK_SIZE
+from backend.config import BROADCAST_RATE, BROADCAST_CONCURRENCY
+from backend.db.database import async_session_maker, init_db, close_db
+from backend.db.instrumentation import track_queries
+from benchmarks.database import check_bench_database
+
+logger = logging.getLogger(__name__)
+
+# Синтетические telegram_id (не пересекаются с load_test)
+SYNTHETIC_USER_BASE = 8_000_000_000
+
+# Слот вне диапазона минут суток - напоминания получают только синтетические пользователи
+BENCH_SLOT = -1
+
+# Сколько пользователей создавать одним оператором
+SEED_BATCH_SIZE = 50_000
+
+
+class StubBot:
+    """
+    Бот без сети для рассылки: send_message ждет latency секунд,
+    каждый retry_after_every-й вызов отвечает TelegramRetryAfter.
+    """
+
+    def __init__(self, latency: float = 0.0, retry_after_every: int = 0, retry_after: float = 1.0):
+        self.latency = latency
+        self.retry_after_every = retry_after_every
+        self.retry_after = retry_after
+        self.calls = 0
+        self.retries = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.retry_after_every and self.calls % self.retry_after_every == 0:
+            self.retries += 1
+            raise TelegramRetryAfter(
+                method=SendMessage(chat_id=chat_id, text=text),
+                message=f"Too Many Requests: retry after {self.retry_after}",
+                retry_after=self.retry_after,
+            )
+        return True
+
+
+@dataclass
+class FanoutResult:
+    """Замер одной рассылки"""
+    kind: str
+    sent: int
+    failed: int
+    retries: int
+    wall_time: float
+    statements: int
+    fetches: int
+    peak_rss_mb: float
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.wall_time if self.wall_time > 0 else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.kind}: отправлено {self.sent}, ошибок {self.failed}, повторов {self.retries}, "
+            f"{self.wall_time:.2f} с, {self.rate:.0f} msg/s, "
+            f"SQL-операторов {self.statements}, порций курсора ~{self.fetches}, "
+            f"пиковая RSS {self.peak_rss_mb:.0f} МБ"
+        )
+
+
+def peak_rss_mb() -> float:
+    """Пиковая RSS процесса (ru_maxrss в Linux - в килобайтах)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def seed_users(session: AsyncSession, users: int, family_size: int):
+    """
+    Создать users синтетических пользователей со слотом BENCH_SLOT, по family_size в семье.
+
+    Пачками по SEED_BATCH_SIZE: id семей выделяются nextval в CTE, семьи и
+    пользователи создаются одним оператором на пачку.
+    """
+    per_batch = max(1, SEED_BATCH_SIZE // family_size)
+    families = math.ceil(users / family_size)
+    for first in range(0, families, per_batch):
+        last = min(first + per_batch, families) - 1
+        await session.execute(
+            text("""
+                WITH numbered AS (
+                    SELECT g, nextval(pg_get_serial_sequence('families', 'id')) AS family_id
+                    FROM generate_series(CAST(:first AS BIGINT), :last) AS g
+                ), new_families AS (
+                    INSERT INTO families (id, name, current_balance, created_at, updated_at)
+                    SELECT family_id, 'Бенчмарк', g % 100000, NOW(), NOW() FROM numbered
+                )
+                INSERT INTO users (telegram_id, first_name, family_id, income_slot, expense_slot, created_at, updated_at)
+                SELECT :base + g * :family_size + k, 'Bench', family_id, :slot, :slot, NOW(), NOW()
+                FROM numbered CROSS JOIN generate_series(0, :family_size - 1) AS k
+                WHERE g * :family_size + k < :users
+            """),
+            {
+                "first": first, "last": last, "base": SYNTHETIC_USER_BASE,
+                "family_size": family_size, "slot": BENCH_SLOT, "users": users,
+            }
+        )
+        await session.commit()
+        logger.info(f"Создано семей: {last + 1}/{families}")
+
+
+async def drop_users(session: AsyncSession):
+    """Удалить синтетических пользователей и их семьи"""
+    await session.execute(
+        text("""
+            WITH gone AS (
+                DELETE FROM users WHERE telegram_id >= :base AND income_slot = :slot
+                RETURNING family_id
+            )
+            DELETE FROM families WHERE id IN (SELECT family_id FROM gone)
+        """),
+        {"base": SYNTHETIC_USER_BASE, "slot": BENCH_SLOT}
+    )
+    await session.commit()
+
+
+async def measure(kind: str, scheduler: ReminderScheduler, bot: StubBot) -> FanoutResult:
+    """Одна рассылка с замером времени, запросов к БД и памяти"""
+    send = scheduler.send_income_reminder if kind == "income" else scheduler.send_expense_reminder
+    retries_before = bot.retries
+
+    # Строки читает сама корутина рассылки - ее запросы попадают в track_queries
+    with track_queries(f"{kind}_reminder_benchmark") as queries:
+        started = time.perf_counter()
+        stats = await send(slot=BENCH_SLOT)
+        wall_time = time.perf_counter() - started
+
+    return FanoutResult(
+        kind=kind,
+        sent=stats.sent,
+        failed=stats.failed,
+        retries=bot.retries - retries_before,
+        wall_time=wall_time,
+        statements=queries.count,
+        # Серверный курсор дочитывает строки порциями без новых операторов
+        fetches=math.ceil(stats.total / STREAM_CHUNK_SIZE),
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк рассылки напоминаний")
+    parser.add_argument("--users", type=int, default=10_000, help="Синтетических пользователей")
+    parser.add_argument("--family-size", type=int, default=2, help="Пользователей в семье")
+    parser.add_argument("--latency", type=float, default=0.03, help="Задержка отправки, секунды")
+    parser.add_argument("--retry-after-every", type=int, default=0, help="RetryAfter на каждый N-й вызов (0 - нет)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Пауза RetryAfter, секунды")
+    parser.add_argument("--rate", type=float, default=BROADCAST_RATE, help="Лимит сообщений в секунду")
+    parser.add_argument("--concurrency", type=int, default=BROADCAST_CONCURRENCY, help="Воркеров рассылки")
+    parser.add_argument("--kinds", default="income,expense", help="Какие напоминания: income,expense")
+    parser.add_argument("--keep", action="store_true", help="Не удалять синтетических пользователей")
+    parser.add_argument("--no-seed", action="store_true", help="Пользователи уже созданы (--keep прошлого запуска)")
+    parser.add_argument("--force", action="store_true", help="Запустить на БД без bench/test в имени")
+    args = parser.parse_args()
+
+    error = check_bench_database(args.force)
+    if error:
+        parser.error(error)
+
+    kinds = [name.strip() for name in args.kinds.split(",") if name.strip()]
+    unknown = set(kinds) - {"income", "expense"}
+    if unknown:
+        parser.error(f"неизвестные напоминания: {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # Лог каждой рассылки мешает замеру
+    logging.getLogger("backend.bot.broadcast").setLevel(logging.WARNING)
+
+    await init_db()
+    try:
+        if not args.no_seed:
+            started = time.perf_counter()
+            async with async_session_maker() as session:
+                await drop_users(session)
+                await seed_users(session, args.users, args.family_size)
+            logger.info(f"Пользователи созданы за {time.perf_counter() - started:.1f} с")
+
+        bot = StubBot(args.latency, args.retry_after_every, args.retry_after)
+        scheduler = ReminderScheduler(bot)
+        scheduler.broadcaster = Broadcaster(bot, rate=args.rate, concurrency=args.concurrency)
+
+        print(f"Пользователей: {args.users}, лимит {args.rate:.0f} msg/s, воркеров {args.concurrency}, "
+              f"задержка {args.latency * 1000:.0f} мс, RSS до рассылки {peak_rss_mb():.0f} МБ")
+        for kind in kinds:
+            print(await measure(kind, scheduler, bot))
+    finally:
+        if not args.keep:
+            async with async_session_maker() as session:
+                await drop_users(session)
+        await close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
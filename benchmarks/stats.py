@@ -0,0 +1,48 @@
+"""
+Статистика замеров: перцентили и таблица результатов
+"""
+import math
+from dataclasses import dataclass, field
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Перцентиль p (0-100) по методу ближайшего ранга; sorted_values отсортирован"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+@dataclass
+class LatencySeries:
+    """Замеры одной операции (секунды)"""
+    name: str
+    values: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    def add(self, value: float):
+        self.values.append(value)
+
+    def summary(self, wall_time: float) -> dict:
+        values = sorted(self.values)
+        return {
+            "name": self.name,
+            "count": len(values),
+            "errors": self.errors,
+            "rps": len(values) / wall_time if wall_time > 0 else 0.0,
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1] if values else 0.0,
+        }
+
+
+def render_table(rows: list[dict]) -> str:
+    """Таблица результатов (задержки в миллисекундах)"""
+    lines = [f"{'операция':<18}{'кол-во':>9}{'ошибки':>8}{'rps':>10}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}"]
+    for row in rows:
+        lines.append(
+            f"{row['name']:<18}{row['count']:>9}{row['errors']:>8}{row['rps']:>10.1f}"
+            f"{row['p50'] * 1000:>10.1f}{row['p95'] * 1000:>10.1f}{row['p99'] * 1000:>10.1f}{row['max'] * 1000:>10.1f}"
+        )
+    return "\n".join(lines)
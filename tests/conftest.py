@@ -0,0 +1,55 @@
+"""
+Общие фикстуры: тестовая БД PostgreSQL для тестов, которым нужна настоящая база
+
+Используется та же БД, что и в test_smoke.py (money_bot_test, см. run_tests.sh),
+или TEST_DATABASE_URL. Фикстура удаляет все таблицы, поэтому работает только с БД,
+в имени которой есть "test". Если БД недоступна, такие тесты пропускаются.
+"""
+import os
+
+import pytest
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+
+from backend.config import DATABASE_URL
+from backend.db.database import Base
+from backend.db import models  # noqa: F401 - регистрирует модели для create_all
+from backend.db.partitions import ensure_default_partition
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL', DATABASE_URL.replace('money_bot', 'money_bot_test'))
+
+
+def check_test_database(url: str) -> str | None:
+    """Текст ошибки, если БД по url не похожа на тестовую (ее таблицы будут удалены)"""
+    name = make_url(url).database or ""
+    if "test" in name.lower():
+        return None
+    return f"БД {name} не похожа на тестовую: задай TEST_DATABASE_URL с БД, в имени которой есть test"
+
+
+@pytest.fixture
+async def db_session_maker():
+    """Фабрика сессий к пустой тестовой БД со всеми таблицами (удаляются после теста)"""
+    error = check_test_database(TEST_DATABASE_URL)
+    if error:
+        pytest.skip(error)
+
+    engine = create_async_engine(TEST_DATABASE_URL, echo=False)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+    except Exception as e:
+        await engine.dispose()
+        pytest.skip(f"Тестовая БД недоступна: {e}")
+
+    session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_maker() as session:
+        await ensure_default_partition(session)
+        await session.commit()
+
+    yield session_maker
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
@@ -0,0 +1,80 @@
+"""
+Тесты инструментов нагрузочного тестирования
+"""
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from backend.bot.broadcast import Broadcaster
+from benchmarks.bot_api_stub import BotApiStub
+from benchmarks.load_test import UpdateFactory, STUB_TOKEN, SYNTHETIC_USER_BASE
+from benchmarks.reminder_fanout import StubBot
+from benchmarks.stats import percentile, LatencySeries
+
+
+def test_percentile_nearest_rank():
+    """Тест перцентилей по ближайшему рангу"""
+    values = [float(i) for i in range(1, 101)]
+
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+    assert percentile(values, 100) == 100.0
+    assert percentile([0.3], 99) == 0.3
+    assert percentile([], 50) == 0.0
+
+
+def test_latency_series_summary():
+    """Тест сводки: rps считается по общему времени прогона"""
+    series = LatencySeries("start")
+    for value in (0.3, 0.1, 0.2, 0.4):
+        series.add(value)
+
+    summary = series.summary(wall_time=2.0)
+
+    assert summary["count"] == 4
+    assert summary["rps"] == 2.0
+    assert summary["p50"] == 0.2
+    assert summary["max"] == 0.4
+
+
+async def test_bot_api_stub_round_trip():
+    """Тест: бот отправляет сообщение в заглушку и получает Message"""
+    stub = BotApiStub()
+    await stub.start()
+    bot = Bot(STUB_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(stub.base_url)))
+    try:
+        message = await bot.send_message(42, "привет")
+    finally:
+        await bot.session.close()
+        await stub.stop()
+
+    assert message.chat.id == 42
+    assert message.text == "привет"
+    assert stub.calls["sendMessage"] == 1
+
+
+def test_update_factory_marks_commands():
+    """Тест: команда получает entity bot_command, ответ на вопрос - нет"""
+    factory = UpdateFactory(Bot(STUB_TOKEN))
+    telegram_id = SYNTHETIC_USER_BASE + 7
+
+    command = factory.message(telegram_id, "/income")
+    reply = factory.message(telegram_id, "1500")
+
+    assert command.message.entities[0].type == "bot_command"
+    assert command.message.from_user.id == telegram_id
+    assert reply.message.entities is None
+    assert reply.update_id == command.update_id + 1
+
+
+async def test_stub_bot_retry_after_goes_through_broadcaster():
+    """Тест: RetryAfter заглушки повторяется рассылкой, все сообщения доходят"""
+    bot = StubBot(retry_after_every=3, retry_after=0.05)
+    broadcaster = Broadcaster(bot, rate=1000, concurrency=2, chat_interval=0)
+
+    stats = await broadcaster.broadcast("bench", [{"chat_id": i, "text": "x"} for i in range(5)])
+
+    assert stats.sent == 5
+    assert stats.retries == bot.retries == 2
+    assert bot.calls == 7
@@ -0,0 +1,128 @@
+"""
+Тесты массовой рассылки
+"""
+import time
+from collections import OrderedDict
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+
+from backend.bot.broadcast import Broadcaster, TokenBucket
+
+
+class FakeBot:
+    """Бот-заглушка: запоминает отправленные сообщения"""
+
+    def __init__(self, retry_after_for: set[int] | None = None):
+        self.sent = []
+        self.retry_after_for = retry_after_for or set()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.retry_after_for:
+            self.retry_after_for.discard(chat_id)
+            raise TelegramRetryAfter(method=None, message="Flood control", retry_after=0.2)
+        self.sent.append(chat_id)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    """Тест, что bucket не выдает токенов быстрее rate после исчерпания запаса"""
+    bucket = TokenBucket(rate=50, capacity=5)
+    started = time.monotonic()
+    for _ in range(15):
+        await bucket.acquire()
+    # 5 токенов сразу, еще 10 - со скоростью 50/с
+    assert time.monotonic() - started >= 0.18
+
+
+@pytest.mark.asyncio
+async def test_broadcast_sends_all():
+    """Тест, что все сообщения отправлены и статистика посчитана"""
+    bot = FakeBot()
+    broadcaster = Broadcaster(bot, rate=1000, concurrency=10)
+
+    stats = await broadcaster.broadcast(
+        "test",
+        ({"chat_id": chat_id, "text": "hi"} for chat_id in range(100))
+    )
+
+    assert sorted(bot.sent) == list(range(100))
+    assert stats.total == 100
+    assert stats.sent == 100
+    assert stats.failed == 0
+    assert stats.finished_at is not None
+
+
+@pytest.mark.asyncio
+async def test_broadcast_retry_after_pauses_bucket():
+    """Тест, что RetryAfter ставит рассылку на паузу и сообщение отправляется повторно"""
+    bot = FakeBot(retry_after_for={3})
+    broadcaster = Broadcaster(bot, rate=1000, concurrency=4, chat_interval=0)
+
+    stats = await broadcaster.broadcast(
+        "test",
+        [{"chat_id": chat_id, "text": "hi"} for chat_id in range(10)]
+    )
+
+    assert sorted(bot.sent) == list(range(10))
+    assert stats.retries == 1
+    assert stats.duration >= 0.2
+
+
+@pytest.mark.asyncio
+async def test_broadcast_defers_failures_to_outbox():
+    """Тест, что сообщение с временной ошибкой уходит в очередь сообщений, а не теряется"""
+    from backend.bot.outbox import Outbox
+
+    class FlakyBot(FakeBot):
+        async def send_message(self, chat_id, text, **kwargs):
+            if chat_id == 3:
+                raise RuntimeError("connection reset")
+            await super().send_message(chat_id, text, **kwargs)
+
+    delivered = []
+
+    async def outbox_bot(method):
+        delivered.append(method.chat_id)
+
+    outbox = Outbox(workers=2, rate=1000, session_maker=None)
+    await outbox.start(outbox_bot)
+    broadcaster = Broadcaster(FlakyBot(), rate=1000, concurrency=4, chat_interval=0, outbox=outbox)
+
+    stats = await broadcaster.broadcast("test", [{"chat_id": chat_id, "text": "hi"} for chat_id in range(5)])
+    await outbox.join()
+    await outbox.stop()
+
+    assert stats.sent == 4
+    assert stats.deferred == 1
+    assert stats.failed == 0
+    assert delivered == [3]
+
+
+@pytest.mark.asyncio
+async def test_chat_interval_tracking_is_bounded():
+    """Тест, что время отправки хранится только для чатов с неистекшим интервалом"""
+    broadcaster = Broadcaster(FakeBot(), rate=1000, chat_interval=0.2)
+    chat_last_sent = OrderedDict()
+
+    for chat_id in range(100):
+        await broadcaster._wait_chat_interval(chat_id, chat_last_sent)
+    assert len(chat_last_sent) == 100
+
+    time.sleep(0.21)
+    await broadcaster._wait_chat_interval(100, chat_last_sent)
+    assert list(chat_last_sent) == [100]
+
+    # Повторная отправка в тот же чат все еще ждет интервал
+    started = time.monotonic()
+    await broadcaster._wait_chat_interval(100, chat_last_sent)
+    assert time.monotonic() - started >= 0.15
+
+
+def test_reminders_share_bucket_with_outbox():
+    """Тест, что рассылка напоминаний и очередь сообщений делят один лимит токена бота"""
+    from backend.bot.outbox import outbox
+    from backend.bot.scheduler import ReminderScheduler
+
+    scheduler = ReminderScheduler(FakeBot())
+    assert scheduler.broadcaster.bucket is outbox.bucket
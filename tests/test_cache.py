@@ -0,0 +1,44 @@
+"""
+Тесты кэша с TTL и вытеснением LRU
+"""
+import time
+
+from backend.bot.cache import TTLCache
+
+
+def test_cache_hit_and_miss():
+    """Тест подсчета попаданий и промахов"""
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set(1, "a")
+
+    assert cache.get(1) == "a"
+    assert cache.get(2) is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_cache_lru_eviction():
+    """Тест, что при переполнении вытесняется давно не использованная запись"""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)
+    cache.set(3, "c")
+
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+    assert cache.evictions == 1
+
+
+def test_cache_ttl_and_invalidate():
+    """Тест истечения TTL и явной инвалидации"""
+    cache = TTLCache(maxsize=10, ttl=0.05)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.invalidate(2)
+
+    assert cache.get(2) is None
+    time.sleep(0.06)
+    assert cache.get(1) is None
+    assert len(cache) == 0
@@ -0,0 +1,174 @@
+"""
+Тесты записи операций в PostgreSQL (нужна тестовая БД, см. conftest.py)
+"""
+import asyncio
+from decimal import Decimal
+
+from sqlalchemy import select, func, update
+
+from backend.db.ledger import record_transactions, merge_families, Entry
+from backend.db.models import Family, Transaction, TransactionType, FamilyDailyTotal, User
+
+
+async def create_family(session_maker, balance: Decimal = Decimal('0'), members: tuple[int, ...] = ()) -> int:
+    async with session_maker() as session:
+        family = Family(current_balance=balance)
+        session.add(family)
+        await session.flush()
+        session.add_all(User(telegram_id=telegram_id, family_id=family.id) for telegram_id in members)
+        await session.commit()
+        return family.id
+
+
+async def move_member(session_maker, telegram_id: int, family_id: int):
+    async with session_maker() as session:
+        await session.execute(update(User).where(User.telegram_id == telegram_id).values(family_id=family_id))
+        await session.commit()
+
+
+async def family_balance(session_maker, family_id: int) -> Decimal:
+    async with session_maker() as session:
+        result = await session.execute(select(Family.current_balance).where(Family.id == family_id))
+        return result.scalar_one()
+
+
+async def test_concurrent_record_transactions(db_session_maker):
+    """Тест: параллельные записи членов семьи не теряют друг друга"""
+    family_id = await create_family(db_session_maker, Decimal('100'), members=tuple(range(1, 21)))
+
+    async def record(telegram_id: int, entries: list[Entry]):
+        async with db_session_maker() as session:
+            await record_transactions(session, family_id, telegram_id, f"user{telegram_id}", entries)
+            await session.commit()
+
+    writes = [
+        record(telegram_id, [
+            Entry(TransactionType.INCOME, Decimal('10.50'), "зарплата"),
+            Entry(TransactionType.EXPENSE, Decimal('3.25'), "кофе"),
+        ])
+        for telegram_id in range(1, 21)
+    ]
+    await asyncio.gather(*writes)
+
+    assert await family_balance(db_session_maker, family_id) == Decimal('100') + 20 * Decimal('7.25')
+    async with db_session_maker() as session:
+        result = await session.execute(select(func.count()).select_from(Transaction))
+        assert result.scalar_one() == 40
+
+
+async def test_record_transactions_missing_family(db_session_maker):
+    """Тест: если семьи нет, ничего не записывается"""
+    async with db_session_maker() as session:
+        balance = await record_transactions(
+            session, 999, 1, "user", [Entry(TransactionType.EXPENSE, Decimal('5'), "хлеб")]
+        )
+        await session.commit()
+        result = await session.execute(select(func.count()).select_from(Transaction))
+
+        assert balance is None
+        assert result.scalar_one() == 0
+
+
+async def test_record_transactions_after_leaving_family(db_session_maker):
+    """Тест: запись по устаревшему family_id (пользователь уже в другой семье) не проходит"""
+    old_family_id = await create_family(db_session_maker, Decimal('10'), members=(1, 2))
+    new_family_id = await create_family(db_session_maker)
+    # Выход обработала другая реплика - в кэше этой все еще старая семья
+    await move_member(db_session_maker, 1, new_family_id)
+
+    async with db_session_maker() as session:
+        balance = await record_transactions(
+            session, old_family_id, 1, "user", [Entry(TransactionType.EXPENSE, Decimal('5'), "хлеб")]
+        )
+        await session.commit()
+        result = await session.execute(select(func.count()).select_from(Transaction))
+
+        assert balance is None
+        assert result.scalar_one() == 0
+    assert await family_balance(db_session_maker, old_family_id) == Decimal('10')
+
+
+async def test_merge_families_preserves_totals(db_session_maker):
+    """Тест: после слияния баланс, история и дневные итоги целиком в целевой семье"""
+    source_id = await create_family(db_session_maker, members=(1,))
+    target_id = await create_family(db_session_maker, members=(2,))
+
+    async with db_session_maker() as session:
+        await record_transactions(session, source_id, 1, "муж", [
+            Entry(TransactionType.INCOME, Decimal('1000'), "зарплата"),
+            Entry(TransactionType.EXPENSE, Decimal('150'), "продукты"),
+        ])
+        await record_transactions(session, target_id, 2, "жена", [
+            Entry(TransactionType.INCOME, Decimal('500'), "премия"),
+        ])
+        await session.commit()
+
+    # Тот же участник и день в обеих семьях - итоги складываются
+    await move_member(db_session_maker, 1, target_id)
+    async with db_session_maker() as session:
+        await record_transactions(session, target_id, 1, "муж", [
+            Entry(TransactionType.EXPENSE, Decimal('50'), "такси"),
+        ])
+        await session.commit()
+
+        balance = await merge_families(session, source_id, target_id)
+        await session.commit()
+
+        assert balance == Decimal('1300')
+        families = await session.execute(select(Family.id, Family.current_balance).order_by(Family.id))
+        assert families.all() == [(source_id, Decimal('0')), (target_id, Decimal('1300'))]
+
+        history = await session.execute(select(Transaction.family_id, func.count()).group_by(Transaction.family_id))
+        assert history.all() == [(target_id, 4)]
+
+        totals = await session.execute(
+            select(
+                FamilyDailyTotal.family_id,
+                FamilyDailyTotal.telegram_id,
+                FamilyDailyTotal.income_sum,
+                FamilyDailyTotal.expense_sum,
+                FamilyDailyTotal.tx_count,
+            ).order_by(FamilyDailyTotal.telegram_id)
+        )
+        assert totals.all() == [
+            (target_id, 1, Decimal('1000'), Decimal('200'), 3),
+            (target_id, 2, Decimal('500'), Decimal('0'), 1),
+        ]
+
+
+async def test_merge_families_missing_source(db_session_maker):
+    """Тест: слияние с несуществующей семьей ничего не меняет"""
+    target_id = await create_family(db_session_maker, Decimal('10'))
+    async with db_session_maker() as session:
+        assert await merge_families(session, 999, target_id) is None
+        await session.commit()
+    assert await family_balance(db_session_maker, target_id) == Decimal('10')
+
+
+async def test_merge_families_waits_for_concurrent_write(db_session_maker):
+    """Тест: запись в source, закоммиченная во время слияния, попадает и в историю, и в баланс target"""
+    source_id = await create_family(db_session_maker, members=(1,))
+    target_id = await create_family(db_session_maker, Decimal('10'))
+
+    async def merge():
+        async with db_session_maker() as session:
+            balance = await merge_families(session, source_id, target_id)
+            await session.commit()
+            return balance
+
+    async with db_session_maker() as writer:
+        # Запись держит строку source, слияние начинается до ее коммита
+        await record_transactions(writer, source_id, 1, "муж", [
+            Entry(TransactionType.INCOME, Decimal('100'), "зарплата"),
+        ])
+        merging = asyncio.create_task(merge())
+        await asyncio.sleep(0.2)
+        assert not merging.done()
+        await writer.commit()
+
+    assert await merging == Decimal('110')
+    assert await family_balance(db_session_maker, source_id) == Decimal('0')
+    assert await family_balance(db_session_maker, target_id) == Decimal('110')
+    async with db_session_maker() as session:
+        history = await session.execute(select(Transaction.family_id, func.count()).group_by(Transaction.family_id))
+        assert history.all() == [(target_id, 1)]
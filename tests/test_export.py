@@ -0,0 +1,49 @@
+"""
+Тесты записи выгрузки
+"""
+import io
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from backend.db.export import CsvWriter, XlsxWriter, EXPORT_HEADER
+from backend.db.models import TransactionType
+
+ROWS = [
+    (datetime(2026, 10, 1, 9, 30), TransactionType.INCOME, Decimal("5000.00"), "Зарплата", "Аня"),
+    (datetime(2026, 10, 2, 20, 0), TransactionType.EXPENSE, Decimal("350.50"), None, None),
+]
+
+
+def test_csv_writer():
+    """Тест CSV: BOM, заголовок, строки пачками, файл остается открытым"""
+    file = io.BytesIO()
+    writer = CsvWriter(file)
+    writer.write_rows(ROWS[:1])
+    writer.write_rows(ROWS[1:])
+    writer.close()
+
+    assert not file.closed
+    text = file.getvalue().decode('utf-8-sig')
+    assert text.splitlines() == [
+        ";".join(EXPORT_HEADER),
+        "2026-10-01 09:30:00;Пополнение;5000.00;Зарплата;Аня",
+        "2026-10-02 20:00:00;Расход;350.50;;",
+    ]
+
+
+def test_xlsx_writer():
+    """Тест XLSX: заголовок и строки читаются обратно"""
+    openpyxl = pytest.importorskip("openpyxl")
+
+    file = io.BytesIO()
+    writer = XlsxWriter(file)
+    writer.write_rows(ROWS)
+    writer.close()
+
+    file.seek(0)
+    sheet = openpyxl.load_workbook(file).active
+    rows = list(sheet.iter_rows(values_only=True))
+    assert rows[0] == EXPORT_HEADER
+    assert len(rows) == 3
@@ -0,0 +1,26 @@
+"""
+Тесты курсоров истории
+"""
+from datetime import datetime
+
+import pytest
+
+from backend.db.history import HistoryCursor
+
+
+def test_cursor_roundtrip():
+    """Тест, что курсор переживает кодирование в callback_data"""
+    cursor = HistoryCursor(created_at=datetime(2025, 12, 8, 20, 15, 30, 123456), id=42)
+
+    encoded = cursor.encode()
+
+    assert HistoryCursor.decode(encoded) == cursor
+    # callback_data в Telegram ограничена 64 байтами
+    assert len(f"hist:older:{encoded}".encode()) <= 64
+
+
+@pytest.mark.parametrize("value", ["", "abc", "1:2:3", "x:1"])
+def test_cursor_decode_invalid(value):
+    """Тест, что испорченный курсор отклоняется ValueError"""
+    with pytest.raises(ValueError):
+        HistoryCursor.decode(value)
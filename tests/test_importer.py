@@ -0,0 +1,101 @@
+"""
+Тесты разбора файла импорта (импорту в БД нужна тестовая БД, см. conftest.py)
+"""
+import io
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import text
+
+from backend.db.export import CsvWriter
+from backend.db.importer import (
+    read_import_rows, parse_import_row, import_transactions, ImportFormatError, ImportRow, MAX_IMPORT_ERRORS,
+)
+from backend.db.models import Family, TransactionType, User
+
+
+def test_read_import_rows():
+    """Тест разбора: тип словом или знаком суммы, запятая как разделитель"""
+    lines = [
+        "date,type,amount,description\n",
+        "2024-01-15,Расход,350,Продукты\n",
+        "\n",
+        "16.01.2024 09:30,,\"50 000,00\",Зарплата\n",
+        "2024-01-17,,-99.9\n",
+    ]
+    assert list(read_import_rows(lines)) == [
+        ImportRow(datetime(2024, 1, 15), TransactionType.EXPENSE, Decimal("350.00"), "Продукты", None),
+        ImportRow(datetime(2024, 1, 16, 9, 30), TransactionType.INCOME, Decimal("50000.00"), "Зарплата", None),
+        ImportRow(datetime(2024, 1, 17), TransactionType.EXPENSE, Decimal("99.90"), None, None),
+    ]
+
+
+def test_read_import_rows_errors():
+    """Тест, что ошибки копятся до конца файла и выводятся с номерами строк"""
+    lines = ["Дата;Тип;Сумма\n", "2024-01-15;Расход;350\n", "вчера;Расход;1\n", "2024-01-15;Подарок;1\n"]
+    rows = read_import_rows(lines)
+    assert next(rows).amount == Decimal("350.00")
+
+    with pytest.raises(ImportFormatError) as error:
+        list(rows)
+    assert error.value.total == 2
+    assert error.value.errors[0].startswith("Строка 3:")
+    assert error.value.errors[1].startswith("Строка 4:")
+
+
+@pytest.mark.parametrize("created_at", ["0001-01-01", "1999-12-31", "9999-12-31"])
+def test_parse_import_row_date_range(created_at):
+    """Тест, что даты вне допустимого диапазона отклоняются (иначе импорт создал бы тысячи секций)"""
+    with pytest.raises(ValueError, match="вне допустимого диапазона"):
+        parse_import_row([created_at, "Расход", "350"])
+
+
+def test_read_import_rows_error_limit():
+    """Тест, что пользователю показывается не больше MAX_IMPORT_ERRORS ошибок"""
+    lines = ["Дата;Тип;Сумма\n"] + ["2024-01-15;Расход;0\n"] * (MAX_IMPORT_ERRORS + 5)
+    with pytest.raises(ImportFormatError) as error:
+        list(read_import_rows(lines))
+    assert error.value.total == MAX_IMPORT_ERRORS + 5
+    assert len(error.value.errors) == MAX_IMPORT_ERRORS
+
+
+def test_export_round_trip():
+    """Тест, что файл /export импортируется обратно без изменений"""
+    exported = [
+        (datetime(2026, 10, 1, 9, 30), TransactionType.INCOME, Decimal("5000.00"), "Зарплата", "Аня"),
+        (datetime(2026, 10, 2, 20, 0), TransactionType.EXPENSE, Decimal("350.50"), None, None),
+    ]
+    file = io.BytesIO()
+    writer = CsvWriter(file)
+    writer.write_rows(exported)
+    writer.close()
+
+    lines = io.StringIO(file.getvalue().decode('utf-8-sig'), newline='')
+    assert [
+        (row.created_at, row.transaction_type, row.amount, row.description, row.user_name)
+        for row in read_import_rows(lines)
+    ] == exported
+
+
+async def test_import_creates_partitions_outside_import_transaction(db_session_maker):
+    """Тест: секции месяцев импорта создаются и коммитятся до записи, даже если импорт откатили"""
+    rows = [
+        ImportRow(datetime(2021, 3, 5, 12, 0), TransactionType.INCOME, Decimal("1000"), "зарплата", None),
+        ImportRow(datetime(2021, 4, 1, 9, 30), TransactionType.EXPENSE, Decimal("250.50"), "продукты", None),
+    ]
+    async with db_session_maker() as session:
+        family = Family(current_balance=0)
+        session.add(family)
+        await session.flush()
+        session.add(User(telegram_id=1, family_id=family.id))
+        await session.commit()
+
+        result = await import_transactions(session, family.id, 1, "user", iter(rows))
+        assert (result.count, result.balance) == (2, Decimal("749.50"))
+        await session.rollback()
+
+    async with db_session_maker() as session:
+        for name in ("transactions_y2021m03", "transactions_y2021m04"):
+            result = await session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+            assert result.scalar()
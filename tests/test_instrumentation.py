@@ -0,0 +1,74 @@
+"""
+Тесты учета SQL-запросов (на синхронном SQLite)
+"""
+import logging
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from backend.db import instrumentation
+from backend.db.instrumentation import (
+    instrument_engine,
+    track_queries,
+    query_budget,
+    QueryBudgetExceeded,
+    handler_queries,
+)
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_track_queries(engine):
+    """Тест, что запросы засчитываются текущему блоку и копятся по имени"""
+    handler_queries.pop("test_handler", None)
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))  # вне блока - не считается
+        with track_queries("test_handler") as stats:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+
+    assert stats.count == 2
+    assert stats.total_time > 0
+    assert handler_queries["test_handler"]["calls"] == 1
+    assert handler_queries["test_handler"]["queries"] == 2
+
+
+def test_failed_query_not_counted(engine):
+    """Тест, что упавший запрос не ломает учет следующих"""
+    with engine.connect() as conn, track_queries("test_failed") as stats:
+        with pytest.raises(Exception):
+            conn.execute(text("SELECT * FROM missing_table"))
+        conn.execute(text("SELECT 1"))
+
+    assert stats.count == 1
+
+
+def test_query_budget(engine):
+    """Тест бюджета запросов"""
+    with engine.connect() as conn:
+        with query_budget(2):
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+
+        with pytest.raises(QueryBudgetExceeded):
+            with query_budget(1, name="cmd_start"):
+                conn.execute(text("SELECT 1"))
+                conn.execute(text("SELECT 2"))
+
+
+def test_slow_query_log(engine, monkeypatch, caplog):
+    """Тест, что запрос дольше порога пишется в лог с именем обработчика"""
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_THRESHOLD", 0.0)
+
+    with caplog.at_level(logging.WARNING, logger="backend.db.instrumentation"):
+        with engine.connect() as conn, track_queries("cmd_history"):
+            conn.execute(text("SELECT   1"))
+
+    assert "в cmd_history: SELECT 1" in caplog.text
@@ -0,0 +1,49 @@
+"""
+Тесты кодов привязки в PostgreSQL (нужна тестовая БД, см. conftest.py)
+"""
+import asyncio
+from datetime import timedelta
+
+from backend.bot.invites import InviteStore
+
+
+async def test_invite_code_redeemed_once(db_session_maker):
+    """Тест: при параллельном погашении код срабатывает ровно один раз"""
+    store = InviteStore()
+    async with db_session_maker() as session:
+        code = await store.create(session, family_id=1, creator_id=100)
+        await session.commit()
+
+    async def redeem(telegram_id: int):
+        async with db_session_maker() as session:
+            invite = await store.consume(session, code, telegram_id, family_id=telegram_id)
+            await session.commit()
+            return invite
+
+    results = await asyncio.gather(*(redeem(telegram_id) for telegram_id in range(200, 210)))
+
+    redeemed = [invite for invite in results if invite is not None]
+    assert len(redeemed) == 1
+    assert redeemed[0].family_id == 1
+    async with db_session_maker() as session:
+        assert await store.get(session, code) is None
+
+
+async def test_invite_code_rejected_without_consuming(db_session_maker):
+    """Тест: свой код, код своей семьи и истекший код не гасятся"""
+    store = InviteStore()
+    expired_store = InviteStore(ttl=timedelta(seconds=-1))
+    async with db_session_maker() as session:
+        code = await store.create(session, family_id=1, creator_id=100)
+        expired = await expired_store.create(session, family_id=2, creator_id=101)
+        await session.commit()
+
+        assert await store.consume(session, code, telegram_id=100, family_id=5) is None
+        assert await store.consume(session, code, telegram_id=200, family_id=1) is None
+        assert await store.consume(session, expired, telegram_id=200, family_id=5) is None
+        assert await store.get(session, code) is not None
+
+        # Истекший код удаляется очисткой реплики, которая его создала
+        assert await expired_store.cleanup(session) == 1
+        await session.commit()
+        assert await store.get(session, expired) is None
@@ -0,0 +1,72 @@
+"""
+Тесты разбора сумм
+"""
+from decimal import Decimal
+
+import pytest
+
+from backend.db.ledger import parse_amount, parse_entries, signed_amount, Entry, MAX_ENTRIES
+from backend.db.models import TransactionType
+
+
+def test_parse_amount():
+    """Тест разбора суммы с запятой и округления до копеек"""
+    assert parse_amount("1500,50") == Decimal("1500.50")
+    assert parse_amount(" 350 ") == Decimal("350.00")
+    assert parse_amount("0.005") == Decimal("0.01")
+
+
+@pytest.mark.parametrize("text", ["abc", "", "nan", "inf", "1.2.3"])
+def test_parse_amount_invalid(text):
+    """Тест, что не-числа отклоняются ValueError"""
+    with pytest.raises(ValueError):
+        parse_amount(text)
+
+
+def test_signed_amount():
+    """Тест знака изменения баланса"""
+    assert signed_amount(TransactionType.INCOME, Decimal("10")) == Decimal("10")
+    assert signed_amount(TransactionType.EXPENSE, Decimal("10")) == Decimal("-10")
+
+
+def test_parse_entries():
+    """Тест разбора нескольких операций: знак задает тип, без знака - тип по умолчанию"""
+    entries = parse_entries("350 продукты\n\n1200,50 аренда\n+5000 зарплата\n-99", TransactionType.EXPENSE)
+    assert entries == [
+        Entry(TransactionType.EXPENSE, Decimal("350.00"), "продукты"),
+        Entry(TransactionType.EXPENSE, Decimal("1200.50"), "аренда"),
+        Entry(TransactionType.INCOME, Decimal("5000.00"), "зарплата"),
+        Entry(TransactionType.EXPENSE, Decimal("99.00"), ""),
+    ]
+
+
+@pytest.mark.parametrize("text, amount, description", [
+    ("350 2 пиццы", "350.00", "2 пиццы"),
+    ("500 5 кг картошки", "500.00", "5 кг картошки"),
+    ("1 500 аренда", "1500.00", "аренда"),
+    ("12\xa0345 678,50 ремонт", "12345678.50", "ремонт"),
+    ("1 5000 чек", "1.00", "5000 чек"),
+])
+def test_parse_entries_spaces_in_amount(text, amount, description):
+    """Тест, что пробел входит в сумму только как разделитель тысяч"""
+    assert parse_entries(text, TransactionType.EXPENSE) == [
+        Entry(TransactionType.EXPENSE, Decimal(amount), description)
+    ]
+
+
+def test_parse_entries_default_income():
+    """Тест, что в /income строки без знака - пополнения"""
+    assert parse_entries("5000", TransactionType.INCOME) == [Entry(TransactionType.INCOME, Decimal("5000.00"), "")]
+
+
+@pytest.mark.parametrize("text", ["", "продукты 350", "350\n0 ноль", "9999999999 много"])
+def test_parse_entries_invalid(text):
+    """Тест, что строка без суммы, ноль или огромная сумма отклоняются"""
+    with pytest.raises(ValueError):
+        parse_entries(text, TransactionType.EXPENSE)
+
+
+def test_parse_entries_limit():
+    """Тест ограничения числа операций в одном сообщении"""
+    with pytest.raises(ValueError):
+        parse_entries("\n".join(["1"] * (MAX_ENTRIES + 1)), TransactionType.EXPENSE)
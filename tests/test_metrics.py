@@ -0,0 +1,53 @@
+"""
+Тесты метрик Prometheus
+"""
+import pytest
+
+from backend.metrics import Registry
+
+
+def test_counter_and_gauge_render():
+    """Тест текстового формата счетчика и gauge с callback"""
+    registry = Registry()
+    updates = registry.counter("updates_total", "Обновления", ["type"])
+    registry.gauge("pool_in_use", "Соединения", callback=lambda: 3)
+
+    updates.inc(type="message")
+    updates.inc(2, type="message")
+    updates.inc(type='call"back')
+
+    assert registry.render() == (
+        "# HELP updates_total Обновления\n"
+        "# TYPE updates_total counter\n"
+        'updates_total{type="call\\"back"} 1\n'
+        'updates_total{type="message"} 3\n'
+        "# HELP pool_in_use Соединения\n"
+        "# TYPE pool_in_use gauge\n"
+        "pool_in_use 3\n"
+    )
+
+
+def test_histogram_buckets():
+    """Тест накопительных корзин гистограммы: граница включается (le)"""
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Время", ["handler"], buckets=(0.1, 1.0))
+
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, handler="cmd_start")
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{handler="cmd_start",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{handler="cmd_start",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{handler="cmd_start",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{handler="cmd_start"} 3.65' in lines
+    assert 'latency_seconds_count{handler="cmd_start"} 4' in lines
+
+
+def test_labels_required():
+    """Тест, что метки проверяются"""
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Время", ["handler"])
+    with pytest.raises(ValueError):
+        latency.observe(1.0)
+    with pytest.raises(ValueError):
+        registry.counter("latency_seconds", "Дубликат")
@@ -0,0 +1,53 @@
+"""
+Тесты ленивой сессии БД в middleware
+"""
+import pytest
+from aiogram.dispatcher.event.handler import HandlerObject
+
+from backend.bot.middlewares import session_middleware, session_usage
+
+
+async def handler_without_session(message):
+    return "ok"
+
+
+async def handler_with_unused_session(message, session):
+    return "ok"
+
+
+async def handler_with_session(message, session):
+    session.add_all([])
+    return "ok"
+
+
+async def call(callback):
+    handler_object = HandlerObject(callback=callback)
+    data = {'handler': handler_object}
+
+    async def handler(event, data):
+        return await handler_object.call(event, **data)
+
+    result = await session_middleware(handler, object(), data)
+    return result, data
+
+
+@pytest.mark.asyncio
+async def test_no_session_for_handler_without_argument():
+    """Тест, что обработчику без аргумента session сессия не передается"""
+    result, data = await call(handler_without_session)
+
+    assert result == "ok"
+    assert 'session' not in data
+
+
+@pytest.mark.asyncio
+async def test_session_created_only_on_use():
+    """Тест, что сессия создается только при первом обращении"""
+    _, data = await call(handler_with_unused_session)
+    assert not data['session'].used
+
+    _, data = await call(handler_with_session)
+    assert data['session'].used
+
+    assert session_usage["handler_with_unused_session"]["session_used"] == 0
+    assert session_usage["handler_with_session"]["session_used"] == 1
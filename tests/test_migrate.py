@@ -0,0 +1,20 @@
+"""
+Тесты реестра миграций
+"""
+from backend.db.migrate import MIGRATIONS, pending_migrations
+
+
+def test_registry_versions():
+    """Тест, что версии уникальны и идут по возрастанию"""
+    versions = [migration.version for migration in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+def test_pending_migrations():
+    """Тест, что долгие миграции на старте пропускаются, а командой применяются"""
+    all_versions = {migration.version for migration in MIGRATIONS}
+    slow = {migration.version for migration in MIGRATIONS if migration.slow}
+
+    assert pending_migrations(all_versions, include_slow=True) == []
+    assert {m.version for m in pending_migrations(set(), include_slow=False)} == all_versions - slow
+    assert {m.version for m in pending_migrations(all_versions - slow, include_slow=True)} == slow
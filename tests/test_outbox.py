@@ -0,0 +1,208 @@
+"""
+Тесты очереди исходящих сообщений
+"""
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramNetworkError
+from aiogram.methods import SendMessage
+from aiogram.types import Message
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from sqlalchemy import select, insert
+
+from backend.bot.outbox import Outbox, method_payload, backoff_delay
+from backend.db.models import OutboxMessage
+
+
+class FakeBot:
+    """Бот-заглушка: выполняет методы с небольшой случайной задержкой и запоминает их"""
+
+    def __init__(self, failures: dict[str, list[Exception]] | None = None):
+        self.sent: list[tuple[int, str]] = []
+        self.calls = 0
+        # text -> исключения, которые по очереди бросят попытки отправить этот текст
+        self.failures = failures or {}
+
+    async def __call__(self, method: SendMessage):
+        self.calls += 1
+        await asyncio.sleep(random.uniform(0, 0.005))
+        errors = self.failures.get(method.text)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((method.chat_id, method.text))
+
+
+def make_outbox(**kwargs) -> Outbox:
+    settings = dict(workers=4, rate=10000, retry_backoff=0.01, max_backoff=0.05, session_maker=None)
+    settings.update(kwargs)
+    return Outbox(**settings)
+
+
+async def test_outbox_keeps_order_within_chat():
+    """Тест: сообщения одного чата доставляются по порядку, хотя воркеров несколько"""
+    bot = FakeBot()
+    outbox = make_outbox()
+    await outbox.start(bot)
+
+    for number in range(20):
+        for chat_id in (1, 2, 3):
+            await outbox.send(chat_id, f"{chat_id}:{number}")
+    await outbox.join()
+    await outbox.stop()
+
+    for chat_id in (1, 2, 3):
+        texts = [text for chat, text in bot.sent if chat == chat_id]
+        assert texts == [f"{chat_id}:{number}" for number in range(20)]
+    assert outbox.pending == 0
+
+
+async def test_outbox_retries_with_backoff():
+    """Тест: сетевая ошибка и RetryAfter повторяются, порядок чата не нарушается"""
+    method = SendMessage(chat_id=1, text="first")
+    bot = FakeBot({
+        "first": [
+            TelegramNetworkError(method=method, message="timeout"),
+            TelegramRetryAfter(method=method, message="Flood control", retry_after=0.05),
+        ]
+    })
+    outbox = make_outbox()
+    await outbox.start(bot)
+
+    await outbox.send(1, "first")
+    await outbox.send(1, "second")
+    await outbox.join()
+    await outbox.stop()
+
+    assert bot.sent == [(1, "first"), (1, "second")]
+    assert bot.calls == 4
+
+
+async def test_outbox_gives_up_after_max_attempts():
+    """Тест: после max_attempts неудач сообщение отбрасывается, следующие доставляются"""
+    method = SendMessage(chat_id=1, text="broken")
+    bot = FakeBot({
+        "broken": [TelegramNetworkError(method=method, message="timeout") for _ in range(10)],
+        "blocked": [TelegramForbiddenError(method=method, message="bot was blocked by the user")],
+    })
+    outbox = make_outbox(max_attempts=3)
+    await outbox.start(bot)
+
+    await outbox.send(1, "broken")
+    await outbox.send(1, "after")
+    await outbox.send(2, "blocked")
+    await outbox.join()
+    await outbox.stop()
+
+    assert bot.sent == [(1, "after")]
+    # 3 попытки broken, 1 - after, 1 - blocked (без повторов)
+    assert bot.calls == 5
+
+
+async def test_reply_without_running_outbox_sends_directly():
+    """Тест: если очередь не запущена (тесты, скрипты), reply отправляет сразу"""
+    sent = []
+
+    class DirectBot(FakeBot):
+        async def __call__(self, method, request_timeout=None):
+            sent.append(method.text)
+
+    message = Message.model_validate(
+        {"message_id": 1, "date": 0, "chat": {"id": 5, "type": "private"}, "text": "/start"}
+    ).as_(DirectBot())
+
+    await make_outbox().reply(message, "привет")
+
+    assert sent == ["привет"]
+
+
+def test_method_payload_round_trip():
+    """Тест: сохраненный метод восстанавливается без значений по умолчанию бота"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="⬅️ Старее", callback_data="hist:older:abc")
+    message = Message.model_validate(
+        {"message_id": 1, "date": 0, "chat": {"id": 5, "type": "private"}, "text": "/history"}
+    )
+
+    payload = method_payload(message.answer("<b>История</b>", reply_markup=builder.as_markup()))
+    restored = SendMessage.model_validate(payload)
+
+    assert payload["chat_id"] == 5
+    assert "parse_mode" not in payload
+    assert json.loads(json.dumps(payload)) == payload
+    assert restored.reply_markup.inline_keyboard[0][0].callback_data == "hist:older:abc"
+
+
+def test_backoff_delay():
+    """Тест экспоненциальной задержки с потолком"""
+    assert [backoff_delay(n, 1.0, 5.0) for n in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+
+async def saved_messages(session_maker) -> list[tuple]:
+    async with session_maker() as session:
+        result = await session.execute(
+            select(OutboxMessage.chat_id, OutboxMessage.owner, OutboxMessage.attempts).order_by(OutboxMessage.id)
+        )
+        return result.all()
+
+
+async def test_outbox_persists_message_until_delivered(db_session_maker):
+    """Тест: durable-сообщение лежит в outbox_messages до доставки, ответ в БД не пишется"""
+    release = asyncio.Event()
+
+    class SlowBot(FakeBot):
+        async def __call__(self, method):
+            await release.wait()
+            await super().__call__(method)
+
+    bot = SlowBot()
+    outbox = make_outbox(session_maker=db_session_maker)
+    await outbox.start(bot)
+
+    await outbox.send(1, "hello", kind="income_reminder", durable=True)
+    await outbox.send(2, "reply")
+    assert await saved_messages(db_session_maker) == [(1, outbox.owner, 0)]
+
+    release.set()
+    await outbox.join()
+    assert sorted(bot.sent) == [(1, "hello"), (2, "reply")]
+    assert await saved_messages(db_session_maker) == []
+    await outbox.stop()
+
+
+async def test_outbox_releases_undelivered_on_stop(db_session_maker):
+    """Тест: при остановке недоставленное освобождается с числом попыток"""
+    method = SendMessage(chat_id=1, text="stuck")
+    bot = FakeBot({"stuck": [TelegramNetworkError(method=method, message="timeout") for _ in range(10)]})
+    outbox = make_outbox(session_maker=db_session_maker, retry_backoff=10, max_backoff=10)
+    await outbox.start(bot)
+
+    await outbox.send(1, "stuck")
+    await asyncio.sleep(0.05)
+    await outbox.stop(timeout=0.05)
+
+    assert await saved_messages(db_session_maker) == [(1, None, 1)]
+
+
+async def test_outbox_restores_messages_with_expired_lease(db_session_maker):
+    """Тест: сообщения упавшей реплики забираются после истечения аренды, живые - нет"""
+    now = datetime.utcnow()
+    async with db_session_maker() as session:
+        await session.execute(insert(OutboxMessage), [
+            {"chat_id": 1, "kind": "reply", "payload": {"chat_id": 1, "text": "orphan"},
+             "attempts": 2, "owner": "dead", "locked_until": now - timedelta(seconds=1)},
+            {"chat_id": 2, "kind": "reply", "payload": {"chat_id": 2, "text": "busy"},
+             "attempts": 0, "owner": "alive", "locked_until": now + timedelta(minutes=5)},
+        ])
+        await session.commit()
+
+    bot = FakeBot()
+    outbox = make_outbox(session_maker=db_session_maker)
+    await outbox.start(bot)
+    await asyncio.sleep(0.05)
+    await outbox.join()
+    await outbox.stop()
+
+    assert bot.sent == [(1, "orphan")]
+    assert await saved_messages(db_session_maker) == [(2, "alive", 0)]
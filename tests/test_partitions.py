@@ -0,0 +1,26 @@
+"""
+Тесты границ месячных секций
+"""
+from datetime import date
+
+from backend.db.partitions import add_months, month_range, partition_name
+
+
+def test_add_months():
+    """Тест перехода через конец года"""
+    assert add_months(date(2026, 10, 18), 0) == date(2026, 10, 1)
+    assert add_months(date(2026, 11, 30), 2) == date(2027, 1, 1)
+    assert add_months(date(2026, 1, 31), -1) == date(2025, 12, 1)
+
+
+def test_month_range():
+    """Тест, что в диапазон попадают все месяцы, пересекающиеся с днями"""
+    assert month_range(date(2026, 11, 15), date(2027, 1, 1)) == [
+        date(2026, 11, 1), date(2026, 12, 1), date(2027, 1, 1)
+    ]
+    assert month_range(date(2026, 10, 5), date(2026, 10, 6)) == [date(2026, 10, 1)]
+
+
+def test_partition_name():
+    """Тест имени секции"""
+    assert partition_name(date(2026, 3, 1)) == "transactions_y2026m03"
@@ -0,0 +1,65 @@
+"""
+Тесты периодов отчетов и дневных итогов (итогам нужна тестовая БД, см. conftest.py)
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select, func
+
+from backend.db.ledger import record_transactions, Entry
+from backend.db.models import Family, FamilyDailyTotal, TransactionType, User
+from backend.db.rollups import period_range, backfill_totals, get_period_totals
+
+
+@pytest.mark.parametrize("period, start", [
+    ("week", date(2026, 10, 12)),
+    ("month", date(2026, 10, 1)),
+    ("year", date(2026, 1, 1)),
+])
+def test_period_range(period, start):
+    """Тест границ периода: от начала периода до конца сегодняшнего дня"""
+    assert period_range(period, today=date(2026, 10, 18)) == (start, date(2026, 10, 19))
+
+
+def test_period_range_unknown():
+    """Тест, что неизвестный период отклоняется"""
+    with pytest.raises(ValueError):
+        period_range("decade", today=date(2026, 10, 18))
+
+
+async def test_totals_upsert_accumulates(db_session_maker):
+    """Тест: повторные записи за день прибавляются к одной строке итогов и совпадают с пересчетом"""
+    async with db_session_maker() as session:
+        family = Family(current_balance=0)
+        session.add(family)
+        await session.flush()
+        session.add(User(telegram_id=1, family_id=family.id))
+        await session.commit()
+
+        for amount in ("100", "20.50", "0.02"):
+            await record_transactions(session, family.id, 1, "user", [
+                Entry(TransactionType.INCOME, Decimal(amount), ""),
+                Entry(TransactionType.EXPENSE, Decimal(amount) / 2, ""),
+            ])
+        await session.commit()
+
+        result = await session.execute(
+            select(FamilyDailyTotal.income_sum, FamilyDailyTotal.expense_sum, FamilyDailyTotal.tx_count)
+        )
+        accumulated = result.all()
+        assert accumulated == [(Decimal('120.52'), Decimal('60.26'), 6)]
+
+        today = datetime.utcnow().date()
+        totals = await get_period_totals(session, family.id, *period_range("month", today))
+        assert (totals.income, totals.expense, totals.count) == (Decimal('120.52'), Decimal('60.26'), 6)
+
+        # Пересчет из transactions дает те же итоги
+        assert await backfill_totals(session, family.id) == 1
+        await session.commit()
+        result = await session.execute(
+            select(FamilyDailyTotal.income_sum, FamilyDailyTotal.expense_sum, FamilyDailyTotal.tx_count)
+        )
+        assert result.all() == accumulated
+        result = await session.execute(select(func.count()).select_from(FamilyDailyTotal))
+        assert result.scalar_one() == 1
@@ -0,0 +1,113 @@
+"""
+Тесты слотов напоминаний: перевод местного времени в минуту суток UTC
+"""
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import select
+
+from backend.db.models import User
+from backend.db.slots import (
+    parse_time, is_valid_timezone, reminder_slot, user_slots, current_slot, refresh_reminder_slots,
+)
+from backend.config import DAILY_INCOME_TIME, DAILY_EXPENSE_TIME, TIMEZONE
+
+WINTER = date(2024, 1, 15)
+SUMMER = date(2024, 7, 15)
+
+
+def test_parse_time():
+    """Тест разбора HH:MM"""
+    assert parse_time("09:05").hour == 9
+    assert parse_time(" 20:30 ").minute == 30
+    for value in ("9", "25:00", "ab:cd"):
+        with pytest.raises(ValueError):
+            parse_time(value)
+
+
+def test_is_valid_timezone():
+    """Тест проверки часового пояса"""
+    assert is_valid_timezone("Europe/Moscow")
+    assert not is_valid_timezone("Mars/Olympus")
+
+
+@pytest.mark.parametrize("local_time, timezone, on_date, slot", [
+    ("09:00", "UTC", WINTER, 9 * 60),
+    ("09:00", "Europe/Moscow", WINTER, 6 * 60),
+    ("09:00", "Europe/Moscow", SUMMER, 6 * 60),
+    # Нецелое смещение
+    ("09:00", "Asia/Kolkata", WINTER, 3 * 60 + 30),
+    # Переход через полночь назад и вперед
+    ("08:00", "Asia/Tokyo", WINTER, 23 * 60),
+    ("20:00", "America/Los_Angeles", WINTER, 4 * 60),
+    ("00:00", "UTC", WINTER, 0),
+    ("23:59", "UTC", WINTER, 1439),
+])
+def test_reminder_slot(local_time, timezone, on_date, slot):
+    """Тест слота для разных поясов"""
+    assert reminder_slot(local_time, timezone, on_date) == slot
+
+
+@pytest.mark.parametrize("timezone, winter_slot, summer_slot", [
+    ("Europe/Berlin", 19 * 60, 18 * 60),
+    ("America/New_York", 1 * 60, 0),
+    # Южное полушарие: летнее время зимой по календарю севера
+    ("Australia/Sydney", 9 * 60, 10 * 60),
+])
+def test_reminder_slot_dst(timezone, winter_slot, summer_slot):
+    """Тест: после перехода на летнее/зимнее время слот сдвигается на час"""
+    assert reminder_slot("20:00", timezone, WINTER) == winter_slot
+    assert reminder_slot("20:00", timezone, SUMMER) == summer_slot
+
+
+def test_reminder_slot_dst_transition_day():
+    """Тест: в день перехода смещение берется на эту дату, а не на момент расчета"""
+    # Европа переходит на летнее время в последнее воскресенье марта в 01:00 UTC
+    assert reminder_slot("20:00", "Europe/Berlin", date(2024, 3, 30)) == 19 * 60
+    assert reminder_slot("20:00", "Europe/Berlin", date(2024, 3, 31)) == 18 * 60
+
+
+def test_user_slots_defaults():
+    """Тест: пустые настройки пользователя берутся из конфига"""
+    assert user_slots(None, None, None) == (
+        reminder_slot(DAILY_INCOME_TIME, TIMEZONE),
+        reminder_slot(DAILY_EXPENSE_TIME, TIMEZONE),
+    )
+    assert user_slots("UTC", "07:15", "21:45") == (7 * 60 + 15, 21 * 60 + 45)
+
+
+def test_current_slot():
+    """Тест текущей минуты суток"""
+    assert current_slot(datetime(2024, 1, 1, 13, 37, 59)) == 13 * 60 + 37
+
+
+async def test_refresh_reminder_slots(db_session_maker):
+    """Тест: один UPDATE пересчитывает все группы и не трогает актуальные слоты"""
+    async with db_session_maker() as session:
+        session.add_all([
+            User(telegram_id=1),
+            User(telegram_id=2, timezone="UTC", income_time="07:15", expense_time="21:45"),
+            User(telegram_id=3, timezone="UTC", income_time="07:15", expense_time="21:45"),
+            User(telegram_id=4, timezone="Asia/Kolkata", income_slot=0, expense_slot=0),
+        ])
+        await session.commit()
+
+        assert await refresh_reminder_slots(session) == 4
+        # Повторный пересчет ничего не меняет
+        assert await refresh_reminder_slots(session) == 0
+
+        result = await session.execute(
+            select(User.telegram_id, User.income_slot, User.expense_slot).order_by(User.telegram_id)
+        )
+        assert result.all() == [
+            (1, *user_slots(None, None, None)),
+            (2, 7 * 60 + 15, 21 * 60 + 45),
+            (3, 7 * 60 + 15, 21 * 60 + 45),
+            (4, *user_slots("Asia/Kolkata", None, None)),
+        ]
+
+
+async def test_refresh_reminder_slots_empty(db_session_maker):
+    """Тест: без пользователей запрос не выполняется"""
+    async with db_session_maker() as session:
+        assert await refresh_reminder_slots(session) == 0
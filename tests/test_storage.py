@@ -0,0 +1,56 @@
+"""
+Тесты FSM-хранилища в PostgreSQL (нужна тестовая БД, см. conftest.py)
+"""
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import select
+
+from backend.bot.storage import PostgresStorage, storage_key
+from backend.db.models import FsmState
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+async def saved_record(session_maker):
+    async with session_maker() as session:
+        result = await session.execute(select(FsmState.state, FsmState.data).where(FsmState.key == storage_key(KEY)))
+        return result.first()
+
+
+async def test_cached_storage_writes_behind(db_session_maker):
+    """Тест: в режиме local запись сначала видна из памяти и попадает в БД при flush"""
+    storage = PostgresStorage(db_session_maker, flush_interval=60, cached=True)
+
+    await storage.set_state(KEY, "FinanceStates:waiting_for_income")
+    await storage.set_data(KEY, {"family_id": 7})
+
+    assert await storage.get_state(KEY) == "FinanceStates:waiting_for_income"
+    assert await storage.get_data(KEY) == {"family_id": 7}
+    assert await saved_record(db_session_maker) is None
+
+    await storage.flush()
+    assert tuple(await saved_record(db_session_maker)) == ("FinanceStates:waiting_for_income", {"family_id": 7})
+
+    # Пустая запись (диалог завершен) удаляется из таблицы
+    await storage.set_state(KEY, None)
+    await storage.set_data(KEY, {})
+    await storage.close()
+    assert await saved_record(db_session_maker) is None
+
+
+async def test_shared_storage_is_coherent_across_replicas(db_session_maker):
+    """Тест: в режиме shared вторая реплика сразу видит смену состояния первой"""
+    replica_a = PostgresStorage(db_session_maker, cached=False)
+    replica_b = PostgresStorage(db_session_maker, cached=False)
+
+    # Реплика B уже читала пустое состояние этого пользователя
+    assert await replica_b.get_state(KEY) is None
+
+    await replica_a.set_state(KEY, "FinanceStates:waiting_for_income")
+    assert await replica_b.get_state(KEY) == "FinanceStates:waiting_for_income"
+
+    await replica_b.set_state(KEY, None)
+    assert await replica_a.get_state(KEY) is None
+    assert await saved_record(db_session_maker) is None
+
+    await replica_a.close()
+    await replica_b.close()